@@ -35,6 +35,11 @@ import queue  # noqa
 import functools
 
 import logging
+
+from gateway_code import metrics
+from gateway_code.utils import jobs
+from gateway_code.utils.device_events import DEVICE_EVENTS
+
 LOGGER = logging.getLogger('gateway_code')
 
 # pylint: disable=C2801
@@ -44,7 +49,9 @@ def logger_call(msg, log_lvl='info', err_lvl='warning'):
     """ Decorator to wrap a function with logs
 
     Print a message before calling the function and an error message in case of
-    non zero return value.
+    non zero return value. The message is the current job stage.
+    Duration and failures are recorded in `metrics.REGISTRY`, labeled with the
+    function name and the 'TYPE' of the node it is called on.
 
     :param msg: message used in logs messages
     :param log_lvl: Logger level for info message
@@ -60,7 +67,15 @@ def logger_call(msg, log_lvl='info', err_lvl='warning'):
         def _wrapped_f(*args, **kwargs):
             """ Function wrapped with logs """
             log_msg(msg)
-            ret = func(*args, **kwargs)
+            jobs.set_stage(msg)
+            node_type = getattr(args[0], 'TYPE', '') if args else ''
+            t_start = time.monotonic()
+            ret = 1  # on exception
+            try:
+                ret = func(*args, **kwargs)
+            finally:
+                metrics.REGISTRY.observe(func.__qualname__, node_type,
+                                         time.monotonic() - t_start, ret)
             if ret:
                 log_err("%s FAILED: ret = %d", msg, ret)
             return ret
@@ -103,11 +118,15 @@ def wait_cond(timeout, value, fct, *args, **kwargs):
 # The embedded need some time to detect the tty
 # At least of 1.33 seconds has been (so ~ x2)
 TTY_DETECT_TIME = 3
+# A powered on node tty may disappear and reappear during the first 2 seconds
+TTY_STABLE_TIME = 2
+# Time without tty events after which it is considered stable
+TTY_SETTLE_TIME = 0.5
 
 
 def wait_tty(dev_tty, logger, timeout=TTY_DETECT_TIME):
     """ Wait that tty is present """
-    if wait_cond(timeout, True, os.path.exists, dev_tty):
+    if DEVICE_EVENTS.wait(dev_tty, True, timeout):
         return 0
     logger.error('Error Open Node tty not visible: %s', dev_tty)
     return 1
@@ -115,10 +134,24 @@ def wait_tty(dev_tty, logger, timeout=TTY_DETECT_TIME):
 
 def wait_no_tty(dev_tty, timeout=TTY_DETECT_TIME):
     """ Wait until `dev_tty` is not present """
-    ret = wait_cond(timeout, False, os.path.exists, dev_tty)
+    ret = DEVICE_EVENTS.wait(dev_tty, False, timeout)
     return 0 if ret else 1
 
 
+def wait_tty_stable(dev_tty, logger, settle_time=TTY_SETTLE_TIME,
+                    timeout=TTY_STABLE_TIME + TTY_DETECT_TIME):
+    """ Wait that tty is present and stable
+
+    Node may have been stopped and restarted just before, so its TTY can
+    disappear and reappear. Returns once it is present and no device event
+    happened during `settle_time`. """
+    if DEVICE_EVENTS.wait_stable(dev_tty, True, settle_time, timeout,
+                                 quiet=True):
+        return 0
+    logger.error('Error Open Node tty not visible: %s', dev_tty)
+    return 1
+
+
 def synchronous(tlockname):
     """A decorator to place an instance based lock around a method """
     def _wrap(func):
@@ -42,6 +42,9 @@ GATEWAY_CONFIG_PATH = os.environ.get('IOTLAB_GATEWAY_CFG_DIR',
                                      '/var/local/config/')
 GATEWAY_CONFIG_PATH = os.path.abspath(GATEWAY_CONFIG_PATH)
 
+# Volatile runtime directory, content lost on gateway reboot
+RUN_DIR = os.environ.get('IOTLAB_GATEWAY_RUN_DIR', None)
+
 IOTLAB_USERS = os.environ.get('IOTLAB_USERS_DIR', '/iotlab/users')
 EXP_FILES_DIR = os.path.join(IOTLAB_USERS, '{user}/.iot-lab/{exp_id}/')
 EXP_FILES = {
@@ -21,20 +21,24 @@
 
 """ Control Node experiment implementation """
 
+import os
 import time
 import logging
 
 import gateway_code.utils.ftdi_check
-from gateway_code.common import logger_call
+from gateway_code.common import booleanize, logger_call, wait_cond
 from gateway_code.nodes import ControlNodeBase
+from gateway_code.utils import firmware_state, measures_hub
 from gateway_code.utils.openocd import OpenOCD
+from gateway_code import config
 from gateway_code.config import static_path
-from . import cn_interface, cn_protocol
+from . import aggregation, cn_interface, cn_protocol, measures_buffer, sniffer
 
 
 LOGGER = logging.getLogger('gateway_code')
 
 
+# pylint:disable=too-many-instance-attributes
 class ControlNodeIotlab(ControlNodeBase):
     """ Control Node implemenation """
     TYPE = 'iotlab'
@@ -45,6 +49,8 @@ class ControlNodeIotlab(ControlNodeBase):
     OPENOCD_CFG_FILE = static_path('iot-lab.cfg')
     OPENOCD_OPTS = (static_path('iot-lab-cn.cfg'),)
     FW_CONTROL_NODE = static_path('control_node.elf')
+    # Upper bound of the control node firmware start time
+    READY_TIMEOUT = 2
     FEATURES = ['leds',
                 'open_node_power',
                 'open_node_gpio', 'open_node_i2c',
@@ -55,10 +61,26 @@ class ControlNodeIotlab(ControlNodeBase):
         self.default_profile = default_profile
 
         self.openocd = OpenOCD.from_node(self)
-        self.cn_serial = cn_interface.ControlNodeSerial(self.TTY)
-        self.protocol = cn_protocol.Protocol(self.cn_serial.send_command)
+        self.cn_serial = self._serial_class()(self.TTY)
+        self.protocol = cn_protocol.Protocol(self.cn_serial.send_command,
+                                             self.cn_serial.submit)
         self.open_node_state = 'stop'
         self.profile = self.default_profile
+        # Profile configured on the control node, None if unknown
+        self._configured = None
+        self.measures = measures_buffer.MeasuresBuffer()
+        self.aggregator = None
+        self.sniffer = None
+
+    @staticmethod
+    def _serial_class():
+        """ Control node serial interface class, from 'cn_serial_reader'
+        config: 'thread' (default) or 'asyncio' """
+        reader = config.read_config('cn_serial_reader', 'thread')
+        try:
+            return cn_interface.READERS[reader]
+        except KeyError:
+            raise ValueError(f'Invalid cn_serial_reader: {reader!r}')
 
     @property
     def programmer(self):
@@ -66,17 +88,102 @@ class ControlNodeIotlab(ControlNodeBase):
         return self.openocd
 
     @logger_call("Control node : Starting of control node serial interface")
-    def start(self, exp_id, exp_files=None):
-        """ Start ControlNode serial interface """
+    def start(self, exp_id, exp_files=None, profile=None):
+        """ Start ControlNode serial interface
+
+        Consumption measures aggregation of `profile` and sniffer pcapng
+        output are set here, as they change the serial interface OML
+        configuration """
         ret_val = 0
-        ret_val += self.reset()
+        # Readiness is checked through the serial interface, start it first
+        self._configured = None
+        ret_val += self.openocd.reset()
 
+        oml_files = self._start_aggregation(exp_id, exp_files, profile)
+        oml_files, ret = self._start_sniffer(oml_files, profile)
+        ret_val += ret
         oml_cfg = self.cn_serial.oml_xml_config(self.node_id, exp_id,
-                                                exp_files)
+                                                oml_files)
+        # Tee experiment measures to their consumers, the serial interface
+        # only prints them when there is one
+        consumption = (profile or self.default_profile).consumption
+        self.measures.set_consumption(
+            consumption.fields if consumption is not None else ())
+        self.measures.clear()
+        if oml_cfg is not None:
+            sinks = []
+            if self._live_measures():
+                self.cn_serial.measures_hub = measures_hub.HUB
+                sinks.append(self.measures)
+            if self.aggregator is not None:
+                sinks.append(self.aggregator)
+            self.cn_serial.measures_sinks = sinks
         ret_val += self.cn_serial.start(oml_cfg)
+        ret_val += self._wait_control_node_ready()
         ret_val += self.open_start('dc')
         return ret_val
 
+    @staticmethod
+    def _live_measures():
+        """ Live measures hub and window are used, if 'live_measures' is
+        configured or a hub subscriber already waits for measures """
+        enabled = booleanize(config.read_config('live_measures', False))
+        return enabled or measures_hub.HUB.subscribers > 0
+
+    def _start_aggregation(self, exp_id, exp_files, profile):
+        """ Create `profile` consumption measures aggregator
+
+        :return: experiment files written by the serial interface, without
+            the raw consumption one if not required """
+        consumption = (profile or self.default_profile).consumption
+        aggregate = (profile or self.default_profile).aggregate
+        if not exp_files or aggregate is None:
+            return exp_files
+        path = aggregation.aggregate_path(exp_files['consumption'])
+        LOGGER.info('Aggregate consumption measures in %s', path)
+        self.aggregator = aggregation.ConsumptionAggregator.open(
+            path, aggregate, self.node_id, exp_id, fields=consumption.fields)
+        if aggregate.raw:
+            return exp_files
+        return {name: path for name, path in exp_files.items()
+                if name != 'consumption'}
+
+    def _start_sniffer(self, exp_files, profile):
+        """ Write sniffer frames as pcapng instead of the OML file, if
+        'sniffer_pcapng' is configured and `profile` radio is in sniffer mode
+
+        A profile updated to sniffer mode during the experiment writes the
+        OML file, as a sniffer that could not start.
+
+        :return: experiment files written by the serial interface, with the
+            sniffer FIFO, and start return value """
+        radio = (profile or self.default_profile).radio
+        if radio is None or radio.mode != 'sniffer':
+            return exp_files, 0
+        enabled = booleanize(config.read_config('sniffer_pcapng', False))
+        if not enabled or not exp_files or 'sniffer' not in exp_files:
+            return exp_files, 0
+        port = config.read_config('sniffer_port', sniffer.PORT)
+        try:
+            port = int(port)
+        except ValueError:
+            LOGGER.error('Invalid sniffer_port: %r', port)
+            return exp_files, 1
+        path = os.path.splitext(exp_files['sniffer'])[0] + '.pcapng'
+        LOGGER.info('Write sniffer frames in %s', path)
+        self.sniffer = sniffer.Sniffer(path, exp_files['sniffer'], port=port)
+        ret = self.sniffer.start()
+        if ret:
+            self.sniffer = None
+            return exp_files, ret
+        return dict(exp_files, sniffer=self.sniffer.fifo), 0
+
+    def _stop_aggregation(self):
+        """ Write last aggregated measures, serial interface is stopped """
+        if self.aggregator is not None:
+            self.aggregator.close()
+            self.aggregator = None
+
     @logger_call("Control node: Setup")
     def setup(self):
         """Setup control node.
@@ -90,18 +197,29 @@ class ControlNodeIotlab(ControlNodeBase):
         """ Start ControlNode """
         ret_val = 0
         ret_val += self.open_stop('dc')
-        ret_val += self.cn_serial.stop()
+        # Reset while serial interface still runs to check readiness
         ret_val += self.reset()
+        ret_val += self.cn_serial.stop()
+        self._configured = None
+        self._stop_aggregation()
+        if self.sniffer is not None:
+            ret_val += self.sniffer.stop()
+            self.sniffer = None
         return ret_val
 
     @logger_call("Control node : Start experiment")
     def start_experiment(self, profile):
         """ Configure the experiment """
         ret_val = 0
-        ret_val += self.protocol.green_led_blink()
-        ret_val += self.protocol.set_time()
-        ret_val += self.protocol.set_node_id(self.node_id)
-        ret_val += self.configure_profile(profile)
+        with self.protocol.pipeline() as pipeline:
+            ret_val += self.protocol.green_led_blink()
+            ret_val += self.protocol.set_time()
+            ret_val += self.protocol.set_node_id(self.node_id)
+            ret_val += self.configure_profile(profile)
+        ret_val += pipeline.ret
+        # profile answers are only checked here, when leaving the pipeline
+        if pipeline.ret:
+            self._configured = None
         return ret_val
 
     @logger_call("Control node : stop of the experiment")
@@ -118,11 +236,13 @@ class ControlNodeIotlab(ControlNodeBase):
     def autotest_setup(self, measures_handler):
         """Setup node for autotests."""
         ret_val = 0
-        ret_val += self.reset()
+        self._configured = None
+        ret_val += self.openocd.reset()
 
         self.cn_serial.measures_debug = measures_handler
         self.cn_serial.start()
 
+        ret_val += self._wait_control_node_ready()
         ret_val += self.protocol.set_time()
         return ret_val
 
@@ -137,18 +257,52 @@ class ControlNodeIotlab(ControlNodeBase):
 
     @logger_call("Control node : profile configuration")
     def configure_profile(self, profile=None):
-        """ Configure the given profile on the control node """
+        """ Configure the given profile on the control node
+
+        Only the profile parts changed since the last configuration are sent,
+        an unchanged profile does nothing """
         LOGGER.info('Configure profile on Control Node')
         self.profile = profile or self.default_profile
+        changed = self.profile.diff(self._configured)
+        LOGGER.debug('Profile changes: %s', sorted(changed))
+        if (profile is not None and self._configured is not None and
+                'aggregate' in changed):
+            LOGGER.warning('Consumption aggregation is only set at '
+                           'experiment start, not updated')
         ret_val = 0
-        # power_mode (start|stop dc|batt)
-        ret_val += self.protocol.start_stop(self.open_node_state,
-                                            self.profile.power)
-        # Monitoring
-        ret_val += self.protocol.config_consumption(self.profile.consumption)
-        ret_val += self.protocol.config_radio(self.profile.radio)
+        with self.protocol.pipeline() as pipeline:
+            # power_mode (start|stop dc|batt)
+            if 'power' in changed:
+                ret_val += self.protocol.start_stop(self.open_node_state,
+                                                    self.profile.power)
+            # Monitoring
+            if 'consumption' in changed:
+                ret_val += self.protocol.config_consumption(
+                    self.profile.consumption)
+            if 'radio' in changed:
+                ret_val += self.protocol.config_radio(self.profile.radio)
+        ret_val += pipeline.ret
+        self._configured = self.profile if ret_val == 0 else None
         return ret_val
 
+    def _power_changed(self, power):
+        """ Open node `power` was set, forget configured profile if changed """
+        if self._configured is not None and self._configured.power != power:
+            self._configured = None
+
+    def measures_published(self):
+        """ Experiment measures are published to the live measures hub """
+        return self.cn_serial.measures_hub is not None
+
+    def measures_window(self, seconds=None):
+        """ Return the experiment last `seconds` consumption and radio
+        measures, `measures_buffer.WINDOW` if None
+
+        Measures are only kept with the 'live_measures' configuration """
+        if seconds is None:
+            seconds = measures_buffer.WINDOW
+        return self.measures.window(seconds)
+
     @logger_call("Control node : start power of open node")
     def open_start(self, power=None):
         """ Start open node with 'power' source """
@@ -156,6 +310,7 @@ class ControlNodeIotlab(ControlNodeBase):
         ret = self.protocol.start_stop('start', power)
         if ret == 0:
             self.open_node_state = 'start'
+            self._power_changed(power)
         return ret
 
     @logger_call("Control node : stop power of open node")
@@ -165,8 +320,10 @@ class ControlNodeIotlab(ControlNodeBase):
         ret = self.protocol.start_stop('stop', power)
         if ret == 0:
             self.open_node_state = 'stop'
+            self._power_changed(power)
         return ret
 
+    @firmware_state.tracked('FW_CONTROL_NODE')
     @logger_call("Control node : flash the open node")
     def flash(self, firmware_path=None, binary=False, offset=0):
         """ Flash the given firmware on Control Node
@@ -178,26 +335,38 @@ class ControlNodeIotlab(ControlNodeBase):
         """
         firmware_path = firmware_path or self.FW_CONTROL_NODE
         LOGGER.info('Flash firmware on Control Node %s', firmware_path)
+        self._configured = None
         ret = self.openocd.flash(firmware_path)
-        self._wait_control_node_ready()
+        ret += self._wait_control_node_ready()
         return ret
 
     @logger_call("Control node : reset")
     def reset(self):
         """ Reset the Control Node using jtag """
         LOGGER.info('Reset Control Node')
+        # monitoring configuration is lost
+        self._configured = None
         ret = self.openocd.reset()
-        self._wait_control_node_ready()
+        ret += self._wait_control_node_ready()
         return ret
 
-    @staticmethod
-    def _wait_control_node_ready():
+    def _wait_control_node_ready(self):
         """ Wait that the ControlNode firmware starts.
 
         It waits one second when starting, and may also trigger udev when
         restarting a node. This take a bit more than 1.1 second.
-        So wait 2 seconds to be safe.  """
-        time.sleep(2)
+
+        When the serial interface is running, wait until the control node
+        answers, else wait READY_TIMEOUT seconds to be safe. """
+        if self.cn_serial.process is None:
+            time.sleep(self.READY_TIMEOUT)
+            return 0
+        # Commands sent before the restart will not be answered
+        self.cn_serial.forget_timed_out()
+        if wait_cond(self.READY_TIMEOUT, 0, self.protocol.ping):
+            return 0
+        LOGGER.error('Control node not ready after %ss', self.READY_TIMEOUT)
+        return 1
 
     def status(self):
         """ Check Control node status """
@@ -0,0 +1,208 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Windowed aggregation of consumption measures
+
+Consumption measures debug lines are reduced on the gateway to statistics
+per time window, written as an OML text file next to the raw consumption
+one. Only one line per window is written instead of one per sample.
+Lines are written by a `QueuedWriter` thread, not by the serial interface
+reader.
+"""
+
+import os
+import math
+import time
+import logging
+
+from gateway_code import config
+from gateway_code.utils import measures_hub
+from gateway_code.utils.queued_writer import QueuedWriter
+
+LOGGER = logging.getLogger('gateway_code')
+
+# Written file buffer, to write windows to NFS by large blocks
+BUFFER_SIZE = 2 ** 16
+
+OML_HEADER = '''protocol: 5
+domain: {exp_id}
+start-time: {start_time}
+sender-id: {node_id}
+app-name: control_node_measures
+schema: 0 _experiment_metadata subject:string key:string value:string
+schema: 1 control_node_measures_consumption_aggregate {columns}
+content: text
+
+'''
+
+
+def aggregate_path(consumption_path):
+    """ Aggregated measures file path for the raw `consumption_path` one
+
+    >>> aggregate_path('/iotlab/user/123/consumption/m3-1.oml')
+    '/iotlab/user/123/consumption/m3-1.aggregate.oml'
+    """
+    return os.path.splitext(consumption_path)[0] + '.aggregate.oml'
+
+
+class ConsumptionAggregator:  # pylint:disable=too-many-instance-attributes
+    """ Write consumption measures `aggregate.stats` per `aggregate.window_ms`
+
+    Windows are aligned on the measures timestamps, a window is written when
+    a measure of the next one is received, or on `close`.
+    Only the profile enabled consumption `fields` are aggregated.
+
+    >>> import io
+    >>> from gateway_code.profile import Aggregate
+    >>> output = io.StringIO()
+    >>> aggregator = ConsumptionAggregator(
+    ...     output, Aggregate(100, ['min', 'max']), start_time=10)
+    >>> aggregator.add(10.12, (0.1, 3.3, 0.03))
+    >>> aggregator.add(10.18, (0.3, 3.3, 0.09))
+    >>> aggregator.add_line(b'measures_debug: consumption_measure '
+    ...                     b'10.210000:1.78250 0.200000 3.300000 0.060000')
+    >>> print(aggregator.columns)
+    timestamp_s:uint32 timestamp_us:uint32 count:uint32 power_min:double \
+power_max:double voltage_min:double voltage_max:double current_min:double \
+current_max:double
+    >>> aggregator.flush()
+    >>> first, second = output.getvalue().splitlines()
+    >>> first.split('\\t')[3:]
+    ['10', '100000', '2', '0.1', '0.3', '3.3', '3.3', '0.03', '0.09']
+    >>> second.split('\\t')[3:]
+    ['10', '200000', '1', '0.2', '0.2', '3.3', '3.3', '0.06', '0.06']
+    """
+    STREAM = b'consumption'
+    FIELDS = measures_hub.CONSUMPTION
+
+    def __init__(self, output, aggregate, start_time=None, *, fields=None):
+        self.output = output
+        self.aggregate = aggregate
+        self.fields = self.FIELDS if fields is None else tuple(fields)
+        self.window = aggregate.window_ms / 1000.0
+        self.start_time = int(time.time() if start_time is None
+                              else start_time)
+        self.columns = ' '.join(
+            ['timestamp_s:uint32', 'timestamp_us:uint32', 'count:uint32'] +
+            [f'{field}_{stat}:double' for field in self.fields
+             for stat in aggregate.stats])
+        # file written by `open`, and its header written with the first row
+        self.path = None
+        self.header = None
+        # invalid consumption measures lines
+        self.rejected = 0
+        self._seqno = 0
+        # current window
+        self._start = None
+        self._count = 0
+        self._min = None
+        self._max = None
+        self._sum = None
+
+    @classmethod
+    def open(cls, path, aggregate, node_id, exp_id, *, fields=None):
+        """ Create aggregator writing to user file `path` with its OML header
+
+        The file is removed on `close` if no measures were written """
+        config.create_user_file(path)
+        output = QueuedWriter(open(path, 'w', buffering=BUFFER_SIZE),
+                              name='consumption_aggregate')
+        aggregator = cls(output, aggregate, fields=fields)
+        aggregator.path = path
+        aggregator.header = OML_HEADER.format(
+            exp_id=exp_id, node_id=node_id, start_time=aggregator.start_time,
+            columns=aggregator.columns)
+        return aggregator
+
+    def add_line(self, line):
+        """ Aggregate consumption measures debug `line`, as bytes
+
+        Other measures are ignored, invalid consumption lines are counted in
+        `rejected` """
+        measure = measures_hub.parse_measure(line)
+        if measure is None or measure[0] != self.STREAM:
+            return
+        values = measures_hub.parse_values(measure[1])
+        measures = None
+        if values is not None:
+            measures = measures_hub.consumption_values(values[1:],
+                                                       self.fields)
+        if measures is None:
+            self.rejected += 1
+            return
+        self.add(values[0], measures)
+
+    def add(self, timestamp, values):
+        """ Add measure `values` at `timestamp`, in `FIELDS` order """
+        start = math.floor(timestamp / self.window) * self.window
+        if start != self._start:
+            self._write_window()
+            self._start = start
+            self._count = 1
+            self._min = list(values)
+            self._max = list(values)
+            self._sum = list(values)
+            return
+
+        self._count += 1
+        for index, value in enumerate(values):
+            self._sum[index] += value
+            if value < self._min[index]:
+                self._min[index] = value
+            elif value > self._max[index]:
+                self._max[index] = value
+
+    def flush(self):
+        """ Write the current window and flush output """
+        self._write_window()
+        self.output.flush()
+
+    def close(self):
+        """ Write the current window and close output """
+        self._write_window()
+        self.output.close()
+        if self.path is not None:
+            config.clean_user_file(self.path)
+        if self.rejected:
+            LOGGER.warning('Consumption aggregation: %d invalid measures '
+                           'lines rejected', self.rejected)
+
+    def _write_window(self):
+        """ Write current window statistics, if any """
+        if not self._count:
+            return
+        stats = {'min': self._min, 'max': self._max,
+                 'mean': [total / self._count for total in self._sum]}
+        values = [repr(stats[stat][index])
+                  for index in range(len(self.fields))
+                  for stat in self.aggregate.stats]
+        self._seqno += 1
+        seconds, micro = divmod(round(self._start * 1e6), 1000000)
+        if self.header is not None:
+            self.output.write(self.header)
+            self.header = None
+        row = '\t'.join(
+            [f'{self._start - self.start_time:.6f}', '1', str(self._seqno),
+             str(seconds), str(micro), str(self._count)] + values)
+        self.output.write(row + '\n')
+        self._start = None
+        self._count = 0
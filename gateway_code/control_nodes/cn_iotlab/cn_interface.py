@@ -22,18 +22,29 @@
 
 """ Interface with the `control node serial program`.
 
-Manage sending commands and receiving messages
+Manage sending commands and receiving messages.
+Several commands can be in flight, answers are matched to the oldest
+pending command with the same name. A timed out command stays pending for
+`LATE_ANSWER_DELAY`, so its late answer is not given to a newer one.
+
+Answers are read by a thread per interface, or by an asyncio protocol in an
+event loop shared by all interfaces, see `READERS`.
 """
 
+import time
 import queue
+import asyncio
 import threading
 import logging
 import atexit
+import functools
+import collections
 
 from subprocess import PIPE
 from tempfile import NamedTemporaryFile
 
 from gateway_code import common
+from gateway_code import metrics
 from gateway_code.utils import subprocess_timeout
 
 LOGGER = logging.getLogger('gateway_code')
@@ -41,40 +52,83 @@ LOGGER = logging.getLogger('gateway_code')
 
 CONTROL_NODE_SERIAL_INTERFACE = 'control_node_serial_interface'
 
+# Answers to a timed out command arriving in this delay are ignored
+LATE_ANSWER_DELAY = 5.0
+
 
 OML_XML = '''
 <omlc id='{node_id}' exp_id='{exp_id}'>
-  <collect url='file:{consumption}' encoding='text'>
-    <stream name="consumption" mp="consumption" samples='1' />
-  </collect>
-  <collect url='file:{radio}' encoding='text'>
-    <stream name="radio" mp="radio" samples='1' />
-  </collect>
-  <collect url='file:{event}' encoding='text'>
-    <stream name="event" mp="event" samples='1' />
-  </collect>
-  <collect url='file:{sniffer}' encoding='text'>
-    <stream name="sniffer" mp="sniffer" samples='1' />
+{collects}</omlc>
+'''
+OML_COLLECT = '''  <collect url='file:{path}' encoding='text'>
+    <stream name="{stream}" mp="{stream}" samples='1' />
   </collect>
-</omlc>
 '''
+# Streams written to the experiment files with the same name
+OML_STREAMS = ('consumption', 'radio', 'event', 'sniffer')
+
+
+class Request:  # pylint:disable=too-many-instance-attributes
+    """ Command sent to the control node interface, waiting its answer """
+
+    def __init__(self, command_args, on_timeout=None):
+        self.command_args = command_args
+        self.name = command_args[0]
+        self.answer = None
+        self.sent = time.monotonic()
+        self.rtt = None
+        # timed out, late answer ignored until this deadline
+        self.expires = None
+        self._on_timeout = on_timeout
+        self._answered = threading.Event()
+
+    def answered(self, answer):
+        """ Set command `answer`, None if it could not be sent """
+        if answer is not None:
+            self.rtt = time.monotonic() - self.sent
+        self.answer = answer
+        self._answered.set()
+
+    def wait(self, timeout=1.0):
+        """ Wait at max `timeout` for the answer
+
+        :return: received answer or `None` if timeout caught """
+        if not self._answered.wait(timeout) and self._on_timeout is not None:
+            self._on_timeout(self)
+        return self.answer
 
 
 class ControlNodeSerial:  # pylint:disable=too-many-instance-attributes
     """
     Class handling the communication with the control node serial program
     """
+    # Answer line first word: handler method name, others are command answers
+    HANDLERS = {
+        b'config_ack': '_config_ack',  # ack set_time/measures
+        b'error': '_cn_error',  # control node error
+        # debug messages
+        b'cn_serial_error:': '_cn_serial_error',  # control node serial error
+        b'measures_debug:': '_measures',  # measures output
+        b'cn_serial_ready': '_ready',  # cn_serial interface ready
+    }
 
     def __init__(self, tty):
         self.tty = tty
         self.process = None
         self.reader_thread = None
-        self.msgs = queue.Queue(1)
         self.measures_debug = None
+        self.measures_hub = None
+        # objects given each raw measures line to `add_line`
+        self.measures_sinks = []
 
         self._send_mutex = threading.Semaphore(1)
+        # command name: pending and timed out requests, in sending order
+        self._pending_lock = threading.Lock()
+        self._pending = collections.defaultdict(collections.deque)
         self._wait_ready = queue.Queue(1)
         self._oml_cfg_file = None
+        self._handlers = {word: getattr(self, name)
+                          for word, name in self.HANDLERS.items()}
 
         # cleanup in case of error
         atexit.register(self.stop)
@@ -85,12 +139,11 @@ class ControlNodeSerial:  # pylint:disable=too-many-instance-attributes
         Run `control node serial program` and handle its answers.
         """
         common.empty_queue(self._wait_ready)
+        self.forget_timed_out()  # answers from the previous process
 
         args = self._cn_interface_args(oml_xml_config)
         self.process = subprocess_timeout.Popen(args, stderr=PIPE, stdin=PIPE)
-
-        self.reader_thread = threading.Thread(target=self._reader)
-        self.reader_thread.start()
+        self._start_reader()
 
         ret = self._wait_ready.get()
         return ret
@@ -104,8 +157,9 @@ class ControlNodeSerial:  # pylint:disable=too-many-instance-attributes
         if self._oml_cfg_file is not None:
             args += ['-c', self._oml_cfg_file.name]
 
-        # Debug mode
-        if self.measures_debug is not None:
+        # Debug mode, measures are also printed for the hub and sinks
+        if (self.measures_debug is not None or
+                self.measures_hub is not None or self.measures_sinks):
             args += ['-d']
 
         return args
@@ -127,10 +181,16 @@ class ControlNodeSerial:  # pylint:disable=too-many-instance-attributes
 
     @staticmethod
     def oml_xml_config(node_id, exp_id, exp_files_dict=None):
-        """ Generate the oml xml configuration """
+        """ Generate the oml xml configuration
+
+        Streams without a file in `exp_files_dict` are not collected """
         if not exp_files_dict:
             return None
-        cfg = OML_XML.format(node_id=node_id, exp_id=exp_id, **exp_files_dict)
+        collects = ''.join(
+            OML_COLLECT.format(stream=stream, path=exp_files_dict[stream])
+            for stream in OML_STREAMS if stream in exp_files_dict)
+        cfg = OML_XML.format(node_id=node_id, exp_id=exp_id,
+                             collects=collects)
         return cfg.strip()
 
     def stop(self):
@@ -143,12 +203,13 @@ class ControlNodeSerial:  # pylint:disable=too-many-instance-attributes
         except OSError:
             LOGGER.error('Control node process already terminated')
 
-        if self.reader_thread is not None:
-            self.reader_thread.join()
+        self._join_reader()
 
-        # remove process after reader_thread is joined
+        # remove process after reader is joined
         self.process = None
         self.measures_debug = None
+        self.measures_hub = None
+        self.measures_sinks = []
 
         # cleanup oml
         if self._oml_cfg_file is not None:
@@ -173,33 +234,102 @@ class ControlNodeSerial:  # pylint:disable=too-many-instance-attributes
             pass  # None
 
     def _handle_answer(self, line):
-        """Handle control node answers
+        """Handle control node answers `line`, as bytes
 
           * For errors, print the message
           * For command answers, send it to command sender
         """
-        answer = line.split(' ')
-        if answer[0] == 'config_ack':  # ack set_time/measures
-            LOGGER.debug('config_ack %s', answer[1])
-            if answer[1] == 'set_time':
-                LOGGER.info('Control Node set time delay: %d us',
-                            int(1000000 * float(answer[2])))
-        elif answer[0] == 'error':  # control node error
-            LOGGER.error('Control node error: %r', answer[1])
+        handler = self._handlers.get(line.split(b' ', 1)[0])
+        if handler is None:  # control node answer to a command
+            self._command_answer(line.decode().split(' '))
+        else:
+            handler(line)
 
-        # debug messages
-        elif answer[0] == 'cn_serial_error:':  # control node serial error
-            LOGGER.error(line)
-        elif answer[0] == 'measures_debug:':  # measures output
-            self.measures_handler(line)
-        elif answer[0] == 'cn_serial_ready':  # cn_serial interface ready
-            self._wait_ready.put(0)
+    @staticmethod
+    def _config_ack(line):
+        """ Log set_time/measures configuration ack """
+        answer = line.decode().split(' ')
+        LOGGER.debug('config_ack %s', answer[1])
+        if answer[1] == 'set_time':
+            LOGGER.info('Control Node set time delay: %d us',
+                        int(1000000 * float(answer[2])))
 
-        else:  # control node answer to a command
-            try:
-                self.msgs.put_nowait(answer)
-            except queue.Full:
-                LOGGER.error('Control node answer queue full: %r', answer)
+    @staticmethod
+    def _cn_error(line):
+        """ Log control node error """
+        LOGGER.error('Control node error: %r', line.decode().split(' ')[1])
+
+    @staticmethod
+    def _cn_serial_error(line):
+        """ Log control node serial program error """
+        LOGGER.error(line.decode())
+
+    def _ready(self, _line):
+        """ Control node serial program is ready """
+        self._wait_ready.put(0)
+
+    def _measures(self, line):
+        """ Decode measures only if they are used """
+        for sink in self.measures_sinks:
+            sink.add_line(line)
+        hub = self.measures_hub
+        if hub is not None and not hub.subscribers:
+            hub = None
+        if self.measures_debug is None and hub is None:
+            return
+        line = line.decode()
+        if self.measures_debug is not None:
+            self.measures_handler(line)
+        if hub is not None:
+            hub.publish(line)
+
+    def _command_answer(self, answer):
+        """ Give `answer` to the oldest pending command with the same name
+
+        Answers to timed out commands are dropped """
+        name = answer[0]
+        now = time.monotonic()
+        with self._pending_lock:
+            pending = self._pending[name]
+            # answer not received in LATE_ANSWER_DELAY, command was lost
+            while pending and pending[0].expires is not None and \
+                    pending[0].expires < now:
+                pending.popleft()
+            if not pending:
+                LOGGER.error('Control node unexpected answer: %r', answer)
+                return
+            request = pending.popleft()
+        if request.expires is not None:
+            LOGGER.warning('Control node late answer ignored: %r', answer)
+            return
+
+        request.answered(answer)
+        LOGGER.debug('control_node_answer: %r %.3fs', answer, request.rtt)
+        metrics.REGISTRY.observe(f'ControlNodeSerial.{name}', '',
+                                 request.rtt, answer[-1] != 'ACK')
+
+    def _timed_out(self, request, late_answer=True):
+        """ Timed out `request` answer will be ignored
+
+        Without `late_answer`, the command is considered lost and removed """
+        with self._pending_lock:
+            if request not in self._pending[request.name]:
+                return  # answered meanwhile
+            if late_answer:
+                request.expires = time.monotonic() + LATE_ANSWER_DELAY
+            else:
+                self._pending[request.name].remove(request)
+        LOGGER.error('control_node_serial answer timeout')
+
+    def forget_timed_out(self):
+        """ Forget timed out commands, their answers will not come
+
+        To call when the control node restarted """
+        with self._pending_lock:
+            for pending in self._pending.values():
+                for request in [req for req in pending
+                                if req.expires is not None]:
+                    pending.remove(request)
 
     def measures_handler(self, line):
         """ Debug measures """
@@ -207,45 +337,166 @@ class ControlNodeSerial:  # pylint:disable=too-many-instance-attributes
         if self.measures_debug is not None:
             self.measures_debug(line)  # pylint:disable=not-callable
 
+    def _start_reader(self):
+        """ Start handling control node answers """
+        self.reader_thread = threading.Thread(target=self._reader)
+        self.reader_thread.start()
+
+    def _join_reader(self):
+        """ Wait answers handling end, after process was stopped """
+        if self.reader_thread is not None:
+            self.reader_thread.join()
+
     def _reader(self):
         """ Reader thread worker.
 
         Reads and handle control node answers
         """
         while self.process.poll() is None:
-            line = self.process.stderr.readline().decode()
-            if line == '':
+            line = self.process.stderr.readline()
+            if line == b'':
                 break
             self._handle_answer(line.strip())
         else:
             LOGGER.error('Control node serial reader thread ended prematurely')
             self._wait_ready.put(1)  # in case of failure at startup
 
-    def send_command(self, command_args):
-        """ Send given command to control node and wait for an answer
+    def submit(self, command_args, late_answer=True):
+        """ Send given command to control node without waiting its answer
 
         :param command_args: command arguments
         :type command_args: list of string
-        :return: received answers or `None` if timeout caught
+        :param late_answer: an answer may still come after a timeout, else
+            the command is considered lost
+        :return: `Request` to wait the answer from
         """
+        request = Request(command_args, functools.partial(
+            self._timed_out, late_answer=late_answer))
         command_str = ' '.join(command_args) + '\n'
-        answer_cn = None
+        with self._pending_lock:
+            self._pending[request.name].append(request)
         with self._send_mutex:
-            # remove existing items (old not treated answers)
-            common.empty_queue(self.msgs)
             try:
                 LOGGER.debug('control_node_cmd: %r', command_args)
                 self.process.stdin.write(command_str.encode())
                 self.process.stdin.flush()
-                # wait for answer 1 second at max
-                answer_cn = self.msgs.get(block=True, timeout=1.0)
-            except queue.Empty:
-                LOGGER.error('control_node_serial answer timeout')
+                return request
             except AttributeError:
                 LOGGER.error('control_node_serial stdin is None')
             except IOError:
                 LOGGER.error('control_node_serial process is terminated')
-            finally:
-                LOGGER.debug('control_node_answer: %r', answer_cn)
 
-        return answer_cn
+        with self._pending_lock:
+            self._pending[request.name].remove(request)
+        request.answered(None)
+        return request
+
+    def send_command(self, command_args, timeout=1.0, late_answer=True):
+        """ Send given command to control node and wait for an answer
+
+        :param command_args: command arguments
+        :type command_args: list of string
+        :param timeout: answer timeout in seconds
+        :param late_answer: see `submit`
+        :return: received answers or `None` if timeout caught
+        """
+        return self.submit(command_args, late_answer).wait(timeout)
+
+
+class _EventLoopThread:
+    """ asyncio event loop running in a daemon thread, started on first use """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+
+    @property
+    def loop(self):
+        """ Running event loop """
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True,
+                                 name='cn_serial_event_loop').start()
+                self._loop = loop
+        return self._loop
+
+    def run(self, coro):
+        """ Run `coro` in the event loop and return its result """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
+EVENT_LOOP = _EventLoopThread()
+
+
+class _LinesProtocol(asyncio.Protocol):
+    """ Split received data in lines, without decoding them """
+
+    def __init__(self, handle_line, connection_lost):
+        self._handle_line = handle_line
+        self._connection_lost = connection_lost
+        self._buffer = b''
+
+    def data_received(self, data):
+        end = data.rfind(b'\n')
+        if end < 0:
+            self._buffer += data
+            return
+        lines = (self._buffer + data[:end]).split(b'\n')
+        self._buffer = data[end + 1:]
+        for line in lines:
+            line = line.strip()
+            if line:
+                self._handle_line(line)
+
+    def connection_lost(self, exc):
+        if self._buffer.strip():
+            self._handle_line(self._buffer.strip())
+        self._connection_lost()
+
+
+class AsyncControlNodeSerial(ControlNodeSerial):
+    """ ControlNodeSerial reading answers in the shared asyncio event loop
+
+    Output is read by large chunks, split in lines as bytes and only decoded
+    when required. """
+
+    def __init__(self, tty):
+        super().__init__(tty)
+        self._transport = None
+        self._stopping = False
+        self._reader_done = threading.Event()
+
+    def _start_reader(self):
+        self._stopping = False
+        self._reader_done.clear()
+        self._transport, _ = EVENT_LOOP.run(EVENT_LOOP.loop.connect_read_pipe(
+            lambda: _LinesProtocol(self._handle_answer, self._reader_ended),
+            self.process.stderr))
+
+    def _reader_ended(self):
+        """ Process output closed """
+        if not self._stopping:
+            LOGGER.error('Control node serial reader ended prematurely')
+            try:
+                self._wait_ready.put_nowait(1)  # in case of failure at startup
+            except queue.Full:
+                pass
+        self._reader_done.set()
+
+    def stop(self):
+        self._stopping = True
+        return super().stop()
+
+    def _join_reader(self):
+        if self._transport is None:
+            return
+        self._reader_done.wait()
+        self._transport = None
+
+
+# Control node answers readers implementations
+READERS = {
+    'thread': ControlNodeSerial,
+    'asyncio': AsyncControlNodeSerial,
+}
@@ -22,20 +22,83 @@
 
 """ Protocol between python code and control_node_serial_interface C code """
 
+import threading
+import contextlib
+
+
+class Pipeline:  # pylint:disable=too-few-public-methods
+    """ Commands sent in a `Protocol.pipeline` block
+
+    `ret` is the sum of their return values once the block exited """
+
+    def __init__(self):
+        self.requests = []
+        self.ret = 0
+
 
 class Protocol:
-    """ Implements commands that can be sent to control node interface """
+    """ Implements commands that can be sent to control node interface
 
-    def __init__(self, sender):
+    :param sender: send a command and return its answer
+    :param submitter: send a command and return an object to `wait(timeout)`
+        its answer from, allows pipelining commands
+    """
+
+    def __init__(self, sender, submitter=None):
         self.sender = sender
+        self.submitter = submitter
+        self._local = threading.local()
+        # green led mode set by the gateway, 'green_led_on' when idle
+        self.green_led = 'green_led_on'
 
     def send_cmd(self, command_list):
-        """ Send a command to the control node and wait for it's answer.  """
-        command = command_list[0]
+        """ Send a command to the control node and wait for it's answer.
+
+        In a `pipeline` block, it does not wait and returns 0 """
+        pipeline = getattr(self._local, 'pipeline', None)
+        if pipeline is not None:
+            pipeline.requests.append((command_list[0],
+                                      self.submitter(command_list)))
+            return 0
         answer = self.sender(command_list)
+        return self._check_answer(command_list[0], answer)
+
+    @staticmethod
+    def _check_answer(command, answer):
+        """ Return 0 if `answer` acknowledges `command`
+
+        >>> Protocol._check_answer('start', ['start', 'ACK'])
+        0
+        >>> Protocol._check_answer('start', ['start', 'NACK'])
+        1
+        >>> Protocol._check_answer('start', None)
+        1
+        """
         answer_valid = ([command, 'ACK'] == answer)
         return 0 if answer_valid else 1   # 0 on success
 
+    @contextlib.contextmanager
+    def pipeline(self, timeout=1.0):
+        """ Send the block commands without waiting for their answers
+
+        Answers are checked when exiting the block, waiting at max `timeout`
+        for each one, and commands return values summed in `Pipeline.ret`.
+        Without `submitter` or in a pipeline block, commands are sent as usual.
+        """
+        pipeline = Pipeline()
+        if self.submitter is None or getattr(self._local, 'pipeline', None):
+            yield pipeline
+            return
+
+        self._local.pipeline = pipeline
+        try:
+            yield pipeline
+        finally:
+            self._local.pipeline = None
+            for command, request in pipeline.requests:
+                pipeline.ret += self._check_answer(command,
+                                                   request.wait(timeout))
+
     def start_stop(self, command, alim):
         """ Start/stop open node
 
@@ -87,14 +150,28 @@ class Protocol:
         cmd = ['set_node_id', archi, num]
         return self.send_cmd(cmd)
 
+    def ping(self, timeout=0.2):
+        """ Check that control node answers commands
+
+        There is no dedicated command, send the current green led mode again
+        so the led state is kept (or restored after a control node reset).
+        Pings sent while the control node boots are lost, their answers are
+        not expected after a timeout.
+        """
+        cmd = [self.green_led]
+        answer = self.sender(cmd, timeout=timeout, late_answer=False)
+        return 0 if [cmd[0], 'ACK'] == answer else 1
+
     def green_led_blink(self):
         """ Set green led in blinking mode """
         cmd = ['green_led_blink']
+        self.green_led = cmd[0]
         return self.send_cmd(cmd)
 
     def green_led_on(self):
         """ Set green led on """
         cmd = ['green_led_on']
+        self.green_led = cmd[0]
         return self.send_cmd(cmd)
 
     def config_consumption(self, consumption=None):
@@ -0,0 +1,182 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Ring buffers of the last control node measures
+
+Consumption and radio RSSI measures debug lines are parsed without decoding,
+with the measures hub parser, and kept in fixed size typed arrays, old
+samples being overwritten.
+Appending is O(1), samples are in timestamp order so a time range is found
+by bisection.
+"""
+
+import array
+import threading
+
+from gateway_code.utils import measures_hub
+
+# Samples kept per measure type, 10 seconds at the fastest consumption rate
+CAPACITY = 2 ** 16
+# Default query window in seconds
+WINDOW = 10.0
+
+
+class RingBuffer:
+    """ Last `capacity` samples of `fields`, the first one is the timestamp """
+
+    def __init__(self, fields, capacity=CAPACITY):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self.count = 0
+        self._next = 0  # next sample index
+        self._columns = [array.array('d', bytes(8 * capacity))
+                         for _ in self.fields]
+        self._lock = threading.Lock()
+
+    def append(self, *values):
+        """ Add a sample, `values` in `fields` order """
+        with self._lock:
+            for column, value in zip(self._columns, values):
+                column[self._next] = value
+            self._next = (self._next + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def clear(self):
+        """ Remove all samples """
+        with self._lock:
+            self.count = 0
+            self._next = 0
+
+    def latest(self):
+        """ Newest sample timestamp, None if empty """
+        with self._lock:
+            if not self.count:
+                return None
+            return self._columns[0][self._index(self.count - 1)]
+
+    def between(self, start=None, end=None):
+        """ Return samples with `start` <= timestamp < `end`
+
+        :return: dict of `fields` values lists """
+        with self._lock:
+            first = 0 if start is None else self._bisect(start)
+            last = self.count if end is None else self._bisect(end)
+            return {field: self._slice(column, first, last)
+                    for field, column in zip(self.fields, self._columns)}
+
+    def _index(self, position):
+        """ Array index of the sample at `position`, 0 being the oldest """
+        return (self._next - self.count + position) % self.capacity
+
+    def _bisect(self, timestamp):
+        """ Position of the first sample with timestamp >= `timestamp` """
+        timestamps = self._columns[0]
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if timestamps[self._index(mid)] < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _slice(self, column, first, last):
+        """ `column` values from `first` to `last` positions """
+        if last <= first:
+            return []
+        begin = self._index(first)
+        end = begin + last - first
+        if end <= self.capacity:
+            return column[begin:end].tolist()
+        return column[begin:].tolist() + column[:end - self.capacity].tolist()
+
+
+class MeasuresBuffer:
+    """ Consumption and radio RSSI ring buffers, filled from measures lines
+
+    Only the consumption measures enabled in the profile, set with
+    `set_consumption`, are kept.
+
+    >>> measures = MeasuresBuffer(capacity=4)
+    >>> measures.set_consumption(('power', 'voltage', 'current'))
+    >>> measures.add_line(b'measures_debug: radio_measure 10.5 11 -91')
+    >>> measures.add_line(b'measures_debug: radio_measure 12.0 11 -85')
+    >>> measures.add_line(b'measures_debug: consumption_measure '
+    ...                   b'11.841070:1.78250 0.000000 3.230000 0.080003')
+    >>> measures.add_line(b'measures_debug: unknown_measure 12.2 1')
+    >>> measures.window(1.0)['radio']
+    {'timestamp': [12.0], 'channel': [11.0], 'rssi': [-85.0]}
+    >>> measures.window(1.0)['consumption']['voltage']
+    [3.23]
+    """
+    CONSUMPTION = measures_hub.CONSUMPTION
+    RADIO = ('channel', 'rssi')
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.buffers = {}
+        self._by_stream = {}
+        self._add_buffer(b'consumption', self.CONSUMPTION)
+        self._add_buffer(b'radio', self.RADIO)
+
+    def _add_buffer(self, stream, fields):
+        """ Create `stream` measures buffer with `fields` values """
+        buffer = RingBuffer(('timestamp',) + tuple(fields), self.capacity)
+        self.buffers[stream.decode()] = buffer
+        self._by_stream[stream] = buffer
+
+    def set_consumption(self, fields):
+        """ Keep consumption measures enabled `fields`, samples are removed """
+        self._add_buffer(b'consumption', fields)
+
+    def add_line(self, line):
+        """ Store measures debug `line` values, as bytes
+
+        Other measures and lines with unexpected values are ignored """
+        measure = measures_hub.parse_line(line)
+        if measure is None:
+            return
+        stream, values = measure
+        buffer = self._by_stream.get(stream)
+        if buffer is None:
+            return
+        if stream == b'consumption':
+            measures = measures_hub.consumption_values(values[1:],
+                                                       buffer.fields[1:])
+            values = None if measures is None else values[:1] + measures
+        if values is not None and len(values) == len(buffer.fields):
+            buffer.append(*values)
+
+    def clear(self):
+        """ Remove all samples """
+        for buffer in self.buffers.values():
+            buffer.clear()
+
+    def window(self, seconds=WINDOW):
+        """ Return each buffer samples of the last `seconds` before its newest
+        sample """
+        window = {}
+        for name, buffer in self.buffers.items():
+            latest = buffer.latest()
+            start = None if latest is None else latest - seconds
+            window[name] = buffer.between(start)
+        return window
@@ -0,0 +1,388 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Radio sniffer frames written as pcapng
+
+The serial interface sniffer OML stream is written to a FIFO read here,
+instead of the experiment 'sniffer' OML file. Frames are written to a
+pcapng file, rotated by size, and sent live to TCP clients on the
+'sniffer_port' configuration port, `PORT` by default, so Wireshark can read
+them directly. The file is written by a `QueuedWriter`
+thread, and the FIFO is always read until its end, so the serial interface
+never waits for NFS nor gets a broken pipe.
+
+Frames use the IEEE 802.15.4 TAP link type, which carries channel, RSSI and
+LQI of each packet in TLVs before the frame.
+
+Columns are found by name in the OML schema: 'timestamp_s',
+'timestamp_us', 'channel', 'rssi', 'lqi', and the frame 'blob' column.
+Without this schema, the stream is copied to the experiment OML file.
+"""
+
+import os
+import queue
+import errno
+import struct
+import socket
+import shutil
+import logging
+import binascii
+import tempfile
+import threading
+
+from gateway_code import config
+from gateway_code.utils.queued_writer import QueuedWriter
+
+LOGGER = logging.getLogger('gateway_code')
+
+PORT = 30000
+# pcapng file size before rotation
+ROTATE_SIZE = 64 * 2 ** 20
+BUFFER_SIZE = 2 ** 16
+# Blocks queued per live client before it is dropped
+QUEUE_SIZE = 1024
+
+LINKTYPE_IEEE802_15_4_TAP = 283
+# Frames include their 16 bits FCS
+FCS_TYPE = 1
+
+SECTION_HEADER = (
+    # Section header block, version 1.0, unknown section length
+    struct.pack('<IIIHHqI', 0x0A0D0D0A, 28, 0x1A2B3C4D, 1, 0, -1, 28) +
+    # Interface description block, microseconds timestamps
+    struct.pack('<IIHHII', 1, 20, LINKTYPE_IEEE802_15_4_TAP, 0, 0, 20))
+
+# Enhanced packet block header, TAP header with TLVs: FCS type, RSS,
+# channel assignment and LQI
+_EPB = struct.Struct('<IIIIIII')
+_TAP = struct.Struct('<BBH' + 'HHB3x' + 'HHf' + 'HHHB1x' + 'HHB3x')
+_TAP_CHANNEL_PAGE = 0
+
+
+def packet_block(timestamp, frame, channel, rssi, lqi):
+    """ Return `frame` enhanced packet block, as a list of buffers
+
+    `frame` is not copied
+
+    >>> block = packet_block(1.5, b'\\x41\\x88', 11, -91.0, 255)
+    >>> [len(buf) for buf in block], sum(len(buf) for buf in block) % 4
+    ([64, 2, 6], 0)
+    """
+    data_len = _TAP.size + len(frame)
+    padding = -data_len % 4
+    total_len = _EPB.size + data_len + padding + 4
+    micro = int(round(timestamp * 1e6))
+    header = bytearray(_EPB.size + _TAP.size)
+    _EPB.pack_into(header, 0, 6, total_len, 0, micro >> 32,
+                   micro & 0xFFFFFFFF, data_len, data_len)
+    _TAP.pack_into(header, _EPB.size, 0, 0, _TAP.size,
+                   0, 1, FCS_TYPE,
+                   1, 4, rssi,
+                   3, 3, channel, _TAP_CHANNEL_PAGE,
+                   10, 1, lqi)
+    trailer = bytes(padding) + struct.pack('<I', total_len)
+    return [header, frame, trailer]
+
+
+class PcapngWriter:
+    """ Write packet blocks to user file `path`, rotated every `rotate_size`
+    bytes
+
+    The first file is created with the first block.
+    Next files are named '<name>.1.pcapng', '<name>.2.pcapng'... """
+
+    def __init__(self, path, rotate_size=ROTATE_SIZE):
+        self.path = path
+        self.rotate_size = rotate_size
+        self.files = 0
+        self.size = 0
+        self._file = None
+
+    def _open(self):
+        path = self.path
+        if self.files:
+            base, ext = os.path.splitext(self.path)
+            path = f'{base}.{self.files}{ext}'
+        self.files += 1
+        self._file = open(config.create_user_file(path, 'wb'), 'wb',
+                          buffering=BUFFER_SIZE)
+        self._file.write(SECTION_HEADER)
+        self.size = len(SECTION_HEADER)
+
+    def write(self, block):
+        """ Write `block` buffers """
+        size = sum(len(buf) for buf in block)
+        if self._file is None:
+            self._open()
+        elif self.size + size > self.rotate_size:
+            self._file.close()
+            self._open()
+        self._file.writelines(block)
+        self.size += size
+
+    def close(self):
+        """ Flush and close file """
+        if self._file is not None:
+            self._file.close()
+
+
+class LiveServer:
+    """ Send pcapng stream to TCP clients
+
+    Clients get the section header, then the blocks published after they
+    connected. A client too slow to read `QUEUE_SIZE` blocks is dropped. """
+
+    def __init__(self, port=PORT, host=''):
+        self.address = (host, port)
+        self.port = port
+        self._socket = None
+        self._clients = ()  # copy on write
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def clients(self):
+        """ Number of connected clients """
+        return len(self._clients)
+
+    def start(self):
+        """ Listen for clients, return 0 on success """
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(self.address)
+        except OSError as err:
+            LOGGER.error('Sniffer live server: %s', err)
+            sock.close()
+            return 1
+        sock.listen(4)
+        self.port = sock.getsockname()[1]
+        self._socket = sock
+        self._thread = threading.Thread(target=self._accept, daemon=True,
+                                        name='sniffer_server')
+        self._thread.start()
+        return 0
+
+    def stop(self):
+        """ Stop listening and disconnect clients """
+        if self._socket is None:
+            return
+        self._socket.shutdown(socket.SHUT_RDWR)
+        self._socket.close()
+        self._thread.join()
+        self._socket = None
+        for client in self._clients:
+            self._drop(client)
+
+    def publish(self, block):
+        """ Queue `block` buffers to all clients """
+        if not self._clients:
+            return
+        data = b''.join(block)
+        for client in self._clients:
+            try:
+                client.put_nowait(data)
+            except queue.Full:
+                LOGGER.warning('Sniffer live client too slow, dropped')
+                self._drop(client)
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            client = queue.Queue(QUEUE_SIZE)
+            client.put(SECTION_HEADER)
+            with self._lock:
+                self._clients += (client,)
+            threading.Thread(target=self._send, args=(conn, client),
+                             daemon=True, name='sniffer_client').start()
+
+    def _drop(self, client):
+        """ Remove `client` and stop its sender """
+        with self._lock:
+            self._clients = tuple(cli for cli in self._clients
+                                  if cli is not client)
+        try:
+            client.put_nowait(None)
+        except queue.Full:
+            client.get_nowait()
+            client.put_nowait(None)
+
+    def _send(self, conn, client):
+        with conn:
+            while True:
+                data = client.get()
+                if data is None:
+                    return
+                try:
+                    conn.sendall(data)
+                except OSError:
+                    self._drop(client)
+                    return
+
+
+class Sniffer:  # pylint:disable=too-many-instance-attributes
+    """ Read sniffer OML stream from `fifo`, write it to pcapng and live
+    clients
+
+    :param oml_path: OML file the stream is copied to, when it has no
+        sniffer schema """
+    COLUMNS = ('timestamp_s', 'timestamp_us', 'channel', 'rssi', 'lqi')
+
+    def __init__(self, pcap_path, oml_path=None, port=PORT,
+                 rotate_size=ROTATE_SIZE):
+        self.pcap_path = pcap_path
+        self.oml_path = oml_path
+        self.rotate_size = rotate_size
+        self.server = LiveServer(port)
+        self.frames = 0
+        # sniffer schema number and columns indexes, once read
+        self.columns = None
+        self.fifo = None
+        self._writer = None
+        self._oml_writer = None
+        self._thread = None
+
+    def start(self):
+        """ Start live server, create FIFO and start reading it
+
+        :return: 0 on success, live server errors are returned before
+            creating the FIFO """
+        ret = self.server.start()
+        if ret:
+            return ret
+        directory = tempfile.mkdtemp(prefix='sniffer')
+        self.fifo = os.path.join(directory, 'sniffer.oml')
+        os.mkfifo(self.fifo)
+        self._writer = QueuedWriter(
+            PcapngWriter(self.pcap_path, self.rotate_size),
+            name='sniffer_pcapng')
+        self._thread = threading.Thread(target=self._read, daemon=True,
+                                        name='sniffer_reader')
+        self._thread.start()
+        return 0
+
+    def stop(self):
+        """ Stop reading after FIFO writer closed it, close files """
+        if self._thread is None:
+            return 0
+        while self._thread.is_alive():
+            self._unblock_reader()
+            self._thread.join(0.1)
+        self._thread = None
+        self._writer.close()
+        if self._oml_writer is not None:
+            self._oml_writer.close()
+            self._oml_writer = None
+        self.server.stop()
+        shutil.rmtree(os.path.dirname(self.fifo))
+        LOGGER.info('Sniffer: %d frames written', self.frames)
+        return 0
+
+    def _unblock_reader(self):
+        """ Let reader open the FIFO if no writer ever did """
+        try:
+            os.close(os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError as err:
+            # no reader, it did not open FIFO yet or already returned
+            if err.errno != errno.ENXIO:
+                raise
+
+    def _read(self):
+        """ Read FIFO until its writer closes it
+
+        Without a sniffer schema, the stream is copied to `oml_path` """
+        with open(self.fifo, 'rb') as oml:
+            header = []
+            self.columns = self._read_header(oml, header)
+            if self.columns is None:
+                self._copy(oml, header)
+                return
+            for line in oml:
+                self.add_row(self.columns,
+                             line.rstrip(b'\n').split(b'\t'))
+
+    def _copy(self, oml, header):
+        """ Copy `header` lines and the rest of `oml` stream to `oml_path`,
+        or only read it if not possible """
+        if self.oml_path is not None and header:
+            try:
+                self._oml_writer = QueuedWriter(
+                    open(config.create_user_file(self.oml_path, 'wb'), 'wb',
+                         buffering=BUFFER_SIZE), name='sniffer_oml')
+            except OSError as err:
+                LOGGER.error('Sniffer: %s', err)
+            else:
+                LOGGER.info('Sniffer: OML stream written to %s',
+                            self.oml_path)
+                self._oml_writer.write(b''.join(header))
+        while True:
+            data = oml.read(BUFFER_SIZE)
+            if not data:
+                return
+            if self._oml_writer is not None:
+                self._oml_writer.write(data)
+
+    def _read_header(self, oml, header):
+        """ Return OML sniffer schema number and columns indexes
+
+        Header lines are appended to `header` """
+        schema = None
+        for line in oml:
+            header.append(line)
+            line = line.strip()
+            if not line:
+                break
+            key, _, value = line.decode(errors='replace').partition(': ')
+            if key != 'schema':
+                continue
+            number, _, *columns = value.split()
+            names = [column.split(':', 1)[0] for column in columns]
+            blobs = [index for index, column in enumerate(columns)
+                     if column.endswith(':blob')]
+            if blobs and all(name in names for name in self.COLUMNS):
+                # values are after oml_ts, schema and seqno
+                schema = (number.encode(), blobs[0] + 3,
+                          [names.index(name) + 3 for name in self.COLUMNS])
+        if schema is None:
+            LOGGER.error('Sniffer: no sniffer OML schema')
+        return schema
+
+    def add_row(self, columns, fields):
+        """ Write OML row `fields` frame, other schemas rows are ignored """
+        number, frame_index, indexes = columns
+        if len(fields) < 2 or fields[1] != number:
+            return
+        try:
+            seconds, micro, channel, rssi, lqi = (
+                fields[index] for index in indexes)
+            frame = binascii.a2b_base64(fields[frame_index])
+            block = packet_block(int(seconds) + int(micro) * 1e-6, frame,
+                                 int(channel), float(rssi), int(lqi))
+        except (ValueError, IndexError, binascii.Error):
+            LOGGER.debug('Sniffer: invalid row %r', fields)
+            return
+        self._writer.write(block)
+        self.server.publish(block)
+        self.frames += 1
@@ -27,6 +27,7 @@
 # pylint: disable=maybe-no-member
 # pylint: disable=too-many-public-methods
 
+import os
 import queue
 
 import unittest
@@ -147,7 +148,7 @@ class TestControlNodeSerial(unittest.TestCase):
         ret = self.cn.send_command(['lala'])
         self.assertIsNone(ret)
 
-    def test_answer_and_answer_with_queue_full(self):
+    def test_unexpected_answers(self):
         # get two answers without sending command
         self.readline_ret_vals.put(b'set ACK\n')
         self.readline_ret_vals.put(b'start ACK\n')
@@ -156,13 +157,81 @@ class TestControlNodeSerial(unittest.TestCase):
         self.cn.stop()
 
         self.log_error.check(
-            (
-                'gateway_code',
-                'ERROR',
-                f'Control node answer queue full: {["start", "ACK"]}'
-            )
+            ('gateway_code', 'ERROR',
+             f'Control node unexpected answer: {["set", "ACK"]}'),
+            ('gateway_code', 'ERROR',
+             f'Control node unexpected answer: {["start", "ACK"]}'),
         )
 
+    def test_pipelined_commands(self):
+        """ Answers are matched by command name, in order """
+        self.cn.start()
+        start = self.cn.submit(['start', 'dc'])
+        set_time = self.cn.submit(['set_time'])
+        stop = self.cn.submit(['start', 'battery'])
+        self.assertEqual(3, self.popen.stdin.write.call_count)
+
+        self.readline_ret_vals.put(b'set_time ACK\n')
+        self.readline_ret_vals.put(b'start ACK\n')
+        self.readline_ret_vals.put(b'start NACK\n')
+        self.assertEqual(['start', 'ACK'], start.wait(1))
+        self.assertEqual(['set_time', 'ACK'], set_time.wait(1))
+        self.assertEqual(['start', 'NACK'], stop.wait(1))
+        self.assertGreaterEqual(start.rtt, 0)
+        self.cn.stop()
+
+    def test_late_answer(self):
+        """ Late answer is not given to the next same command """
+        self.cn.start()
+        self.assertIsNone(self.cn.send_command(['start', 'dc'], timeout=0))
+
+        request = self.cn.submit(['start', 'dc'])
+        self.readline_ret_vals.put(b'start ACK\n')  # late
+        self.assertIsNone(request.wait(0.1))
+        self.readline_ret_vals.put(b'start ACK\n')
+        self.assertIsNone(request.wait(0.1))  # timed out before
+
+        request = self.cn.submit(['start', 'dc'])
+        self.readline_ret_vals.put(b'start ACK\n')
+        self.assertEqual(['start', 'ACK'], request.wait(1))
+        self.cn.stop()
+        self.log_error.check(
+            ('gateway_code', 'ERROR', 'control_node_serial answer timeout'),
+            ('gateway_code', 'WARNING',
+             f'Control node late answer ignored: {["start", "ACK"]}'),
+            ('gateway_code', 'ERROR', 'control_node_serial answer timeout'),
+            ('gateway_code', 'WARNING',
+             f'Control node late answer ignored: {["start", "ACK"]}'),
+        )
+
+    def test_lost_command(self):
+        """ Command without late answer does not take the next answer """
+        self.cn.start()
+        self.assertIsNone(self.cn.send_command(['green_led_on'], timeout=0,
+                                               late_answer=False))
+        request = self.cn.submit(['green_led_on'])
+        self.readline_ret_vals.put(b'green_led_on ACK\n')
+        self.assertEqual(['green_led_on', 'ACK'], request.wait(1))
+        self.cn.stop()
+
+    def test_forget_timed_out(self):
+        """ Timed out commands are forgotten after a control node restart,
+        or once their late answer delay passed """
+        self.cn.start()
+        self.assertIsNone(self.cn.send_command(['start', 'dc'], timeout=0))
+        self.cn.forget_timed_out()
+        request = self.cn.submit(['start', 'dc'])
+        self.readline_ret_vals.put(b'start ACK\n')
+        self.assertEqual(['start', 'ACK'], request.wait(1))
+
+        with mock.patch.object(cn_interface, 'LATE_ANSWER_DELAY', 0):
+            self.assertIsNone(self.cn.send_command(['start', 'dc'],
+                                                   timeout=0))
+        request = self.cn.submit(['start', 'dc'])
+        self.readline_ret_vals.put(b'start ACK\n')
+        self.assertEqual(['start', 'ACK'], request.wait(1))
+        self.cn.stop()
+
 # _cn_interface_args
 
     def test__cn_interface_args(self):
@@ -183,6 +252,14 @@ class TestControlNodeSerial(unittest.TestCase):
         self.assertNotIn('-c', args)
         self.assertIn('-d', args)
 
+        # Measures hub
+        self.cn.measures_debug = None
+        self.cn.measures_hub = mock.Mock()
+        self.assertIn('-d', self.cn._cn_interface_args())
+        self.cn.measures_hub = None
+        self.cn.measures_sinks = [mock.Mock()]
+        self.assertIn('-d', self.cn._cn_interface_args())
+
 # _config_oml coverage tests
 
     def test_empty_config_oml(self):
@@ -210,6 +287,15 @@ class TestControlNodeSerial(unittest.TestCase):
         oml_xml_cfg = self.cn.oml_xml_config('m3-1', '1234', exp_files)
         self.assertIsNotNone(oml_xml_cfg)
         self.assertTrue(oml_xml_cfg.startswith('<omlc'))
+        self.assertTrue(oml_xml_cfg.endswith('</omlc>'))
+        self.assertEqual(4, oml_xml_cfg.count('<collect '))
+        self.assertIn("url='file:/tmp/consumption'", oml_xml_cfg)
+
+        # Streams without file are not collected
+        del exp_files['consumption']
+        oml_xml_cfg = self.cn.oml_xml_config('m3-1', '1234', exp_files)
+        self.assertEqual(3, oml_xml_cfg.count('<collect '))
+        self.assertNotIn('consumption', oml_xml_cfg)
 
         # No output if none or empty
         oml_xml_cfg = self.cn.oml_xml_config('m3-1', '1234', None)
@@ -228,26 +314,26 @@ class TestHandleAnswer(unittest.TestCase):
         self.log.uninstall()
 
     def test_config_ack(self):
-        self.cn._handle_answer('config_ack set_time 0.123456')
+        self.cn._handle_answer(b'config_ack set_time 0.123456')
         self.log.check(
             ('gateway_code', 'DEBUG', 'config_ack set_time'),
             ('gateway_code', 'INFO', 'Control Node set time delay: 123456 us')
         )
 
         self.log.clear()
-        self.cn._handle_answer('config_ack anything')
+        self.cn._handle_answer(b'config_ack anything')
         self.log.check(
             ('gateway_code', 'DEBUG', 'config_ack anything'),
         )
 
     def test_error(self):
-        self.cn._handle_answer('error 42')
+        self.cn._handle_answer(b'error 42')
         self.log.check(
             ('gateway_code', 'ERROR', "Control node error: '42'")
         )
 
     def test_cn_serial_error(self):
-        self.cn._handle_answer('cn_serial_error: any error msg')
+        self.cn._handle_answer(b'cn_serial_error: any error msg')
         self.log.check(
             ('gateway_code', 'ERROR', 'cn_serial_error: any error msg')
         )
@@ -259,10 +345,103 @@ class TestHandleAnswer(unittest.TestCase):
         m_debug = mock.Mock()
 
         self.cn.measures_debug = m_debug
-        self.cn._handle_answer(msg)
+        self.cn._handle_answer(msg.encode())
         m_debug.assert_called_with(msg)
 
         m_debug.reset_mock()
         self.cn.measures_debug = None
-        self.cn._handle_answer(msg)
+        self.cn._handle_answer(msg.encode())
         self.assertFalse(m_debug.called)
+
+    def test_measures_hub(self):
+        msg = 'measures_debug: radio_measure 1377268768.841070 11 -91'
+        self.cn.measures_hub = mock.Mock(subscribers=0)
+        self.cn._handle_answer(msg.encode())
+        self.assertFalse(self.cn.measures_hub.publish.called)
+
+        self.cn.measures_hub.subscribers = 1
+        self.cn._handle_answer(msg.encode())
+        self.cn.measures_hub.publish.assert_called_with(msg)
+        self.log.check()  # measures are not logged
+
+    def test_measures_sinks(self):
+        msg = b'measures_debug: radio_measure 1377268768.841070 11 -91'
+        sinks = [mock.Mock(), mock.Mock()]
+        self.cn.measures_sinks = list(sinks)
+        self.cn._handle_answer(msg)
+        for sink in sinks:
+            sink.add_line.assert_called_with(msg)
+        self.cn.stop()
+        self.assertEqual([], self.cn.measures_sinks)
+
+        self.cn.stop()
+        self.assertIsNone(self.cn.measures_hub)
+
+
+class TestAsyncControlNodeSerial(unittest.TestCase):
+    """ Control node interface reading answers with asyncio """
+
+    def setUp(self):
+        read_fd, self.write_fd = os.pipe()
+        popen_class = mock.patch(
+            'gateway_code.utils.subprocess_timeout.Popen').start()
+        self.popen = popen_class.return_value
+        self.popen.stderr = os.fdopen(read_fd, 'rb')
+        self.popen.terminate.side_effect = self._terminate
+        self.popen.stdin.write.side_effect = self._answer
+
+        self.cn = cn_interface.AsyncControlNodeSerial('tty')
+        self.log_error = LogCapture('gateway_code', level=logging.WARNING)
+
+    def tearDown(self):
+        self.cn.stop()
+        mock.patch.stopall()
+        self.log_error.uninstall()
+
+    def _write(self, data):
+        os.write(self.write_fd, data)
+
+    def _terminate(self):
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    def _answer(self, command):
+        self._write(command.split()[0] + b' ACK\n')
+
+    def test_start_send_stop(self):
+        measures = []
+        self.cn.measures_debug = measures.append
+        # Lines split in several chunks
+        self._write(b'cn_serial_ready\nmeasures_debug: radio_measure')
+        self.assertEqual(0, self.cn.start())
+        self._write(b' 1.0 11 -91\n\n')
+        self.assertEqual(['start', 'ACK'], self.cn.send_command(['start']))
+        self.assertEqual(['measures_debug: radio_measure 1.0 11 -91'],
+                         measures)
+
+        self.cn.stop()
+        self.log_error.check()
+        self.assertIsNone(self.cn.send_command(['start']))
+
+    def test_start_error(self):
+        self._terminate()
+        self.assertEqual(1, self.cn.start())
+        self.log_error.check(
+            ('gateway_code', 'ERROR',
+             'Control node serial reader ended prematurely'))
+
+
+class TestReaders(unittest.TestCase):
+
+    def test_lines_protocol(self):
+        lines = []
+        ended = mock.Mock()
+        protocol = cn_interface._LinesProtocol(lines.append, ended)
+        protocol.data_received(b'first line\nsecond')
+        protocol.data_received(b' line\n\nthird')
+        protocol.data_received(b' line')
+        self.assertEqual([b'first line', b'second line'], lines)
+        protocol.connection_lost(None)
+        self.assertEqual(b'third line', lines[-1])
+        self.assertTrue(ended.called)
@@ -21,10 +21,20 @@
 
 """ gateway_code.control_node (iotlab) unit tests files """
 
+import os
+import stat
+import shutil
+import logging
+import tempfile
 import unittest
 from mock import Mock, patch, call
+from testfixtures import LogCapture
 
 from gateway_code.control_nodes.cn_iotlab import ControlNodeIotlab
+from gateway_code.control_nodes.cn_iotlab import cn_interface, cn_protocol
+from gateway_code.profile import Profile
+from gateway_code.utils import measures_hub
+from gateway_code.tests import utils
 
 
 class TestCnIotlab(unittest.TestCase):
@@ -35,8 +45,11 @@ class TestCnIotlab(unittest.TestCase):
         assert self.cn_node.open_node_state == 'stop'
         self.cn_node.default_profile = Mock()
         self.cn_node.default_profile.power = 'test_power'
-        self.cn_node.default_profile.consumption = 'test_consumption'
-        self.cn_node.default_profile.radio = 'test_radio'
+        self.cn_node.default_profile.consumption = Mock(
+            fields=('power', 'voltage', 'current'))
+        self.cn_node.default_profile.radio = Mock(mode='rssi')
+        self.cn_node.default_profile.aggregate = None
+        self.cn_node.default_profile.diff.return_value = set(Profile.PARTS)
         cn_serial_class = patch('gateway_code.control_nodes.cn_iotlab.'
                                 'cn_interface.ControlNodeSerial').start()
         self.cn_node.cn_serial = cn_serial_class.return_value
@@ -54,6 +67,9 @@ class TestCnIotlab(unittest.TestCase):
         self.cn_node.protocol.set_node_id.return_value = 0
         self.cn_node.protocol.config_consumption.return_value = 0
         self.cn_node.protocol.config_radio.return_value = 0
+        self.cn_node.protocol.ping.return_value = 0
+        pipeline = self.cn_node.protocol.pipeline.return_value
+        pipeline.__enter__.return_value = cn_protocol.Pipeline()
 
         openocd_class = patch('gateway_code.utils.openocd.OpenOCD').start()
         self.cn_node.openocd = openocd_class.return_value
@@ -61,7 +77,7 @@ class TestCnIotlab(unittest.TestCase):
         self.cn_node.openocd.reset.return_value = 0
 
         # Let's be fast
-        patch('time.sleep').start()
+        self.sleep = patch('time.sleep').start()
 
     def tearDown(self):
         patch.stopall()
@@ -87,6 +103,114 @@ class TestCnIotlab(unittest.TestCase):
         self.cn_node.protocol.start_stop.assert_called_once()
         self.cn_node.protocol.start_stop.assert_called_with('start', 'dc')
         assert self.cn_node.open_node_state == 'start'
+        # Measures have no consumer
+        assert self.cn_node.cn_serial.measures_hub is not measures_hub.HUB
+        assert self.cn_node.cn_serial.measures_sinks == []
+
+    def test_start_live_measures(self):
+        """Test live measures only set when configured or subscribed."""
+        with patch(utils.READ_CONFIG,
+                   utils.read_config_mock('m3', live_measures='1')):
+            assert self.cn_node.start('123') == 0
+        assert self.cn_node.cn_serial.measures_hub is measures_hub.HUB
+        assert self.cn_node.cn_serial.measures_sinks == [self.cn_node.measures]
+        assert self.cn_node.measures_published()
+
+        self.cn_node.cn_serial.measures_hub = None
+        subscription = measures_hub.HUB.subscribe()
+        self.addCleanup(subscription.close)
+        with patch(utils.READ_CONFIG, utils.read_config_mock('m3')):
+            assert self.cn_node.start('123') == 0
+        assert self.cn_node.cn_serial.measures_hub is measures_hub.HUB
+
+    def test_start_aggregation(self):
+        """Test consumption aggregation set at start."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exp_files = {name: os.path.join(directory, name + '.oml')
+                     for name in ('consumption', 'radio')}
+        consumption = {'period': 140, 'average': 1, 'power': True,
+                       'aggregate': {'window_ms': 100, 'stats': ['mean']}}
+        profile = Profile(Mock(ALIM='3.3V'), 'prof', 'dc', consumption)
+        oml_xml_config = self.cn_node.cn_serial.oml_xml_config
+
+        # Raw consumption measures not written
+        assert self.cn_node.start('123', exp_files, profile) == 0
+        oml_xml_config.assert_called_with(
+            'test', '123', {'radio': exp_files['radio']})
+        aggregator = self.cn_node.aggregator
+        assert self.cn_node.cn_serial.measures_sinks == [aggregator]
+        path = os.path.join(directory, 'consumption.aggregate.oml')
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o666
+        # Only power is enabled in the profile
+        aggregator.add_line(
+            b'measures_debug: consumption_measure '
+            b'100.010000:1.78250 0.100000')
+        aggregator.add_line(
+            b'measures_debug: consumption_measure '
+            b'100.020000:1.79250 0.300000 nan nan')
+        aggregator.add_line(
+            b'measures_debug: consumption_measure '
+            b'100.030000:1.80250 0.000000 3.230000')
+        aggregator.add_line(b'measures_debug: radio_measure 100.1 11 -91')
+        with LogCapture('gateway_code', level=logging.WARNING) as log:
+            assert self.cn_node.stop() == 0
+        log.check(('gateway_code', 'WARNING', 'Consumption aggregation: '
+                   '1 invalid measures lines rejected'))
+        assert self.cn_node.aggregator is None
+        with open(path) as aggregate_file:
+            lines = aggregate_file.read().splitlines()
+        assert 'domain: 123' in lines
+        assert 'schema: 1 control_node_measures_consumption_aggregate ' \
+            'timestamp_s:uint32 timestamp_us:uint32 count:uint32 ' \
+            'power_mean:double' in lines
+        row = lines[-1].split('\t')
+        assert row[3:] == ['100', '0', '2', '0.2']
+
+        # Raw measures also written, empty aggregate file removed
+        os.remove(path)
+        consumption['aggregate']['raw'] = True
+        profile = Profile(Mock(ALIM='3.3V'), 'prof', 'dc', consumption)
+        assert self.cn_node.start('123', exp_files, profile) == 0
+        oml_xml_config.assert_called_with('test', '123', exp_files)
+        assert os.path.exists(path)
+        assert self.cn_node.stop() == 0
+        assert not os.path.exists(path)
+
+        # No aggregation
+        assert self.cn_node.start('123', exp_files) == 0
+        assert self.cn_node.aggregator is None
+        oml_xml_config.assert_called_with('test', '123', exp_files)
+
+    def test_measures_window(self):
+        """Test getting last measures."""
+        self.cn_node.measures.add_line(
+            b'measures_debug: consumption_measure '
+            b'100.000000:1.78250 0.100000 3.300000 0.030000')
+        self.cn_node.measures.add_line(
+            b'measures_debug: consumption_measure '
+            b'120.000000:21.78250 0.200000 3.300000 0.060000')
+        window = self.cn_node.measures_window()
+        assert window['consumption']['current'] == [0.06]
+        assert window['radio']['timestamp'] == []
+        window = self.cn_node.measures_window(20)
+        assert window['consumption']['power'] == [0.1, 0.2]
+
+        # cleared on experiment start
+        assert self.cn_node.start('123') == 0
+        assert self.cn_node.measures_window()['consumption']['power'] == []
+
+        # only the profile consumption measures are in lines
+        consumption = {'period': 140, 'average': 1, 'power': True,
+                       'current': True}
+        profile = Profile(Mock(ALIM='3.3V'), 'prof', 'dc', consumption)
+        assert self.cn_node.start('123', profile=profile) == 0
+        self.cn_node.measures.add_line(
+            b'measures_debug: consumption_measure '
+            b'130.000000:1.78250 0.100000 0.030000')
+        window = self.cn_node.measures_window()['consumption']
+        assert window == {'timestamp': [130.0], 'power': [0.1],
+                          'current': [0.03]}
 
     def test_setup(self):
         """Test setup of iotlab control node."""
@@ -118,10 +242,10 @@ class TestCnIotlab(unittest.TestCase):
         self.cn_node.protocol.set_node_id.assert_called_with('test')
         self.cn_node.protocol.config_consumption.assert_called_once()
         self.cn_node.protocol.config_consumption.assert_called_with(
-            'test_consumption')
+            self.cn_node.default_profile.consumption)
         self.cn_node.protocol.config_radio.assert_called_once()
         self.cn_node.protocol.config_radio.assert_called_with(
-            'test_radio')
+            self.cn_node.default_profile.radio)
         self.cn_node.protocol.start_stop.assert_called_once()
         self.cn_node.protocol.start_stop.assert_called_with(
             'stop', 'test_power')
@@ -136,10 +260,138 @@ class TestCnIotlab(unittest.TestCase):
 
         self.cn_node.protocol.config_consumption.assert_called_once()
         self.cn_node.protocol.config_consumption.assert_called_with(
-            'test_consumption')
+            self.cn_node.default_profile.consumption)
         self.cn_node.protocol.config_radio.assert_called_once()
         self.cn_node.protocol.config_radio.assert_called_with(
-            'test_radio')
+            self.cn_node.default_profile.radio)
+
+    @patch(utils.READ_CONFIG, utils.read_config_mock('m3',
+                                                     sniffer_pcapng='true'))
+    @patch('gateway_code.control_nodes.cn_iotlab.sniffer.Sniffer')
+    def test_start_sniffer(self, sniffer_class):
+        """Test sniffer frames written as pcapng."""
+        snif = sniffer_class.return_value
+        snif.fifo = '/tmp/fifo'
+        snif.start.return_value = 0
+        snif.stop.return_value = 0
+        exp_files = {'sniffer': '/iotlab/sniffer/test.oml', 'radio': 'r.oml'}
+
+        # Radio not in sniffer mode
+        assert self.cn_node.start('123', exp_files) == 0
+        assert not sniffer_class.called
+        self.cn_node.cn_serial.oml_xml_config.assert_called_with(
+            'test', '123', exp_files)
+        assert self.cn_node.stop() == 0
+
+        self.cn_node.default_profile.radio.mode = 'sniffer'
+        assert self.cn_node.start('123', exp_files) == 0
+        sniffer_class.assert_called_with('/iotlab/sniffer/test.pcapng',
+                                         '/iotlab/sniffer/test.oml',
+                                         port=30000)
+        self.cn_node.cn_serial.oml_xml_config.assert_called_with(
+            'test', '123', {'sniffer': '/tmp/fifo', 'radio': 'r.oml'})
+        assert self.cn_node.stop() == 0
+        assert snif.stop.call_count == 1
+        assert self.cn_node.sniffer is None
+
+        # Configured port
+        with patch(utils.READ_CONFIG, utils.read_config_mock(
+                'm3', sniffer_pcapng='true', sniffer_port='30002')):
+            assert self.cn_node.start('123', exp_files) == 0
+        assert sniffer_class.call_args[1] == {'port': 30002}
+        assert self.cn_node.stop() == 0
+
+        # Live server failed, OML file written
+        snif.start.return_value = 1
+        assert self.cn_node.start('123', exp_files) == 1
+        assert self.cn_node.sniffer is None
+        self.cn_node.cn_serial.oml_xml_config.assert_called_with(
+            'test', '123', exp_files)
+        assert self.cn_node.stop() == 0
+        assert snif.stop.call_count == 2
+
+        # Invalid port
+        sniffer_class.reset_mock()
+        with patch(utils.READ_CONFIG, utils.read_config_mock(
+                'm3', sniffer_pcapng='true', sniffer_port='any')):
+            assert self.cn_node.start('123', exp_files) == 1
+        assert not sniffer_class.called
+        assert self.cn_node.stop() == 0
+
+    @patch('gateway_code.control_nodes.cn_iotlab.LOGGER')
+    def test_configure_profile_aggregate(self, logger):
+        """Aggregation is not updated during the experiment."""
+        protocol = self.cn_node.protocol
+        consumption = {'period': 140, 'average': 1, 'power': True}
+        profile = Profile(Mock(ALIM='3.3V'), 'prof', 'dc', consumption)
+        assert self.cn_node.configure_profile(profile) == 0
+        assert protocol.config_consumption.call_count == 1
+
+        consumption['aggregate'] = {'window_ms': 1000, 'stats': ['max']}
+        profile = Profile(Mock(ALIM='3.3V'), 'prof', 'dc', consumption)
+        assert self.cn_node.configure_profile(profile) == 0
+        assert protocol.config_consumption.call_count == 1
+        assert logger.warning.call_count == 1
+
+    def test_configure_profile_diff(self):
+        """Only changed profile parts are configured."""
+        protocol = self.cn_node.protocol
+        node_type = Mock(ALIM='3.3V')
+        consumption = {'period': 140, 'average': 1, 'power': True}
+        radio = {'mode': 'rssi', 'channels': [11], 'period': 10,
+                 'num_per_channel': 1}
+        profile = Profile(node_type, 'prof', 'dc', consumption, radio)
+        assert self.cn_node.configure_profile(profile) == 0
+        assert protocol.start_stop.call_count == 1
+        assert protocol.config_consumption.call_count == 1
+        assert protocol.config_radio.call_count == 1
+
+        # Same profile
+        profile = Profile(node_type, 'other', 'dc', consumption, radio)
+        assert self.cn_node.configure_profile(profile) == 0
+        assert protocol.start_stop.call_count == 1
+        assert protocol.config_consumption.call_count == 1
+        assert protocol.config_radio.call_count == 1
+
+        # Radio only
+        radio['channels'] = [11, 12]
+        profile = Profile(node_type, 'prof', 'dc', consumption, radio)
+        assert self.cn_node.configure_profile(profile) == 0
+        assert protocol.config_consumption.call_count == 1
+        protocol.config_radio.assert_called_with(profile.radio)
+
+        # Power changed by open_start, configuration sent again on failure
+        assert self.cn_node.open_start('battery') == 0
+        protocol.config_radio.return_value = 1
+        assert self.cn_node.configure_profile(profile) == 1
+        assert protocol.start_stop.call_count == 3
+        assert protocol.config_consumption.call_count == 2
+        protocol.config_radio.return_value = 0
+        assert self.cn_node.configure_profile(profile) == 0
+        assert protocol.config_radio.call_count == 4
+
+        # Control node reset
+        assert self.cn_node.start('123') == 0
+        assert self.cn_node.configure_profile(profile) == 0
+        assert protocol.config_consumption.call_count == 4
+        assert self.cn_node.reset() == 0
+        assert self.cn_node.configure_profile(profile) == 0
+        assert protocol.config_consumption.call_count == 5
+
+    def test_start_experiment_config_error(self):
+        """Profile answers errors are checked by the outer pipeline."""
+        protocol = self.cn_node.protocol
+        consumption = {'period': 140, 'average': 1, 'power': True}
+        profile = Profile(Mock(ALIM='3.3V'), 'prof', 'dc', consumption)
+
+        outer, inner = cn_protocol.Pipeline(), cn_protocol.Pipeline()
+        outer.ret = 1  # a 'config_consumption_measure' NACK
+        protocol.pipeline.return_value.__enter__.side_effect = [outer, inner]
+        assert self.cn_node.start_experiment(profile) == 1
+
+        protocol.pipeline.return_value.__enter__.side_effect = None
+        assert self.cn_node.configure_profile(profile) == 0
+        assert protocol.config_consumption.call_count == 2
 
     def test_autotest_setup(self):
         """Test autotest setup of iotlab control node."""
@@ -159,9 +411,61 @@ class TestCnIotlab(unittest.TestCase):
         self.cn_node.protocol.start_stop.assert_called_once()
         self.cn_node.protocol.start_stop.assert_called_with('stop', 'dc')
 
+    def test_wait_ready(self):
+        """Test waiting control node readiness after reset."""
+        # Serial interface running: wait control node answer
+        self.cn_node.protocol.ping.side_effect = [1, 1, 0]
+        assert self.cn_node.reset() == 0
+        assert self.cn_node.protocol.ping.call_count == 3
+        self.sleep.assert_any_call(0.1)
+        self.cn_node.cn_serial.forget_timed_out.assert_called_with()
+
+        # Not answering
+        self.cn_node.protocol.ping.side_effect = None
+        self.cn_node.protocol.ping.return_value = 1
+        with patch.object(ControlNodeIotlab, 'READY_TIMEOUT', 0):
+            assert self.cn_node.reset() == 1
+
+        # Serial interface not running, wait the maximum time
+        self.cn_node.cn_serial.process = None
+        self.sleep.reset_mock()
+        self.cn_node.protocol.ping.reset_mock()
+        assert self.cn_node.reset() == 0
+        self.sleep.assert_called_once_with(ControlNodeIotlab.READY_TIMEOUT)
+        assert self.cn_node.protocol.ping.call_count == 0
+
+    def test_start_ready_order(self):
+        """Readiness is checked after the serial interface is started."""
+        manager = Mock()
+        manager.attach_mock(self.cn_node.openocd.reset, 'reset')
+        manager.attach_mock(self.cn_node.cn_serial.start, 'serial_start')
+        manager.attach_mock(self.cn_node.cn_serial.stop, 'serial_stop')
+        manager.attach_mock(self.cn_node.protocol.ping, 'ping')
+
+        assert self.cn_node.start('123') == 0
+        assert self.cn_node.stop() == 0
+        assert [name for name, _, _ in manager.mock_calls] == [
+            'reset', 'serial_start', 'ping', 'reset', 'ping', 'serial_stop']
+
     def test_status(self):
         """Test status method of iotlab control node."""
         with patch('gateway_code.utils.ftdi_check.ftdi_check') as ftdi_check:
             ftdi_check.return_value = 42
             assert self.cn_node.status() == 42
             ftdi_check.assert_called_with('control', '4232')
+
+    def test_serial_class(self):
+        """Test selecting control node serial interface reader."""
+        # pylint:disable=protected-access
+        read_config = 'gateway_code.config.read_config'
+        with patch(read_config, utils.read_config_mock('m3')):
+            # ControlNodeSerial is mocked
+            assert ControlNodeIotlab._serial_class().__name__ == \
+                'ControlNodeSerial'
+        with patch(read_config, utils.read_config_mock(
+                'm3', cn_serial_reader='asyncio')):
+            assert isinstance(ControlNodeIotlab('test', None).cn_serial,
+                              cn_interface.AsyncControlNodeSerial)
+        with patch(read_config, utils.read_config_mock(
+                'm3', cn_serial_reader='unknown')):
+            self.assertRaises(ValueError, ControlNodeIotlab._serial_class)
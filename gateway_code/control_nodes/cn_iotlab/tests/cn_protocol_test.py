@@ -147,6 +147,32 @@ class TestProtocol(unittest.TestCase):
         self.sender.assert_called_with(['green_led_on'])
         self.assertEqual(0, ret)
 
+    def test_ping(self):
+        sender = mock.Mock(return_value=['green_led_on', 'ACK'])
+        protocol = cn_protocol.Protocol(sender)
+        self.assertEqual(0, protocol.ping())
+        sender.assert_called_with(['green_led_on'], timeout=0.2,
+                                  late_answer=False)
+
+        sender.return_value = None
+        self.assertEqual(1, protocol.ping(timeout=1))
+        sender.assert_called_with(['green_led_on'], timeout=1,
+                                  late_answer=False)
+
+    def test_ping_keeps_green_led(self):
+        sender = mock.Mock(return_value=['green_led_blink', 'ACK'])
+        protocol = cn_protocol.Protocol(sender)
+        protocol.green_led_blink()
+        self.assertEqual(0, protocol.ping())
+        sender.assert_called_with(['green_led_blink'], timeout=0.2,
+                                  late_answer=False)
+
+        sender.return_value = ['green_led_on', 'ACK']
+        protocol.green_led_on()
+        self.assertEqual(0, protocol.ping())
+        sender.assert_called_with(['green_led_on'], timeout=0.2,
+                                  late_answer=False)
+
 
 class TestProtocolRadio(unittest.TestCase):
 
@@ -247,3 +273,33 @@ class TestProtocolRadio(unittest.TestCase):
 
         self.sender.assert_called_with(['config_radio_stop'])
         self.assertEqual(0, ret)
+
+    def test_pipeline(self):
+        submitter = mock.Mock()
+        submitter.return_value.wait.side_effect = [
+            ['green_led_blink', 'ACK'], ['set_time', 'NACK'],
+            ['config_radio_stop', 'ACK']]
+        protocol = cn_protocol.Protocol(self._sender_wrapper, submitter)
+
+        with protocol.pipeline(timeout=2) as pipeline:
+            self.assertEqual(0, protocol.green_led_blink())
+            self.assertEqual(0, protocol.set_time())
+            with protocol.pipeline() as inner:
+                self.assertEqual(0, protocol.config_radio(None))
+            self.assertEqual(3, submitter.call_count)
+            self.assertFalse(submitter.return_value.wait.called)
+        self.assertEqual(1, pipeline.ret)
+        self.assertEqual(0, inner.ret)
+        submitter.return_value.wait.assert_called_with(2)
+        self.assertFalse(self.sender.called)
+
+        # Outside of pipeline
+        self.sender.return_value = ['green_led_on', 'ACK']
+        self.assertEqual(0, protocol.green_led_on())
+        self.assertEqual(3, submitter.call_count)
+
+    def test_pipeline_no_submitter(self):
+        self.sender.return_value = ['set_time', 'NACK']
+        with self.protocol.pipeline() as pipeline:
+            self.assertEqual(1, self.protocol.set_time())
+        self.assertEqual(0, pipeline.ret)
@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test measures_buffer module """
+
+import unittest
+
+from .. import measures_buffer
+
+
+class TestRingBuffer(unittest.TestCase):
+    """ Test RingBuffer """
+
+    def test_append_between(self):
+        """ Old samples are overwritten, time ranges are found """
+        ring = measures_buffer.RingBuffer(('timestamp', 'value'), capacity=4)
+        self.assertIsNone(ring.latest())
+        self.assertEqual({'timestamp': [], 'value': []}, ring.between(1.0))
+
+        for i in range(6):
+            ring.append(float(i), 10.0 * i)
+        self.assertEqual(4, ring.count)
+        self.assertEqual(5.0, ring.latest())
+        self.assertEqual({'timestamp': [2.0, 3.0, 4.0, 5.0],
+                          'value': [20.0, 30.0, 40.0, 50.0]}, ring.between())
+        self.assertEqual([3.0, 4.0], ring.between(2.5, 5.0)['timestamp'])
+        self.assertEqual([2.0], ring.between(end=3.0)['timestamp'])
+        self.assertEqual([], ring.between(6.0)['timestamp'])
+        self.assertEqual([], ring.between(4.0, 3.0)['timestamp'])
+
+        ring.clear()
+        self.assertIsNone(ring.latest())
+        ring.append(7.0, 70.0)
+        self.assertEqual({'timestamp': [7.0], 'value': [70.0]},
+                         ring.between())
+
+
+class TestMeasuresBuffer(unittest.TestCase):
+    """ Test MeasuresBuffer """
+
+    def test_add_line_window(self):
+        """ Consumption and radio measures are stored """
+        measures = measures_buffer.MeasuresBuffer(capacity=8)
+        for i in range(10):
+            measures.add_line(b'measures_debug: consumption_measure '
+                              b'%d.5:1.78250 0.1 3.3 0.03' % i)
+        measures.add_line(b'measures_debug: radio_measure 3.0 26 -42')
+        # invalid lines
+        measures.add_line(b'measures_debug: consumption_measure 9.9 a b c')
+        measures.add_line(b'measures_debug: consumption_measure 9.9 0.1')
+        measures.add_line(b'measures_debug: radio_measure 4.0')
+        measures.add_line(b'measures_debug:')
+
+        window = measures.window(2.0)
+        self.assertEqual([7.5, 8.5, 9.5], window['consumption']['timestamp'])
+        self.assertEqual([0.03] * 3, window['consumption']['current'])
+        self.assertEqual({'timestamp': [3.0], 'channel': [26.0],
+                          'rssi': [-42.0]}, window['radio'])
+        self.assertEqual(8, len(measures.window(100)['consumption']['power']))
+
+        measures.clear()
+        self.assertEqual([], measures.window()['radio']['rssi'])
+
+    def test_real_line(self):
+        """ Control node measures line, with enabled consumption fields """
+        line = (b'measures_debug: consumption_measure 1377268768.841070:'
+                b'1.78250 0.000000 3.230000 0.080003')
+        measures = measures_buffer.MeasuresBuffer(capacity=8)
+        measures.add_line(line)
+        self.assertEqual({'timestamp': [1377268768.84107], 'power': [0.0],
+                          'voltage': [3.23], 'current': [0.080003]},
+                         measures.window()['consumption'])
+
+        # disabled measures are 'nan', or not in lines
+        measures.set_consumption(('voltage',))
+        measures.add_line(b'measures_debug: consumption_measure '
+                          b'1377268768.841070:1.78250 nan 3.230000 nan')
+        measures.add_line(b'measures_debug: consumption_measure '
+                          b'1377268769.841070:2.78250 3.240000')
+        measures.add_line(b'measures_debug: consumption_measure '
+                          b'1377268770.841070:3.78250 3.240000 0.080003')
+        self.assertEqual({'timestamp': [1377268768.84107, 1377268769.84107],
+                          'voltage': [3.23, 3.24]},
+                         measures.window()['consumption'])
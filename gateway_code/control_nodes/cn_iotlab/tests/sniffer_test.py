@@ -0,0 +1,224 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test sniffer module """
+
+import os
+import stat
+import time
+import base64
+import shutil
+import socket
+import struct
+import tempfile
+import unittest
+
+import mock
+
+from gateway_code.control_nodes.cn_iotlab import sniffer
+
+FRAME = bytes.fromhex('41883bcdabffff01003f3f1234')
+# Header written by the control node serial interface OML text output
+OML_HEADER = '''protocol: 5
+domain: 123
+start-time: 1378387028
+sender-id: m3-1
+app-name: control_node_measures
+schema: 0 _experiment_metadata subject:string key:string value:string
+schema: 1 control_node_measures_sniffer timestamp_s:uint32 \
+timestamp_us:uint32 channel:uint32 rssi:int32 lqi:uint32 crc_ok:uint32 \
+length:uint32 frame:blob
+content: text
+
+'''
+
+
+def read_blocks(data):
+    """ Return pcapng `data` blocks as (type, body) """
+    blocks = []
+    while data:
+        block_type, length = struct.unpack('<II', data[:8])
+        assert data[length - 4:length] == data[4:8]
+        blocks.append((block_type, data[8:length - 4]))
+        data = data[length:]
+    return blocks
+
+
+class TestPcapng(unittest.TestCase):
+    """ Test pcapng blocks and writer """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'm3-1.pcapng')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_packet_block(self):
+        """ Frame has TAP header with channel, rssi and lqi """
+        block = b''.join(sniffer.packet_block(1.5, FRAME, 11, -91.0, 255))
+        blocks = read_blocks(block)
+        self.assertEqual(1, len(blocks))
+        block_type, body = blocks[0]
+        self.assertEqual(6, block_type)
+        _, ts_high, ts_low, length, _ = struct.unpack('<IIIII', body[:20])
+        self.assertEqual(1500000, (ts_high << 32) + ts_low)
+        self.assertEqual(36 + len(FRAME), length)
+        tap = body[20:56]
+        self.assertEqual((0, 0, 36), struct.unpack('<BBH', tap[:4]))
+        self.assertEqual((1, 4, -91.0), struct.unpack('<HHf', tap[12:20]))
+        self.assertEqual((3, 3, 11), struct.unpack('<HHH', tap[20:26]))
+        self.assertEqual((10, 1, 255), struct.unpack('<HHB', tap[28:33]))
+        self.assertEqual(FRAME, body[56:56 + len(FRAME)])
+
+    def test_writer_rotate(self):
+        """ Files are rotated with a section header each """
+        block = sniffer.packet_block(1.5, FRAME, 11, -91.0, 255)
+        block_size = sum(len(buf) for buf in block)
+        writer = sniffer.PcapngWriter(
+            self.path, len(sniffer.SECTION_HEADER) + 2 * block_size)
+        for _ in range(3):
+            writer.write(block)
+        writer.close()
+
+        with open(self.path, 'rb') as pcap:
+            blocks = read_blocks(pcap.read())
+        self.assertEqual([0x0A0D0D0A, 1, 6, 6], [typ for typ, _ in blocks])
+        self.assertEqual(283, struct.unpack('<H', blocks[1][1][:2])[0])
+        with open(os.path.join(self.directory, 'm3-1.1.pcapng'), 'rb') as pcap:
+            blocks = read_blocks(pcap.read())
+        self.assertEqual([0x0A0D0D0A, 1, 6], [typ for typ, _ in blocks])
+
+
+class TestSniffer(unittest.TestCase):
+    """ Test OML FIFO reading """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'm3-1.pcapng')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sniffer(self):
+        """ OML frames are written to file and live clients """
+        snif = sniffer.Sniffer(self.path, port=0)
+        self.assertEqual(0, snif.start())
+        client = socket.create_connection(('127.0.0.1', snif.server.port))
+        self.assertTrue(_wait(lambda: snif.server.clients == 1))
+
+        frame = base64.b64encode(FRAME).decode()
+        with open(snif.fifo, 'w') as oml:
+            oml.write(OML_HEADER)
+            oml.write(f'1.0\t1\t1\t1378387029\t500000\t11\t-91\t255\t1\t13\t'
+                      f'{frame}\n')
+            oml.write('1.0\t0\t1\tsubject\tkey\tvalue\n')
+            oml.write('1.0\t1\t2\t1378387029\tinvalid\n')
+            oml.write('invalid\n')
+        self.assertEqual(0, snif.stop())
+        self.assertEqual(1, snif.frames)
+        self.assertFalse(os.path.exists(snif.fifo))
+
+        self.assertEqual((b'1', 10, [3, 4, 5, 6, 7]), snif.columns)
+        self.assertEqual(0o666, stat.S_IMODE(os.stat(self.path).st_mode))
+        with open(self.path, 'rb') as pcap:
+            data = pcap.read()
+        self.assertEqual([0x0A0D0D0A, 1, 6],
+                         [typ for typ, _ in read_blocks(data)])
+        live = b''
+        while True:
+            received = client.recv(4096)
+            if not received:
+                break
+            live += received
+        client.close()
+        self.assertEqual(data, live)
+
+    @mock.patch('gateway_code.control_nodes.cn_iotlab.sniffer.LOGGER')
+    def test_sniffer_no_writer(self, logger):
+        """ Stop without FIFO writer, or without sniffer schema """
+        oml_path = os.path.join(self.directory, 'm3-1.oml')
+        snif = sniffer.Sniffer(self.path, oml_path, port=0)
+        self.assertEqual(0, snif.start())
+        self.assertEqual(0, snif.stop())
+        self.assertEqual(0, snif.stop())
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(oml_path))
+
+        # OML stream copied to the OML file
+        snif = sniffer.Sniffer(self.path, oml_path, port=0)
+        self.assertEqual(0, snif.start())
+        header = OML_HEADER.replace('frame:blob', 'frame:string')
+        rows = ''.join(f'1.0\t1\t{num}\t1378387029\t500000\n'
+                       for num in range(10000))
+        with open(snif.fifo, 'w') as oml:
+            oml.write(header)
+            # more than the FIFO buffer, still read
+            oml.write(rows)
+        self.assertEqual(0, snif.stop())
+        self.assertEqual(0, snif.frames)
+        self.assertIsNone(snif.columns)
+        logger.error.assert_called_with('Sniffer: no sniffer OML schema')
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(0o666, stat.S_IMODE(os.stat(oml_path).st_mode))
+        with open(oml_path) as oml:
+            self.assertEqual(header + rows, oml.read())
+
+    def test_sniffer_port_in_use(self):
+        """ Live server error is returned before creating the FIFO """
+        server = sniffer.LiveServer(port=0)
+        self.assertEqual(0, server.start())
+        snif = sniffer.Sniffer(self.path, port=server.port)
+        self.assertEqual(1, snif.start())
+        self.assertIsNone(snif.fifo)
+        self.assertEqual(0, snif.stop())
+        server.stop()
+
+    def test_live_server(self):
+        """ Slow clients are dropped, port in use is an error """
+        server = sniffer.LiveServer(port=0)
+        self.assertEqual(0, server.start())
+        client = socket.create_connection(('127.0.0.1', server.port))
+        self.assertTrue(_wait(lambda: server.clients == 1))
+        with mock.patch('gateway_code.control_nodes.cn_iotlab.sniffer.'
+                        'QUEUE_SIZE', 1):
+            other = socket.create_connection(('127.0.0.1', server.port))
+            self.assertTrue(_wait(lambda: server.clients == 2))
+        block = [b'\0' * 2 ** 20]
+        for _ in range(16):
+            server.publish(block)
+        self.assertEqual(1, server.clients)
+
+        self.assertEqual(1, sniffer.LiveServer(port=server.port).start())
+        server.stop()
+        client.close()
+        other.close()
+
+
+def _wait(condition, timeout=5.0):
+    """ Wait until `condition()` is True """
+    t_end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > t_end:
+            return False
+        time.sleep(0.01)
+    return True
@@ -42,13 +42,17 @@ class ControlNodeIotlabm3(ControlNodeIotlab):
 
     @logger_call("Control node : profile configuration")
     def configure_profile(self, profile=None):
-        """ Configure the given profile on the control node """
+        """ Configure the given profile on the control node
+
+        Radio is only sent if changed since the last configuration """
         LOGGER.info('Configure profile on Control Node')
         self.profile = profile or self.default_profile
         ret_val = 0
 
         # Monitoring : Radio only, ignore other fields
-        ret_val += self.protocol.config_radio(self.profile.radio)
+        if 'radio' in self.profile.diff(self._configured):
+            ret_val += self.protocol.config_radio(self.profile.radio)
+        self._configured = self.profile if ret_val == 0 else None
         return ret_val
 
     @logger_call("Control node : start power of open node - Ignored")
@@ -21,9 +21,10 @@
 
 """ gateway_code.control_node (iotlabm3) unit tests files """
 
-from mock import Mock, patch
+from mock import patch
 
 from gateway_code.control_nodes.cn_iotlabm3 import ControlNodeIotlabm3
+from gateway_code.profile import Profile
 
 
 def test_cn_iotlabm3_status():
@@ -48,20 +49,24 @@ def test_configure_profile(send_cmd):
     """Test configure_profile method of iotlabm3 control node."""
     send_cmd.return_value = 0
     cn_iotlabm3 = ControlNodeIotlabm3('test', None)
-    profile = Mock()
-    profile.radio = None
+    profile = Profile(None, 'radio', 'dc')
     assert cn_iotlabm3.configure_profile(profile) == 0
     send_cmd.assert_called_with(['config_radio_stop'])
 
-    profile.radio = Mock()
-    profile.radio.mode = 'rssi'
-    profile.radio.channels = ['1', '3', '2']
-    profile.radio.period = 10
-    profile.radio.num_per_channel = 42
+    radio = {'mode': 'rssi', 'channels': [11, 13, 12], 'period': 10,
+             'num_per_channel': 42}
+    profile = Profile(None, 'radio', 'dc', radio=radio)
     assert cn_iotlabm3.configure_profile(profile) == 0
     send_cmd.assert_called_with(['config_radio_measure',
-                                 '1,2,3', '10', '42'])
+                                 '11,12,13', '10', '42'])
 
-    profile.radio.mode = 'sniffer'
+    # Unchanged radio
+    send_cmd.reset_mock()
+    profile = Profile(None, 'other', 'battery', radio=radio)
     assert cn_iotlabm3.configure_profile(profile) == 0
-    send_cmd.assert_called_with(['config_radio_sniffer', '1,2,3', '10'])
+    assert not send_cmd.called
+
+    radio = {'mode': 'sniffer', 'channels': [11, 13, 12], 'period': 10}
+    profile = Profile(None, 'radio', 'dc', radio=radio)
+    assert cn_iotlabm3.configure_profile(profile) == 0
+    send_cmd.assert_called_with(['config_radio_sniffer', '11,12,13', '10'])
@@ -45,7 +45,8 @@ class ControlNodeNo(ControlNodeBase):
         return None
 
     @logger_call("Control node : Start")
-    def start(self, exp_id, exp_files=None):  # pylint:disable=unused-argument
+    def start(self, exp_id, exp_files=None,  # pylint:disable=unused-argument
+              profile=None):
         """ Start ControlNode serial interface """
         return 0
 
@@ -70,7 +70,8 @@ class ControlNodeRpi3(ControlNodeBase):
         return None
 
     @logger_call("Control node: Start")
-    def start(self, exp_id, exp_files=None):  # pylint:disable=unused-argument
+    def start(self, exp_id, exp_files=None,  # pylint:disable=unused-argument
+              profile=None):
         """ Start ControlNode serial interface """
         ret_val = 0
         ret_val += self.open_start('dc')
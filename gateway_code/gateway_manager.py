@@ -28,13 +28,21 @@ import re
 import time
 import errno
 import shutil
-from threading import RLock, Timer
+import functools
+from threading import RLock, Timer, Thread
 
 from gateway_code import config
 from gateway_code import common
+from gateway_code import metrics
 from gateway_code.common import logger_call, wait_tty, wait_no_tty
 from gateway_code.autotest import autotest
 from gateway_code.utils import elftarget
+from gateway_code.utils import firmware_state
+from gateway_code.utils.step_graph import StepGraph
+from gateway_code.utils import command_queue
+from gateway_code.utils import usb_inventory
+from gateway_code.utils import oml_columnar
+from gateway_code.utils import serial_capture
 
 from gateway_code import board_config
 
@@ -43,16 +51,34 @@ from gateway_code import gateway_logging
 LOGGER = gateway_logging.LOGGER
 
 
+def after_cleaning(func):
+    """ Decorator waiting for the nodes background cleaning to be done
+
+    Should be used under 'synchronous' to prevent a new cleaning to start """
+    @functools.wraps(func)
+    def _wrapped_f(self, *args, **kwargs):
+        """ Function run after cleaning """
+        self.wait_cleaning()
+        return func(self, *args, **kwargs)
+    return _wrapped_f
+
+
 class GatewayManager:  # pylint:disable=too-many-instance-attributes
     """ Gateway Manager class,
 
     Manages experiments, open node and control node """
+    # Delay before retrying an experiment timeout stop not queued
+    TIMEOUT_STOP_RETRY = 10.0
 
     def __init__(self, log_folder='.', log_stdout=False):
         gateway_logging.init_logger(log_folder, log_stdout)
 
         self.board_cfg = board_config.BoardConfig()
         self.rlock = RLock()
+        # exp_start/exp_stop wait their turn instead of failing on busy lock
+        self.queue = command_queue.CommandQueue(self.rlock,
+                                                estimate=self._duration)
+        metrics.REGISTRY.const_labels['board'] = self.board_cfg.board_type
 
         # Nodes instance
         self.open_node = self.board_cfg.board_class()
@@ -69,11 +95,20 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         self.experiment_is_running = False
         self.user_log_handler = None
         self.timeout_timer = None
+        self._cleaning = None
+        # Convert measures files to columnar files after experiments
+        self.oml_columnar = common.booleanize(
+            config.read_config('oml_columnar', False))
+        # Capture open node serial output in the experiment 'log' folder
+        self.serial_capture = common.booleanize(
+            config.read_config('serial_capture', False))
 
     @logger_call("Gateway Manager : Setup")
     def setup(self):
         """ Run commands that might crash
         Must be run before running other commands """
+        # Records from a previous daemon, nodes state is unknown
+        firmware_state.FIRMWARE_STATE.clear()
         # Setup control node
         ret = self.node_flash('control', None)  # Flash default
         if ret != 0:
@@ -95,11 +130,19 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         """
         return re.match('^nrf52[0-9]{0,3}dk$', board) is not None
 
+    @staticmethod
+    def _duration(command):
+        """ Mean duration of previous `command` runs """
+        return metrics.REGISTRY.mean(f'GatewayManager.{command}')
+
     # R0913 too many arguments 6/5
+    @command_queue.queued('queue')
     @common.synchronous('rlock')
+    @after_cleaning
     @logger_call("Gateway Manager : Start experiment")
     def exp_start(self, user, exp_id,  # pylint: disable=R0913
-                  firmware_path=None, profile_dict=None, timeout=0):
+                  firmware_path=None, profile_dict=None, timeout=0,
+                  *, serial_timestamps=False):
         """
         Start an experiment
 
@@ -108,10 +151,14 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         :param firmware_path: path of the firmware file to use, can be None
         :param profile_dict: monitoring profile
         :param timeout: Experiment expiration timeout. On 0 no timeout.
+        :param serial_timestamps: prefix open node serial lines with the
+            gateway time on the serial redirection port
 
         Experiment start steps
 
-        1) Prepare Gateway: User experiment files and log:
+        0) Check profile and firmware concurrently, then create user
+           experiment files
+        1) Prepare Gateway: User experiment log
         2) Prepare Control node: Start communication and power on open node
         3) Prepare Open node: Check OK, setup firmware and serial redirection
         4) Configure Control Node Profile and experiment
@@ -122,29 +169,27 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
             LOGGER.debug('Experiment running. Stop previous experiment')
             self.exp_stop()
 
-        try:
-            profile = self.board_cfg.profile_from_dict(profile_dict)
-        except ValueError as err:
-            LOGGER.error('%r', err)
-            return 1
-        if not elftarget.is_compatible_with_node(firmware_path,
-                                                 self.open_node):
-            LOGGER.error('Invalid firmware target, aborting experiment.')
-            return 1
-
-        ret_val = 0
+        # Arguments checks are independent, user files are only created
+        # with valid arguments
+        checks = StepGraph('exp_start_checks')
+        checks.add('profile', self.board_cfg.profile_from_dict, profile_dict)
+        checks.add('firmware', self._check_firmware, firmware_path)
+        checks.add('exp_files', self._prepare_user_exp_files, user, exp_id,
+                   requires=('profile', 'firmware'))
+        checks.run()
+        self._observe_steps(checks)
+
+        ret_val = self._exp_start_checks_error(checks)
+        if ret_val:
+            return ret_val
+        profile = checks.results['profile'].value
 
         self.experiment_is_running = True
         self.exp_id = exp_id
         self.user = user
-
-        if (self.board_cfg.robot_type == 'turtlebot2' or
-                self.board_cfg.cn_class.TYPE == 'no'):  # pragma: no cover
-            LOGGER.info('Create user exp folder')
-            self._create_user_exp_folders(user, exp_id)
-
-        self.exp_files = self.create_user_exp_files(self.board_cfg.node_id,
-                                                    user, exp_id)
+        self.exp_files = checks.results['exp_files'].value
+        self._set_serial_capture(self.exp_files)
+        self._set_serial_timestamps(serial_timestamps)
 
         # Create user log
         self.user_log_handler = gateway_logging.user_logger(
@@ -152,18 +197,15 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         LOGGER.addHandler(self.user_log_handler)
         LOGGER.info('Start experiment: %s-%i', user, exp_id)
 
+        # Open node tty is only visible when powered by the control node, so
+        # nodes steps are run in sequence.
         # Init ControlNode
-        ret_val += self.control_node.start(self.exp_id, self.exp_files)
-
+        ret_val += self.control_node.start(self.exp_id, self.exp_files,
+                                           profile)
         # with Pycom boards, trigger 2 power-cycle to ensure REPL is correctly
         # started
         if self.open_node.TYPE == 'pycom' and self.control_node.TYPE != 'no':
-            for _ in range(2):
-                LOGGER.debug("Power cycle %s board", self.open_node.TYPE)
-                ret_val += self.control_node.open_stop()
-                ret_val += wait_no_tty(self.open_node.TTY, timeout=10)
-                ret_val += self.control_node.open_start()
-                ret_val += wait_tty(self.open_node.TTY, LOGGER, timeout=10)
+            ret_val += self._pycom_power_cycle()
         # Configure Open Node
         ret_val += self.open_node.setup(firmware_path)
         # Configure experiment and monitoring on ControlNode
@@ -173,10 +215,7 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         # becomes fully usable.
         if (firmware_path is not None and
                 self._board_require_power_cycle(self.open_node.TYPE)):
-            LOGGER.info("Power cycle node %s",
-                        self.control_node.node_id.replace('_', '-'))
-            ret_val += self.control_node.open_stop()
-            ret_val += self.control_node.open_start()
+            ret_val += self._power_cycle()
 
         if timeout != 0:
             LOGGER.debug("Setting timeout to: %d", timeout)
@@ -186,13 +225,88 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         LOGGER.info("Start experiment succeeded")
         return ret_val
 
-    @common.synchronous('rlock')
+    def _prepare_user_exp_files(self, user, exp_id):
+        """ Create user experiment files, and folders when required """
+        if (self.board_cfg.robot_type == 'turtlebot2' or
+                self.board_cfg.cn_class.TYPE == 'no'):  # pragma: no cover
+            LOGGER.info('Create user exp folder')
+            self._create_user_exp_folders(user, exp_id)
+
+        return self.create_user_exp_files(self.board_cfg.node_id,
+                                          user, exp_id)
+
+    def _check_firmware(self, firmware_path):
+        """ Check firmware target matches open node
+
+        :raises ValueError: invalid firmware target """
+        if not elftarget.is_compatible_with_node(firmware_path,
+                                                 self.open_node):
+            raise ValueError('Invalid firmware target, aborting experiment.')
+
+    @staticmethod
+    def _exp_start_checks_error(checks):
+        """ Return 1 if exp_start arguments are invalid, 0 otherwise.
+
+        User files are not created with invalid arguments.
+        :raises: the user files creation error """
+        for name in ('profile', 'firmware'):
+            error = checks.results[name].error
+            if isinstance(error, ValueError):
+                LOGGER.error('%r', error)
+                return 1
+        checks.raise_error()
+        return 0
+
+    @staticmethod
+    def _observe_steps(graph):
+        """ Record `graph` steps durations in metrics """
+        for name, result in graph.results.items():
+            if not result.skipped:
+                operation = f'GatewayManager.{graph.name}.{name}'
+                metrics.REGISTRY.observe(operation, '', result.duration,
+                                         result.failed)
+
+    def _pycom_power_cycle(self):
+        """ Power cycle pycom board twice, waiting for its tty """
+        ret_val = 0
+        for _ in range(2):
+            LOGGER.debug("Power cycle %s board", self.open_node.TYPE)
+            ret_val += self.control_node.open_stop()
+            ret_val += wait_no_tty(self.open_node.TTY, timeout=10)
+            ret_val += self.control_node.open_start()
+            ret_val += wait_tty(self.open_node.TTY, LOGGER, timeout=10)
+        return ret_val
+
+    def _power_cycle(self):
+        """ Power cycle open node """
+        LOGGER.info("Power cycle node %s",
+                    self.control_node.node_id.replace('_', '-'))
+        ret_val = 0
+        ret_val += self.control_node.open_stop()
+        ret_val += self.control_node.open_start()
+        return ret_val
+
     def _timeout_exp_stop(self, exp_id, user):
         """ Run exp_stop after timeout.
 
-        Should stop only if experiment is the same as the experiment
-        that started the timer """
+        Retried while the command queue is full or busy, until the
+        experiment that started the timer is stopped """
         LOGGER.info("Timeout experiment: %r %r", user, exp_id)
+        while (self.exp_id, self.user) == (exp_id, user):
+            try:
+                self._timeout_exp_stop_queued(exp_id, user)
+                return
+            except command_queue.CommandQueueError as err:
+                LOGGER.warning('Timeout experiment stop not queued: %s, '
+                               'retry in %ss', err.strerror,
+                               self.TIMEOUT_STOP_RETRY)
+            time.sleep(self.TIMEOUT_STOP_RETRY)
+
+    @command_queue.queued('queue', 'exp_stop')
+    @common.synchronous('rlock')
+    def _timeout_exp_stop_queued(self, exp_id, user):
+        """ Stop experiment, only if experiment is the same as the experiment
+        that started the timer """
         if (self.exp_id, self.user) != (exp_id, user):
             return
 
@@ -200,18 +314,24 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         try:
             self.exp_stop()
         except EnvironmentError as err:
-            print("EnvironmentError", err)
+            LOGGER.error('Timeout experiment stop: %r', err)
             if err.errno == errno.EWOULDBLOCK:
                 LOGGER.warning('timeout_exp_stop would block hope its OK')
                 return
             raise
 
+    @command_queue.queued('queue')
     @common.synchronous('rlock')
+    @after_cleaning
     @logger_call("Gateway Manager : Stop experiment")
-    def exp_stop(self):
+    def exp_stop(self, background=False):
         """
         Stop the current running experiment
 
+        :param background: Only stop user visible parts: monitoring, serial
+            redirection and user files. Open node cleanup and control node
+            stop are run in background, following commands wait for it.
+
         Experiment stop steps
 
         1) Clear expiration timeout
@@ -219,6 +339,8 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         3) Cleanup OpenNode
         4) Stop control node
         5) Cleanup empty user experiment files
+        6) Convert measures files to columnar files in background, if
+           'oml_columnar' is configured
         """
         LOGGER.info("Stop experiment")
 
@@ -232,13 +354,19 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
 
         # Cleanup Control node Monitoring and experiment #
         ret_val += self.control_node.stop_experiment()
-        # Pycom TTY must be available before it's teared down.
-        if self.open_node.TYPE == 'pycom':
-            wait_tty(self.open_node.TTY, LOGGER, timeout=10)
-        # Cleanup open node
-        ret_val += self.open_node.teardown()
-        # Stop control node interaction
-        self.control_node.stop()
+        # Measures files are complete once control node is stopped
+        convert_files = self.exp_files if self.oml_columnar else {}
+        if background:
+            ret_val += self._stop_serial_redirection()
+            self._cleaning = Thread(target=self._background_nodes_teardown,
+                                    args=(convert_files,),
+                                    name='nodes_cleaning')
+            self._cleaning.start()
+        else:
+            ret_val += self._nodes_teardown()
+            self._convert_user_exp_files(convert_files)
+        self._set_serial_capture({})
+        self._set_serial_timestamps(False)
 
         # Remove empty user experiment files
         self.cleanup_user_exp_files(self.exp_files)
@@ -255,7 +383,73 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
 
         return ret_val
 
+    def _nodes_teardown(self):
+        """ Cleanup open node and stop control node interaction """
+        ret_val = 0
+        # Pycom TTY must be available before it's teared down.
+        if self.open_node.TYPE == 'pycom':
+            wait_tty(self.open_node.TTY, LOGGER, timeout=10)
+        # Cleanup open node
+        ret_val += self.open_node.teardown()
+        # Stop control node interaction
+        self.control_node.stop()
+        return ret_val
+
+    def _stop_serial_redirection(self):
+        """ Stop open node serial redirection if any """
+        serial_redirection = getattr(self.open_node, 'serial_redirection',
+                                     None)
+        if serial_redirection is None:
+            return 0
+        return serial_redirection.stop()
+
+    def _set_serial_capture(self, exp_files):
+        """ Set open node serial capture file, if 'serial_capture' is
+        configured and there is an experiment log file """
+        serial_redirection = getattr(self.open_node, 'serial_redirection',
+                                     None)
+        if serial_redirection is None:
+            return
+        path = None
+        if self.serial_capture and 'log' in exp_files:
+            path = serial_capture.capture_path(exp_files['log'])
+        serial_redirection.capture_path = path
+
+    def _set_serial_timestamps(self, enabled):
+        """ Set open node serial redirection lines timestamps """
+        serial_redirection = getattr(self.open_node, 'serial_redirection',
+                                     None)
+        if serial_redirection is not None:
+            serial_redirection.timestamps = enabled
+
+    def _background_nodes_teardown(self, convert_files=None):
+        """ Nodes teardown run in the cleaning thread
+
+        :param convert_files: experiment files to convert to columnar after
+        """
+        LOGGER.info("Nodes cleaning started")
+        ret = self._nodes_teardown()
+        if ret:
+            LOGGER.error('Nodes cleaning failed: ret = %d', ret)
+        LOGGER.info("Nodes cleaning done")
+        self._convert_user_exp_files(convert_files or {})
+
+    @property
+    def is_cleaning(self):
+        """ Nodes cleaning is running in background """
+        return self._cleaning is not None and self._cleaning.is_alive()
+
+    def wait_cleaning(self):
+        """ Wait until nodes background cleaning is done """
+        if self._cleaning is None:
+            return
+        if self._cleaning.is_alive():
+            LOGGER.info('Wait nodes cleaning')
+        self._cleaning.join()
+        self._cleaning = None
+
     @common.synchronous('rlock')
+    @after_cleaning
     def exp_update_profile(self, profile_dict):
         """ Update the experiment profile """
         LOGGER.info('Update experiment profile')
@@ -273,6 +467,7 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         return ret
 
     @common.synchronous('rlock')
+    @after_cleaning
     @logger_call("Gateway Manager : Start open node power")
     def open_power_start(self, power=None):
         """ Power on the open node """
@@ -283,6 +478,7 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         return ret
 
     @common.synchronous('rlock')
+    @after_cleaning
     @logger_call("Gateway Manager : Stop open node power")
     def open_power_stop(self, power=None):
         """ Power off the open node """
@@ -293,9 +489,12 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         return ret
 
     @common.synchronous('rlock')
+    @after_cleaning
     def open_debug_start(self):
         """ Start open node debugger """
         LOGGER.info('Open node debugger start')
+        # debugger may modify the node flash
+        firmware_state.FIRMWARE_STATE.invalidate(self._nodes['open'])
 
         ret = self._nodes['open'].debug_start()
         if ret != 0:  # pragma: no cover
@@ -303,6 +502,7 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         return ret
 
     @common.synchronous('rlock')
+    @after_cleaning
     def open_debug_stop(self):
         """ Stop open node debugger """
         LOGGER.info('Open node debugger stop')
@@ -313,6 +513,7 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         return ret
 
     @common.synchronous('rlock')
+    @after_cleaning
     @logger_call("Gateway Manager : Soft reset of open node")
     def node_soft_reset(self, node):
         """
@@ -330,6 +531,7 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         return ret
 
     @common.synchronous('rlock')
+    @after_cleaning
     @logger_call("Gateway Manager : Flash of node")
     def node_flash(self, node, firmware_path, binary=False, offset=0):
         """
@@ -356,19 +558,71 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         return ret
 
     @common.synchronous('rlock')
+    @after_cleaning
     def auto_tests(self, channel, blink, flash, gps):
         """ Run Auto-tests on nodes and gateway """
         autotest_manager = autotest.AutoTestManager(self)
         return autotest_manager.auto_tests(channel, blink, flash, gps)
 
+    @command_queue.queued('queue')
     @common.synchronous('rlock')
+    @after_cleaning
+    def batch(self, steps, stop_on_error=True):
+        """ Run a sequence of operations with the lock held all along
+
+        :param steps: list of (name, function, kwargs), run in order
+        :param stop_on_error: skip the steps following a failed one
+        :returns: (ret, results), `ret` is the sum of steps return values,
+            `results` has the return value and duration of each step
+        """
+        ret = 0
+        results = []
+        for name, func, kwargs in steps:
+            if ret and stop_on_error:
+                results.append({'op': name, 'skipped': True})
+                continue
+
+            LOGGER.info('Batch: run %s', name)
+            result = {'op': name}
+            t_start = time.monotonic()
+            try:
+                result['ret'] = func(**kwargs)
+            except Exception as err:  # pylint:disable=broad-except
+                LOGGER.error('Batch: %s failed: %r', name, err)
+                result.update(ret=1, error=str(err))
+            result['duration'] = time.monotonic() - t_start
+            ret += result['ret']
+            results.append(result)
+        return ret, results
+
     def status(self):
-        """ Run a node sanity status check """
+        """ Run a node sanity status check
+
+        Without USB inventory, ftdi checks run commands, so run with lock """
+        if usb_inventory.INVENTORY.running:
+            return self._status()
+        return self._locked_status()
+
+    @common.synchronous('rlock')
+    def _locked_status(self):
+        """ Nodes status check with lock """
+        return self._status()
+
+    def _status(self):
+        """ Nodes status check """
         ret = 0
         ret += self.control_node.status()
         ret += self.open_node.status()
         return ret
 
+    def measures_published(self):
+        """ Control node publishes the experiment measures to the hub """
+        return self.control_node.measures_published()
+
+    def measures_window(self, seconds=None):
+        """ Return the control node last `seconds` measures, without lock """
+        return self.control_node.measures_window(seconds)
+
     @common.synchronous('rlock')
     def sleep(self, seconds):
         """Sleep `seconds` seconds."""
@@ -396,6 +650,13 @@ class GatewayManager:  # pylint:disable=too-many-instance-attributes
         for exp_file in exp_files.values():
             config.clean_user_file(exp_file)
 
+    @staticmethod
+    def _convert_user_exp_files(exp_files):
+        """ Convert measures files to columnar in background """
+        oml_columnar.CONVERTER.submit(
+            exp_files[stream] for stream in oml_columnar.STREAMS
+            if stream in exp_files)
+
 # Exp folders creation used in tests
 
     @staticmethod
@@ -390,6 +390,40 @@ class TestComplexExperimentRunning(ExperimentRunningMock):
             assert os.path.isfile(exp_files[meas_type])
             os.remove(exp_files[meas_type])
 
+    def test_m3_exp_with_sniffer_pcapng(self):
+        """ Run an experiment with sniffer frames written as pcapng
+
+        The serial interface sniffer OML header must have the columns read
+        by the sniffer, or the OML stream is copied with an error """
+        if self.board_cfg.cn_type != 'iotlab':
+            pytest.skip("Not an iotlab control node (requires radio)")
+
+        if self.board_cfg.board_class.TYPE != 'm3':
+            pytest.skip("Not an M3")
+
+        read_config = config.read_config
+
+        def _read_config(key, default=IOError):
+            if key == 'sniffer_pcapng':
+                return 'true'
+            return read_config(key, default)
+
+        files = [
+            file_tuple('firmware', self.board_cfg.board_class.FW_AUTOTEST),
+            file_tuple('profile', CURRENT_DIR + 'profile_sniffer.json'),
+        ]
+        with patch('gateway_code.config.read_config', _read_config):
+            ret = self.server.post(EXP_START, upload_files=files)
+        self.assertEqual(0, ret.json['ret'])
+        sniffer = self.g_m.control_node.sniffer
+        self.assertIsNotNone(sniffer)
+        time.sleep(5)
+
+        self.assertEqual(0, self.server.delete('/exp/stop').json['ret'])
+        self.log_error.check()
+        self.assertIsNone(self.g_m.control_node.sniffer)
+        self.assertIsNotNone(sniffer.columns)
+
     def test_exp_with_fastest_measures(self):
         """ Run an experiment with fastest measures."""
 
@@ -456,9 +490,24 @@ class TestManagerLocked(ExperimentRunningMock):
         time.sleep(0.5)
         try:
             # RestServer busy with 'sleep', cannot start a new experiment
-            # Error 503
+            # before queue timeout, Error 503
             error_status = 503
-            self.server.post(EXP_START, status=error_status)
+            extra = query_string('queue_timeout=1')
+            ret = self.server.post(EXP_START, extra_environ=extra,
+                                   status=error_status)
+            self.assertEqual(0, ret.json['position'])
+        finally:
+            thr_blocking.join()
+
+    def test_queued_requests(self):
+        """Test new experiment waits for the manager to be free."""
+        thr_blocking = Thread(target=self.server.get, args=('/sleep/2',))
+        thr_blocking.start()
+        time.sleep(0.5)
+        try:
+            ret = self.server.post(EXP_START)
+            self.assertEqual(0, ret.json['ret'])
+            self.assertEqual(0, self.server.delete('/exp/stop').json['ret'])
         finally:
             thr_blocking.join()
 
@@ -0,0 +1,169 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Operations metrics, exported in Prometheus text format
+
+Operations decorated with `common.logger_call` record their duration and
+failures in `REGISTRY`. Labels are the operation name, the node type
+implementing it and the `const_labels` of the registry (board type).
+"""
+
+import threading
+
+# Flash and experiment operations take from milliseconds to minutes
+BUCKETS = (0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Histogram:  # pylint:disable=too-few-public-methods
+    """ Cumulative histogram of observed values """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """ Add `value` to the histogram """
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ Yield (le, cumulative_count) """
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield str(bound), total
+
+
+class MetricsRegistry:
+    """ Operations duration histograms and errors counters """
+    DURATION = 'gateway_operation_duration_seconds'
+    ERRORS = 'gateway_operation_errors_total'
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.const_labels = {}
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._errors = {}
+
+    def observe(self, operation, node_type, duration, error=False):
+        """ Record an `operation` execution on `node_type` """
+        key = (operation, node_type)
+        with self._lock:
+            hist = self._durations.get(key)
+            if hist is None:
+                hist = self._durations[key] = _Histogram(self.buckets)
+                self._errors[key] = 0
+            hist.observe(duration)
+            self._errors[key] += int(bool(error))
+
+    def mean(self, operation):
+        """ Mean duration of `operation` on all node types, None if never run
+
+        >>> reg = MetricsRegistry()
+        >>> reg.mean('op') is None
+        True
+        >>> reg.observe('op', 'm3', 1.0)
+        >>> reg.observe('op', 'a8', 2.0)
+        >>> reg.mean('op')
+        1.5
+        """
+        with self._lock:
+            hists = [hist for (oper, _), hist in self._durations.items()
+                     if oper == operation]
+            count = sum(hist.count for hist in hists)
+            if not count:
+                return None
+            return sum(hist.sum for hist in hists) / count
+
+    def reset(self):
+        """ Remove all the recorded values """
+        with self._lock:
+            self._durations.clear()
+            self._errors.clear()
+
+    def _labels(self, operation, node_type, **extra):
+        """ Prometheus labels string """
+        labels = dict(self.const_labels, operation=operation,
+                      node_type=node_type, **extra)
+        values = ','.join(f'{name}="{_escape(value)}"'
+                          for name, value in sorted(labels.items()))
+        return '{' + values + '}'
+
+    def prometheus(self):
+        """ Export metrics in Prometheus text format
+
+        >>> reg = MetricsRegistry(buckets=(1, 10))
+        >>> reg.const_labels['board'] = 'm3'
+        >>> reg.observe('Node.flash', 'm3', 2.5, error=True)
+        >>> print(reg.prometheus())  # doctest: +NORMALIZE_WHITESPACE
+        # HELP gateway_operation_duration_seconds Gateway operations duration
+        # TYPE gateway_operation_duration_seconds histogram
+        gateway_operation_duration_seconds_bucket{board="m3",le="1",\
+node_type="m3",operation="Node.flash"} 0
+        gateway_operation_duration_seconds_bucket{board="m3",le="10",\
+node_type="m3",operation="Node.flash"} 1
+        gateway_operation_duration_seconds_bucket{board="m3",le="+Inf",\
+node_type="m3",operation="Node.flash"} 1
+        gateway_operation_duration_seconds_sum{board="m3",\
+node_type="m3",operation="Node.flash"} 2.5
+        gateway_operation_duration_seconds_count{board="m3",\
+node_type="m3",operation="Node.flash"} 1
+        # HELP gateway_operation_errors_total Gateway operations failures
+        # TYPE gateway_operation_errors_total counter
+        gateway_operation_errors_total{board="m3",\
+node_type="m3",operation="Node.flash"} 1
+        """
+        lines = [f'# HELP {self.DURATION} Gateway operations duration',
+                 f'# TYPE {self.DURATION} histogram']
+        with self._lock:
+            for key, hist in sorted(self._durations.items()):
+                for bound, count in hist.cumulative():
+                    labels = self._labels(*key, le=bound)
+                    lines.append(f'{self.DURATION}_bucket{labels} {count}')
+                labels = self._labels(*key)
+                lines.append(f'{self.DURATION}_sum{labels} {hist.sum:.6g}')
+                lines.append(f'{self.DURATION}_count{labels} {hist.count}')
+
+            lines += [f'# HELP {self.ERRORS} Gateway operations failures',
+                      f'# TYPE {self.ERRORS} counter']
+            for key, errors in sorted(self._errors.items()):
+                lines.append(f'{self.ERRORS}{self._labels(*key)} {errors}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    """ Escape label value backslashes and double quotes """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+REGISTRY = MetricsRegistry()
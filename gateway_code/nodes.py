@@ -55,7 +55,7 @@ class ControlNodeBase(NodeBase):
     """ Class to inherit, for control node classes """
 
     @abc.abstractmethod
-    def start(self, exp_id, exp_files=None):
+    def start(self, exp_id, exp_files=None, profile=None):
         """ This method is called when starting an experiment """
         # pragma: no cover
 
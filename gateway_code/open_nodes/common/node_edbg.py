@@ -25,6 +25,7 @@ import logging
 from gateway_code import common
 from gateway_code.common import logger_call
 from gateway_code.nodes import OpenNodeBase
+from gateway_code.utils import firmware_state
 
 from gateway_code.utils.openocd import OpenOCD
 from gateway_code.utils.edbg import Edbg
@@ -67,8 +68,7 @@ class NodeEdbgBase(OpenNodeBase):
         self._in_debug = False
         ret_val = 0
 
-        common.wait_no_tty(self.TTY)
-        ret_val += common.wait_tty(self.TTY, LOGGER)
+        ret_val += common.wait_tty_stable(self.TTY, LOGGER)
         ret_val += self.flash(firmware_path)
         ret_val += self.serial_redirection.start()
         return ret_val
@@ -82,8 +82,7 @@ class NodeEdbgBase(OpenNodeBase):
         # And then restarted again in cn teardown.
         # This leads to problem where the TTY disappears and reappears during
         # the first 2 seconds. So let some time if it wants to disappear first.
-        common.wait_no_tty(self.TTY)
-        ret_val += common.wait_tty(self.TTY, LOGGER)
+        ret_val += common.wait_tty_stable(self.TTY, LOGGER)
         # cleanup debugger before flashing
         ret_val += self.debug_stop()
         ret_val += self.serial_redirection.stop()
@@ -97,10 +96,15 @@ class NodeEdbgBase(OpenNodeBase):
         :param firmware_path: Path to the firmware to be flashed on `node`.
                               If None, flash 'idle' firmware.
         """
+        self._current_fw = firmware_path or self.FW_IDLE
+        return self._flash(firmware_path, binary, offset)
+
+    @firmware_state.tracked('FW_IDLE')
+    def _flash(self, firmware_path, binary, offset):
+        """ Flash firmware with edbg, or openocd when debugging """
         firmware_path = firmware_path or self.FW_IDLE
         LOGGER.info('Flash firmware on %s: %s',
                     self.TYPE.upper(), firmware_path)
-        self._current_fw = firmware_path
 
         if self._in_debug:
             return self.openocd.flash(firmware_path, binary, offset)
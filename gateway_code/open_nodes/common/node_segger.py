@@ -27,6 +27,7 @@ import serial
 from gateway_code import common
 from gateway_code.common import logger_call
 from gateway_code.nodes import OpenNodeBase
+from gateway_code.utils import firmware_state
 
 from gateway_code.utils.segger import Segger
 from gateway_code.utils.serial_redirection import SerialRedirection
@@ -75,8 +76,7 @@ class NodeSeggerBase(OpenNodeBase):
         """ Flash open node, create serial redirection """
         ret_val = 0
 
-        common.wait_no_tty(self.TTY)
-        ret_val += common.wait_tty(self.TTY, LOGGER)
+        ret_val += common.wait_tty_stable(self.TTY, LOGGER)
         ret_val += self.flash(firmware_path)
         ret_val += self.serial_redirection.start()
         return ret_val
@@ -89,14 +89,14 @@ class NodeSeggerBase(OpenNodeBase):
         # And then restarted again in cn teardown.
         # This leads to problem where the TTY disappears and reappears during
         # the first 2 seconds. So let some time if it wants to disappear first.
-        common.wait_no_tty(self.TTY)
-        ret_val += common.wait_tty(self.TTY, LOGGER)
+        ret_val += common.wait_tty_stable(self.TTY, LOGGER)
         # cleanup debugger before flashing
         ret_val += self.debug_stop()
         ret_val += self.serial_redirection.stop()
         ret_val += self.flash(None)
         return ret_val
 
+    @firmware_state.tracked('FW_IDLE')
     @logger_call("Node Segger: flash of segger node")
     def flash(self, firmware_path=None, binary=False, offset=0):
         """ Flash the given firmware on segger node
@@ -81,10 +81,10 @@ class TestNodeEdbgBase(unittest.TestCase):
         assert self.node.programmer == self.node.edbg
 
     @patch('gateway_code.common.wait_tty')
-    @patch('gateway_code.common.wait_no_tty')
-    def test_edbg_node_flash(self, no_tty, tty):
+    @patch('gateway_code.common.wait_tty_stable')
+    def test_edbg_node_flash(self, tty_stable, tty):
         """Test flash function of an edbg based node."""
-        no_tty.return_value = 0
+        tty_stable.return_value = 0
         tty.return_value = 0
         # Setup the node
         assert self.node.setup(self.fw_path) == 0
@@ -109,11 +109,11 @@ class TestNodeEdbgBase(unittest.TestCase):
         self.node.edbg.flash.assert_called_with(self.fw_path, True, 42)
 
     @patch('gateway_code.common.wait_tty')
-    @patch('gateway_code.common.wait_no_tty')
-    def test_edbg_node_flash_with_debug(self, no_tty, tty):
+    @patch('gateway_code.common.wait_tty_stable')
+    def test_edbg_node_flash_with_debug(self, tty_stable, tty):
         # pylint:disable=protected-access
         """Test flash function of an edbg based node while in debug session."""
-        no_tty.return_value = 0
+        tty_stable.return_value = 0
         tty.return_value = 0
         # Setup the node
         assert self.node.debug_start() == 0
@@ -84,10 +84,10 @@ class TestNodeOpenOCDBase(unittest.TestCase):
 
     @patch('serial.Serial')
     @patch('gateway_code.common.wait_tty')
-    @patch('gateway_code.common.wait_no_tty')
-    def test_openocd_node_flash(self, no_tty, tty, ser):
+    @patch('gateway_code.common.wait_tty_stable')
+    def test_openocd_node_flash(self, tty_stable, tty, ser):
         """Test flash function of an openocd based node."""
-        no_tty.return_value = 0
+        tty_stable.return_value = 0
         tty.return_value = 0
         # Setup the node
         assert self.node.setup(self.fw_path) == 0
@@ -95,14 +95,14 @@ class TestNodeOpenOCDBase(unittest.TestCase):
         self.node.openocd.flash.assert_called_with(
             self.fw_path, False, self.node.ROM_START_ADDR)
         assert ser.call_count == 0
-        assert tty.call_count == 1
+        assert tty_stable.call_count == 1
 
         # Teardown the node
-        tty.call_count = 0
+        tty_stable.call_count = 0
         assert self.node.teardown() == 0
         self.node.openocd.flash.assert_called_with(
             self.node.FW_IDLE, False, self.node.ROM_START_ADDR)
-        assert tty.call_count == 1
+        assert tty_stable.call_count == 1
 
         # Flash a firmware
         assert self.node.flash(self.fw_path) == 0
@@ -28,6 +28,7 @@ from gateway_code.common import logger_call
 
 from gateway_code.utils.cc2538 import CC2538
 from gateway_code.nodes import OpenNodeBase
+from gateway_code.utils import firmware_state
 from gateway_code.utils.serial_redirection import SerialRedirection
 
 LOGGER = logging.getLogger('gateway_code')
@@ -75,8 +76,7 @@ class NodeFirefly(OpenNodeBase):
         """ Flash open node, create serial redirection """
         ret_val = 0
 
-        common.wait_no_tty(self.TTY)
-        ret_val += common.wait_tty(self.TTY, LOGGER)
+        ret_val += common.wait_tty_stable(self.TTY, LOGGER)
         ret_val += self.do_flash(firmware_path, toggle_redirect=False)
         ret_val += self.serial_redirection.start()
         return ret_val
@@ -86,8 +86,7 @@ class NodeFirefly(OpenNodeBase):
         """ Stop serial redirection and flash idle firmware """
         ret_val = 0
 
-        common.wait_no_tty(self.TTY)
-        ret_val += common.wait_tty(self.TTY, LOGGER)
+        ret_val += common.wait_tty_stable(self.TTY, LOGGER)
         ret_val += self.serial_redirection.stop()
         ret_val += self.do_flash(None, toggle_redirect=False)
         return ret_val
@@ -104,6 +103,7 @@ class NodeFirefly(OpenNodeBase):
 
         return self.do_flash(firmware_path, True)
 
+    @firmware_state.tracked('FW_IDLE')
     @logger_call("Node firefly : flash of firefly node")
     def do_flash(self, firmware_path=None, toggle_redirect=True):
         """ Flash the given firmware on firefly node
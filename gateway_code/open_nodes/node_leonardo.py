@@ -143,8 +143,7 @@ class NodeLeonardo(OpenNodeBase):
         Also, got some problems when using the tty directly after appearing, so
         git it some delay.
         """
-        common.wait_no_tty(self.TTY)
-        ret = common.wait_tty(self.TTY, LOGGER)
+        ret = common.wait_tty_stable(self.TTY, LOGGER)
         # wait tty ready to speak
         time.sleep(self.TTY_READY_DELAY)
         return ret
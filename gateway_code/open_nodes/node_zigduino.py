@@ -32,6 +32,7 @@ from gateway_code.config import static_path
 from gateway_code import common
 from gateway_code.common import logger_call
 from gateway_code.nodes import OpenNodeBase
+from gateway_code.utils import firmware_state
 
 from gateway_code.utils.avrdude import AvrDude
 from gateway_code.utils.serial_redirection import SerialRedirection
@@ -91,9 +92,7 @@ class NodeZigduino(OpenNodeBase):
         """ Flash open node, create serial redirection """
         ret_val = 0
         # it appears that /dev/ttyON_ZIGDUINO need some time to be detected
-        common.wait_no_tty(self.TTY, timeout=common.TTY_DETECT_TIME)
-        ret_val += common.wait_tty(self.TTY, LOGGER,
-                                   timeout=common.TTY_DETECT_TIME)
+        ret_val += common.wait_tty_stable(self.TTY, LOGGER)
         ret_val += self.do_flash(firmware_path, redirect=False)
         ret_val += self.disable_dtr()
         ret_val += self.serial_redirection.start()
@@ -104,9 +103,7 @@ class NodeZigduino(OpenNodeBase):
         """ Stop serial redirection and flash idle firmware """
         ret_val = 0
 
-        common.wait_no_tty(self.TTY, timeout=common.TTY_DETECT_TIME)
-        ret_val += common.wait_tty(
-            self.TTY, LOGGER, timeout=common.TTY_DETECT_TIME)
+        ret_val += common.wait_tty_stable(self.TTY, LOGGER)
         ret_val += self.serial_redirection.stop()
         # Reboot needs 8 seconds before ending linux sees it in < 2 seconds
         ret_val += common.wait_tty(self.TTY, LOGGER, timeout=10)
@@ -123,6 +120,7 @@ class NodeZigduino(OpenNodeBase):
         """
         return self.do_flash(firmware_path, binary, offset, True)
 
+    @firmware_state.tracked('FW_IDLE')
     @logger_call("Flash of Zigduino node")
     def do_flash(self, firmware_path=None, binary=False,
                  offset=0, redirect=True):  # pylint:disable=unused-argument
@@ -146,9 +144,7 @@ class NodeZigduino(OpenNodeBase):
         LOGGER.info('Flash firmware on Zigduino: %s', firmware_path)
         # First stop serial redirection, flash hangup if an
         # user session is openened on port 20000
-        common.wait_no_tty(self.TTY, timeout=common.TTY_DETECT_TIME)
-        ret_val += common.wait_tty(
-            self.TTY, LOGGER, timeout=common.TTY_DETECT_TIME)
+        ret_val += common.wait_tty_stable(self.TTY, LOGGER)
         if redirect:
             ret_val += self.serial_redirection.stop()
         # Then flash
@@ -59,42 +59,42 @@ class TestNodeFirefly(unittest.TestCase):
         # programmer instance
         assert self.node.programmer == self.node.cc2538
 
-    @patch('gateway_code.common.wait_no_tty')
-    def test_setup(self, wait_no_tty, wait_tty):
+    @patch('gateway_code.common.wait_tty_stable')
+    def test_setup(self, wait_tty_stable, wait_tty):
         """Test setup function of a firefly node."""
-        wait_no_tty.return_value = 0
+        wait_tty_stable.return_value = 0
         wait_tty.return_value = 0
         assert self.node.setup(self.fw_path) == 0
-        wait_tty.assert_called_once()
-        wait_no_tty.assert_called_once()
+        assert wait_tty.call_count == 0
+        wait_tty_stable.assert_called_once()
         self.node.cc2538.flash.assert_called_once()
         self.node.cc2538.flash.assert_called_with(self.fw_path)
         self.node.serial_redirection.start.assert_called_once()
         assert self.node.serial_redirection.stop.call_count == 0
 
-    @patch('gateway_code.common.wait_no_tty')
-    def test_teardown(self, wait_no_tty, wait_tty):
+    @patch('gateway_code.common.wait_tty_stable')
+    def test_teardown(self, wait_tty_stable, wait_tty):
         """Test teardown of a firefly node."""
-        wait_no_tty.return_value = 0
+        wait_tty_stable.return_value = 0
         wait_tty.return_value = 0
         # Teardown the node
         assert self.node.teardown() == 0
         self.node.cc2538.flash.assert_called_with(self.node.FW_IDLE)
-        wait_tty.assert_called_once()
-        wait_no_tty.assert_called_once()
+        assert wait_tty.call_count == 0
+        wait_tty_stable.assert_called_once()
         self.node.serial_redirection.stop.assert_called_once()
         assert self.node.serial_redirection.start.call_count == 0
 
-    @patch('gateway_code.common.wait_no_tty')
-    def test_flash(self, wait_no_tty, wait_tty):
+    @patch('gateway_code.common.wait_tty_stable')
+    def test_flash(self, wait_tty_stable, wait_tty):
         """Test flash of a firefly node."""
-        wait_no_tty.return_value = 0
+        wait_tty_stable.return_value = 0
         wait_tty.return_value = 0
         # Flash a firmware
         assert self.node.flash(self.fw_path) == 0
         self.node.cc2538.flash.assert_called_with(self.fw_path)
         assert wait_tty.call_count == 0
-        assert wait_no_tty.call_count == 0
+        assert wait_tty_stable.call_count == 0
 
         # verify binary mode is not supported
         assert self.node.flash(self.fw_path, binary=True) == 1
@@ -106,4 +106,4 @@ class TestNodeFirefly(unittest.TestCase):
         assert self.node.flash() == 0
         self.node.cc2538.flash.assert_called_with(self.node.FW_IDLE)
         assert wait_tty.call_count == 0
-        assert wait_no_tty.call_count == 0
+        assert wait_tty_stable.call_count == 0
@@ -81,15 +81,15 @@ class TestNodeZigduino(unittest.TestCase):
         assert self.node.reset() == 1
         assert wait_tty.call_count == 0
 
-    @patch('gateway_code.common.wait_no_tty')
-    def test_setup(self, wait_no_tty, wait_tty):
+    @patch('gateway_code.common.wait_tty_stable')
+    def test_setup(self, wait_tty_stable, wait_tty):
         """Test setup function of a zigduino node."""
-        wait_no_tty.return_value = 0
+        wait_tty_stable.return_value = 0
         wait_tty.return_value = 0
         # Setup the node
         assert self.node.setup(self.fw_path) == 0
-        assert wait_tty.call_count == 3
-        assert wait_no_tty.call_count == 2
+        assert wait_tty.call_count == 1
+        assert wait_tty_stable.call_count == 2
         assert self.node.avrdude.flash.call_count == 1
         self.node.avrdude.flash.assert_called_once()
         self.node.avrdude.flash.assert_called_with(self.fw_path)
@@ -98,33 +98,33 @@ class TestNodeZigduino(unittest.TestCase):
 
         # Setup with serial error
         wait_tty.call_count = 0
-        wait_no_tty.call_count = 0
+        wait_tty_stable.call_count = 0
         self.serial.side_effect = SerialException('Error')
         assert self.node.setup(self.fw_path) == 1
-        assert wait_tty.call_count == 3
-        assert wait_no_tty.call_count == 2
+        assert wait_tty.call_count == 1
+        assert wait_tty_stable.call_count == 2
 
-    @patch('gateway_code.common.wait_no_tty')
-    def test_teardown(self, wait_no_tty, wait_tty):
+    @patch('gateway_code.common.wait_tty_stable')
+    def test_teardown(self, wait_tty_stable, wait_tty):
         """Test teardown of a zigduino node."""
-        wait_no_tty.return_value = 0
+        wait_tty_stable.return_value = 0
         wait_tty.return_value = 0
         assert self.node.teardown() == 0
-        assert wait_tty.call_count == 4
-        assert wait_no_tty.call_count == 2
+        assert wait_tty.call_count == 2
+        assert wait_tty_stable.call_count == 2
         self.node.avrdude.flash.assert_called_with(self.node.FW_IDLE)
         self.node.serial_redirection.stop.assert_called_once()
         assert self.node.serial_redirection.start.call_count == 0
 
-    @patch('gateway_code.common.wait_no_tty')
-    def test_flash(self, wait_no_tty, wait_tty):
+    @patch('gateway_code.common.wait_tty_stable')
+    def test_flash(self, wait_tty_stable, wait_tty):
         """Test flash of a zigduino node."""
-        wait_no_tty.return_value = 0
+        wait_tty_stable.return_value = 0
         wait_tty.return_value = 0
         # Flash a firmware
         assert self.node.flash(self.fw_path) == 0
-        assert wait_tty.call_count == 2
-        assert wait_no_tty.call_count == 1
+        assert wait_tty.call_count == 1
+        assert wait_tty_stable.call_count == 1
         self.node.avrdude.flash.assert_called_with(self.fw_path)
         self.node.serial_redirection.stop.assert_called_once()
         self.node.serial_redirection.start.assert_called_once()
@@ -137,8 +137,8 @@ class TestNodeZigduino(unittest.TestCase):
 
         # Flash idle firmware
         wait_tty.call_count = 0
-        wait_no_tty.call_count = 0
+        wait_tty_stable.call_count = 0
         assert self.node.flash() == 0
-        assert wait_tty.call_count == 2
-        assert wait_no_tty.call_count == 1
+        assert wait_tty.call_count == 1
+        assert wait_tty_stable.call_count == 1
         self.node.avrdude.flash.assert_called_with(self.node.FW_IDLE)
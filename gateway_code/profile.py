@@ -23,14 +23,41 @@
 """
 Profile module, implementing the 'Profile' class
 and methods to convert it to config commands
+
+Profiles and their configurations compare by value, so a profile can be
+diffed with the previously configured one.
 """
 
+import abc
+
 # pylint:disable=too-many-arguments,too-few-public-methods
 
 
-class Profile:
+class _Config(abc.ABC):
+
+    """ Configuration comparing by its `_key()` value """
+
+    @abc.abstractmethod
+    def _key(self):
+        """ Values identifying the configuration """
+        # pragma: no cover
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
 
-    """ Experiment monitoring Profile """
+class Profile(_Config):
+
+    """ Experiment monitoring Profile
+
+    Profiles are equal when they configure the same monitoring, whatever
+    their name """
+    PARTS = ('power', 'consumption', 'radio', 'aggregate')
 
     def __init__(self, open_node_type,  # pylint:disable=unused-argument
                  profilename, power,
@@ -56,6 +83,25 @@ class Profile:
         except TypeError as err:
             raise ValueError(f"Error in {_current} arguments {err}")
 
+    @property
+    def aggregate(self):
+        """ Consumption measures aggregation, None if not configured """
+        if self.consumption is None:
+            return None
+        return self.consumption.aggregate
+
+    def _key(self):
+        return tuple(getattr(self, part) for part in self.PARTS)
+
+    def diff(self, other):
+        """ Return the set of `PARTS` configured differently in `other`
+
+        All of them if `other` is None """
+        if other is None:
+            return set(self.PARTS)
+        return {part for part in self.PARTS
+                if getattr(self, part) != getattr(other, part)}
+
     @classmethod
     def from_dict(cls, open_node_type, profile_dict):
         """ Create Profile object from `profile_dict` and `open_node_type`
@@ -69,7 +115,7 @@ class Profile:
             raise ValueError(f"Invalid profile: {err}")
 
 
-class Consumption:
+class Consumption(_Config):
 
     """ Consumption monitoring configuration """
     choices = {
@@ -80,7 +126,8 @@ class Consumption:
     }
 
     def __init__(self, alim, source, period, average,
-                 power=False, voltage=False, current=False):
+                 power=False, voltage=False, current=False, *,
+                 aggregate=None):
         _err = "Required values period/average for consumption measure."
         assert period is not None and average is not None, _err
         period = int(period)
@@ -98,8 +145,52 @@ class Consumption:
         self.voltage = voltage
         self.current = current
 
+        self.aggregate = None
+        if aggregate is not None:
+            self.aggregate = Aggregate(**aggregate)
 
-class Radio:
+    @property
+    def fields(self):
+        """ Enabled measures, in the control node measures lines order """
+        return tuple(field for field in ('power', 'voltage', 'current')
+                     if getattr(self, field))
+
+    def _key(self):
+        # aggregation is done on the gateway, it is a separate profile part
+        return (self.source, self.period, self.average,
+                bool(self.power), bool(self.voltage), bool(self.current))
+
+
+class Aggregate(_Config):
+
+    """ Consumption measures windowed aggregation configuration
+
+    Measures are reduced to `stats` per `window_ms` window on the gateway,
+    raw measures are only written if `raw` is set """
+    choices = {
+        'window_ms': range(1, 3600 * 1000 + 1),
+        'stats': ('min', 'mean', 'max'),
+    }
+
+    def __init__(self, window_ms, stats=('mean',), raw=False):
+        window_ms = int(window_ms)
+        assert window_ms in self.choices['window_ms'], 'Window'
+        assert stats, 'No stats'
+        for stat in stats:
+            assert stat in self.choices['stats'], 'Stats'
+        assert isinstance(raw, bool), 'Raw'
+
+        self.window_ms = window_ms
+        # written in 'choices' order, whatever the given one
+        self.stats = tuple(stat for stat in self.choices['stats']
+                           if stat in stats)
+        self.raw = raw
+
+    def _key(self):
+        return (self.window_ms, self.stats, self.raw)
+
+
+class Radio(_Config):
 
     """ Radio monitoring configuration """
     choices = {
@@ -130,6 +221,11 @@ class Radio:
 
         self._is_valid()
 
+    def _key(self):
+        # channels are sent sorted without duplicates
+        return (self.mode, tuple(sorted(set(self.channels))), self.period,
+                self.num_per_channel)
+
     def _is_valid(self):
         """ raise ValueError if self is not a 'valid' configuration """
 
@@ -25,25 +25,35 @@
 REST server listening to the experiment handler
 """
 
+import math
+import inspect
 import argparse
 import json
 import errno
 import logging
 import functools
 import traceback
-from tempfile import NamedTemporaryFile
 
 import bottle
 from bottle import request
 
 from gateway_code.gateway_manager import GatewayManager
 from gateway_code import board_config
+from gateway_code import metrics
 from gateway_code.common import booleanize
+from gateway_code.utils.command_queue import CommandQueueError
+from gateway_code.utils.firmware_upload import FirmwareUpload
+from gateway_code.utils.jobs import JobTable
+from gateway_code.utils import measures_hub
+from gateway_code.utils import usb_inventory
 
 LOGGER = logging.getLogger('gateway_code')
 
+# Bottle server backends
+SERVERS = ('paste', 'waitress')
 
-class GatewayRest(bottle.Bottle):
+
+class GatewayRest(bottle.Bottle):  # pylint:disable=too-many-public-methods
 
     """
     Gateway Rest class
@@ -51,12 +61,29 @@ class GatewayRest(bottle.Bottle):
     It calls the `gateway_ manager` to handle commands
     """
 
-    def __init__(self, gateway_manager):
+    def __init__(self, gateway_manager, max_request_size=None):
         super().__init__()
         self.gateway_manager = gateway_manager
         self.board_config = board_config.BoardConfig()
+        self.jobs = JobTable()
+        self.max_request_size = max_request_size
+        self.add_hook('before_request', self._check_request_size)
         self._app_routing()
 
+    def _check_request_size(self):
+        """ Reject requests bodies bigger than `max_request_size`
+
+        Chunked bodies size is not known before reading them, reject them """
+        if self.max_request_size is None:
+            return
+        if request.chunked:
+            LOGGER.error('REST: Chunked request body rejected')
+            bottle.abort(411, 'Content-Length required')
+        if request.content_length > self.max_request_size:
+            LOGGER.error('REST: Request too large: %d bytes',
+                         request.content_length)
+            bottle.abort(413, 'Request body too large')
+
     def _app_routing(self):
         """
         Declare the REST supported methods depending on board config
@@ -64,7 +91,15 @@ class GatewayRest(bottle.Bottle):
         # GatewayManager global functions
         self.route('/exp/start/<exp_id:int>/<user>', 'POST', self.exp_start)
         self.route('/exp/stop', 'DELETE', self.exp_stop)
+        # query_string: streams=consumption,radio
+        self.cn_conditional_route('measures_published', '/exp/measures',
+                                  'GET', self.exp_measures)
+        self.route('/batch', 'POST', self.batch)
         self.route('/status', 'GET', self.status)
+        self.route('/status/inventory', 'GET', self.inventory)
+        self.route('/metrics', 'GET', self.metrics)
+        self.route('/queue', 'GET', self.queue)
+        self.route('/jobs/<job_id>', 'GET', self.job)
 
         # Control node functions
         self.route('/exp/update', 'POST', self.exp_update_profile)
@@ -72,6 +107,9 @@ class GatewayRest(bottle.Bottle):
                                   self.open_start)
         self.cn_conditional_route('open_stop', '/open/stop', 'PUT',
                                   self.open_stop)
+        # query_string: seconds=float
+        self.cn_conditional_route('measures_window', '/exp/measures/window',
+                                  'GET', self.measures_window)
         # Autotest functions
         # query_string: channel=int[11:26]
         self.route('/autotest', 'PUT', self.auto_tests)
@@ -99,6 +137,10 @@ class GatewayRest(bottle.Bottle):
         :param exp_id: experiment id
 
         Query string: 'timeout' int
+        Query string: 'queue_timeout' float, max time waiting in queue
+        Query string: 'async' bool, run in a job
+        Query string: 'serial_timestamps' bool, prefix open node serial
+            redirection lines with the gateway time
         """
 
         LOGGER.debug('REST: Start experiment: %s-%i', user, exp_id)
@@ -109,9 +151,19 @@ class GatewayRest(bottle.Bottle):
         except ValueError:
             timeout = 0
 
-        # Extract firmware file
-        firmware_file = self._extract_firmware()
-        firmware = firmware_file.name if firmware_file else None
+        try:
+            queue_timeout = self._queue_timeout()
+        except ValueError:
+            return {'ret': 1, 'error': "Invalid 'queue_timeout' value"}
+        try:
+            run_async = self._async_mode()
+        except ValueError:
+            return {'ret': 1, 'error': "Invalid 'async' value"}
+        try:
+            serial_timestamps = booleanize(
+                request.query.get('serial_timestamps') or False)
+        except ValueError:
+            return {'ret': 1, 'error': "Invalid 'serial_timestamps' value"}
 
         # Extract profile to a dict
         try:
@@ -120,23 +172,193 @@ class GatewayRest(bottle.Bottle):
             LOGGER.error('REST: Invalid json for profile')
             return {'ret': 1}
 
-        ret = self.gateway_manager.exp_start(user, exp_id, firmware, profile,
-                                             timeout)
-        # cleanup of temp file
-        if firmware_file is not None:
-            firmware_file.close()
-        if ret:  # pragma: no cover
-            LOGGER.error('REST: Start experiment with errors: ret: %d', ret)
-        return {'ret': ret}
+        # Extract firmware file, closed by `_exp_start`
+        firmware_file = self._extract_firmware()
+        firmware = firmware_file.name if firmware_file else None
+
+        def _exp_start():
+            """ Start experiment and cleanup firmware file """
+            try:
+                ret = self.gateway_manager.exp_start(
+                    user, exp_id, firmware, profile, timeout,
+                    serial_timestamps=serial_timestamps,
+                    queue_timeout=queue_timeout)
+            finally:
+                # cleanup of temp file
+                if firmware_file is not None:
+                    firmware_file.close()
+            if ret:  # pragma: no cover
+                LOGGER.error('REST: Start experiment with errors: ret: %d',
+                             ret)
+            return {'ret': ret}
+
+        return self._run('exp_start', run_async, _exp_start, firmware_file)
 
     def exp_stop(self):
-        """ Stop the current experiment """
+        """ Stop the current experiment
+
+        Query string: 'background' bool, cleanup nodes in background
+        Query string: 'queue_timeout' float, max time waiting in queue
+        """
         LOGGER.debug('REST: Stop experiment')
-        ret = self.gateway_manager.exp_stop()
+        background_value = request.query.background  # pylint:disable=no-member
+        try:
+            background = booleanize(background_value or False)
+        except ValueError:
+            return {'ret': 1, 'error': "Invalid 'background' value"}
+        try:
+            queue_timeout = self._queue_timeout()
+        except ValueError:
+            return {'ret': 1, 'error': "Invalid 'queue_timeout' value"}
+        ret = self.gateway_manager.exp_stop(background=background,
+                                            queue_timeout=queue_timeout)
         if ret:  # pragma: no cover
             LOGGER.error('REST: Stop experiment errors: ret: %d', ret)
         return {'ret': ret}
 
+    @staticmethod
+    def _async_mode():
+        """ Return 'async' query value
+
+        :raises ValueError: invalid value """
+        return booleanize(request.query.get('async') or False)
+
+    def _run(self, operation, run_async, func, firmware_file=None):
+        """ Return `func()` result, or start it as a job if `run_async`
+
+        The job id is returned with '202 Accepted' status.
+        `func` closes `firmware_file`, it is closed here if the job could not
+        be started """
+        if not run_async:
+            return func()
+        try:
+            job = self.jobs.submit(operation, func)
+        except BaseException:
+            if firmware_file is not None:
+                firmware_file.close()
+            raise
+        LOGGER.info('REST: %s started as job %s', operation, job.id)
+        bottle.response.status = 202
+        return {'ret': 0, 'job': job.id}
+
+    def job(self, job_id):
+        """ Return job `job_id` status and result """
+        job = self.jobs.get(job_id)
+        if job is None:
+            bottle.response.status = 404
+            return {'ret': 1, 'error': f'Unknown job {job_id}'}
+        return job.as_dict()
+
+    @staticmethod
+    def _queue_timeout():
+        """ Return 'queue_timeout' query value, None if not given
+
+        :raises ValueError: invalid or negative value """
+        value = request.query.queue_timeout  # pylint:disable=no-member
+        if not value:
+            return None
+        queue_timeout = float(value)
+        if math.isnan(queue_timeout) or queue_timeout < 0:
+            raise ValueError(value)
+        return queue_timeout
+
+    def batch(self):
+        """ Run a sequence of operations with the manager lock held
+
+        Request: json {'steps': [{'op': name, 'args': {...}}, ...],
+                       'stop_on_error': bool, default true}
+        or multipart 'batch' json file and 'firmware' file for 'open_flash'
+
+        Query string: 'queue_timeout' float, max time waiting in queue
+        """
+        LOGGER.debug('REST: Batch')
+        firmware_file = None
+        try:
+            queue_timeout = self._queue_timeout()
+            batch = self._extract_batch()
+            firmware_file = self._extract_firmware()
+            steps = self._batch_steps(batch, firmware_file)
+            stop_on_error = booleanize(batch.get('stop_on_error', True))
+        except (ValueError, TypeError, KeyError) as err:
+            if firmware_file is not None:
+                firmware_file.close()
+            LOGGER.error('REST: Invalid batch: %s', err)
+            return {'ret': 1, 'error': f'Invalid batch: {err}'}
+
+        try:
+            ret, results = self.gateway_manager.batch(
+                steps, stop_on_error, queue_timeout=queue_timeout)
+        finally:
+            if firmware_file is not None:
+                firmware_file.close()
+        return {'ret': ret, 'steps': results}
+
+    @staticmethod
+    def _extract_batch():
+        """ Extract batch dict from json body or multipart 'batch' file
+
+        :raises: ValueError on an invalid batch """
+        if request.json is not None:
+            batch = request.json
+        else:
+            # Issues with 'request.files'
+            # pylint:disable=unsubscriptable-object
+            batch = json.loads(request.files['batch'].file.read().decode())
+        if not isinstance(batch, dict) or \
+                not isinstance(batch.get('steps'), list):
+            raise ValueError("'steps' list required")
+        return batch
+
+    def _batch_operations(self, firmware_file):
+        """ Return operations available in batch for this board
+
+        {name: (function, node class, node function required)} """
+        g_m = self.gateway_manager
+        node_class = self.board_config.board_class
+        cn_class = self.board_config.cn_class
+
+        def _open_flash(binary=False, offset=0):
+            """ Flash uploaded firmware """
+            return g_m.node_flash('open', firmware_file.name,
+                                  booleanize(binary), int(offset))
+
+        def _exp_update(profile=None):
+            """ Update profile """
+            return g_m.exp_update_profile(profile)
+
+        return {
+            'open_flash': (_open_flash, node_class, 'flash'),
+            'open_flash_idle': (functools.partial(g_m.node_flash, 'open',
+                                                  None), node_class, 'flash'),
+            'open_reset': (functools.partial(g_m.node_soft_reset, 'open'),
+                           node_class, 'reset'),
+            'open_start': (g_m.open_power_start, cn_class, 'open_start'),
+            'open_stop': (g_m.open_power_stop, cn_class, 'open_stop'),
+            'open_debug_start': (g_m.open_debug_start, node_class,
+                                 'debug_start'),
+            'open_debug_stop': (g_m.open_debug_stop, node_class,
+                                'debug_stop'),
+            'exp_update': (_exp_update, None, None),
+        }
+
+    def _batch_steps(self, batch, firmware_file):
+        """ Validate `batch` steps and return (name, function, kwargs) list
+
+        :raises: ValueError, TypeError or KeyError on invalid steps """
+        operations = self._batch_operations(firmware_file)
+        steps = []
+        for step in batch['steps']:
+            name = step['op']
+            kwargs = step.get('args') or {}
+            func, obj, required = operations[name]
+            if obj is not None and not callable(getattr(obj, required, None)):
+                raise ValueError(f'{name} not available')
+            inspect.signature(func).bind(**kwargs)  # TypeError
+            if name == 'open_flash' and firmware_file is None:
+                raise ValueError("Wrong file args: required 'firmware'")
+            steps.append((name, func, kwargs))
+        return steps
+
     def exp_update_profile(self):
         """ Update current experiment profile """
         LOGGER.debug('REST: Update profile')
@@ -179,17 +401,26 @@ class GatewayRest(bottle.Bottle):
             return None
 
         # save http file to disk
-        firmware_file = NamedTemporaryFile(suffix='--' + _firm.filename)
-        firmware_file.write(_firm.file.read())
-        firmware_file.flush()
+        firmware_file = FirmwareUpload(_firm.file, _firm.filename)
+        LOGGER.info('REST: Firmware %s: %d bytes, sha256: %s, elf: %s',
+                    _firm.filename, firmware_file.size, firmware_file.sha256,
+                    firmware_file.elf_target)
         return firmware_file
 
     # Open node commands
     def open_flash(self):
         """ Flash open node
-        Requires: request.files contains 'firmware' file argument """
+        Requires: request.files contains 'firmware' file argument
+
+        Query string: 'async' bool, run in a job
+        """
         LOGGER.debug('REST: Flash OpenNode')
 
+        try:
+            run_async = self._async_mode()
+        except ValueError:
+            return {'ret': 1, 'error': "Invalid 'async' value"}
+
         query = request.query
         binary_value = query.binary  # pylint:disable=no-member
         if binary_value == '':
@@ -205,12 +436,17 @@ class GatewayRest(bottle.Bottle):
         if firmware_file is None:
             return {'ret': 1, 'error': "Wrong file args: required 'firmware'"}
 
-        ret = self.gateway_manager.node_flash(
-            'open', firmware_file.name, binary, offset
-        )
+        def _open_flash():
+            """ Flash firmware and cleanup firmware file """
+            try:
+                ret = self.gateway_manager.node_flash(
+                    'open', firmware_file.name, binary, offset
+                )
+            finally:
+                firmware_file.close()
+            return {'ret': ret}
 
-        firmware_file.close()
-        return {'ret': ret}
+        return self._run('open_flash', run_async, _open_flash, firmware_file)
 
     # Open node commands
     def open_flash_idle(self):
@@ -256,6 +492,7 @@ class GatewayRest(bottle.Bottle):
          Query string: 'channel' int 11-26
          Query string: 'gps' int 0-1
          Query string: 'flash' int 0-1
+         Query string: 'async' bool, run in a job
 
         Mode:
          * 'blink': leds keep blinking
@@ -288,9 +525,13 @@ class GatewayRest(bottle.Bottle):
         except ValueError:
             return {'ret': 1, 'success': [],
                     'errors': ['invalid_flash_option']}
+        try:
+            run_async = self._async_mode()
+        except ValueError:
+            return {'ret': 1, 'success': [], 'errors': ['invalid_async']}
 
-        ret_dict = self.gateway_manager.auto_tests(channel, blink, flash, gps)
-        return ret_dict
+        return self._run('auto_tests', run_async, functools.partial(
+            self.gateway_manager.auto_tests, channel, blink, flash, gps))
 
     def sleep(self, seconds):
         """Sleep `seconds` seconds."""
@@ -299,11 +540,61 @@ class GatewayRest(bottle.Bottle):
 
     def status(self):
         """ Return node status
-         * Check nodes ftdi
+         * Check nodes ftdi, from the USB inventory when running
         """
         LOGGER.debug('REST: Status')
         return {'ret': self.gateway_manager.status()}
 
+    @staticmethod
+    def inventory():
+        """ Return the USB debug probes inventory snapshot """
+        snapshot = usb_inventory.INVENTORY.snapshot()
+        if snapshot is None:
+            return {'ret': 1, 'error': 'USB inventory not running'}
+        return {**snapshot.as_dict(), 'ret': 0}
+
+    def exp_measures(self):
+        """ Stream the experiment measures as Server-Sent Events
+
+        Event type is the measure stream, 'dropped' if the client is too slow
+        and was unsubscribed.
+        Measures are published when the experiment started with the
+        'live_measures' configuration, or with a subscriber waiting. """
+        if not self.gateway_manager.measures_published():
+            bottle.response.status = 409
+            return {'ret': 1, 'error': 'Experiment measures not published, '
+                                       "'live_measures' not configured"}
+        streams = request.query.streams
+        streams = streams.split(',') if streams else None
+        measures_hub.HUB.check_available()
+        LOGGER.info('REST: Measures subscriber %s', streams or 'all')
+
+        bottle.response.content_type = 'text/event-stream'
+        bottle.response.set_header('Cache-Control', 'no-cache')
+        return _sse_stream(measures_hub.HUB, streams)
+
+    def measures_window(self):
+        """ Return the control node last measures, in a 'seconds' window,
+        control node default if not given """
+        value = request.query.seconds  # pylint:disable=no-member
+        try:
+            seconds = float(value) if value else None
+            if seconds is not None and (math.isnan(seconds) or seconds < 0):
+                raise ValueError(value)
+        except ValueError:
+            return {'ret': 1, 'error': "Invalid 'seconds' value"}
+        return {'ret': 0, **self.gateway_manager.measures_window(seconds)}
+
+    @staticmethod
+    def metrics():
+        """ Return operations metrics in Prometheus text format """
+        bottle.response.content_type = metrics.CONTENT_TYPE
+        return metrics.REGISTRY.prometheus()
+
+    def queue(self):
+        """ Return the queued commands with their position and ETA """
+        return {'queue': self.gateway_manager.queue.status()}
+
     def on_conditional_route(self, func, path, *route_args, **route_kwargs):
         """Add route if node implements 'func'."""
         return self._cond_route(self.board_config.board_class, func, path,
@@ -338,6 +629,13 @@ class GatewayRest(bottle.Bottle):
             """Wrapped function."""
             try:
                 return func(*args, **kwargs)
+            except CommandQueueError as err:
+                LOGGER.error('RestServer: %s not queued: %s',
+                             err.filename, err.strerror)
+                bottle.response.status = 503
+                bottle.response.set_header('Retry-After',
+                                           str(math.ceil(err.eta)))
+                return {'ret': 1, **err.as_dict()}
             except EnvironmentError as err:
                 if err.errno == errno.EWOULDBLOCK:
                     LOGGER.error('RestServer: Request would block, abort')
@@ -351,9 +649,52 @@ class GatewayRest(bottle.Bottle):
                 raise exc
         return _wrapped_f
 
+
+def _sse_stream(hub, streams=None, maxsize=measures_hub.QUEUE_SIZE):
+    """ Yield `hub` `streams` measures as Server-Sent Events
+
+    Subscribe when first iterated, so a response never sent does not leave
+    its subscription behind """
+    subscription = hub.subscribe(streams, maxsize)
+    try:
+        yield ': measures\n\n'
+        for stream, data in subscription.events():
+            if stream is None:
+                yield ': keepalive\n\n'  # detect closed connections
+            else:
+                yield f'event: {stream}\ndata: {data}\n\n'
+        yield 'event: dropped\ndata: client too slow\n\n'
+    finally:
+        subscription.close()
+
+
 # Command line functions
 
 
+def server_options(server, threads, timeout=None, keep_alive=False):
+    """ Return bottle `server` backend options
+
+    :param threads: number of worker threads
+    :param timeout: idle connections timeout in seconds
+    :param keep_alive: use HTTP/1.1 persistent connections, 'waitress'
+        always supports them
+
+    >>> sorted(server_options('waitress', 4, 30).items())
+    [('channel_timeout', 30), ('threads', 4)]
+    >>> server_options('paste', 4, keep_alive=True)['protocol_version']
+    'HTTP/1.1'
+    """
+    if server == 'waitress':
+        options = {'threads': threads}
+        if timeout is not None:
+            options['channel_timeout'] = timeout
+        return options
+
+    return {'use_threadpool': True, 'threadpool_workers': threads,
+            'socket_timeout': timeout,
+            'protocol_version': 'HTTP/1.1' if keep_alive else 'HTTP/1.0'}
+
+
 def _parse_arguments(args):
     """
     Parse arguments:
@@ -374,6 +715,22 @@ def _parse_arguments(args):
     parser.add_argument(
         '--reloader', dest='reloader', action='store_true',
         help="Whether to auto-reload the bottle server on source code changes")
+    parser.add_argument(
+        '--server', choices=SERVERS, default='paste',
+        help="HTTP server backend, default paste, "
+             "'waitress' requires the 'waitress' extra")
+    parser.add_argument(
+        '--threads', type=int, default=10,
+        help="Number of server worker threads, default 10")
+    parser.add_argument(
+        '--timeout', type=float, default=None,
+        help="Idle connections timeout in seconds, default none")
+    parser.add_argument(
+        '--keep-alive', dest='keep_alive', action='store_true',
+        help="Use HTTP/1.1 persistent connections (paste), default False")
+    parser.add_argument(
+        '--max-request-size', dest='max_request_size', type=int,
+        default=None, help="Maximum request body size in bytes")
 
     arguments = parser.parse_args(args)
 
@@ -386,9 +743,12 @@ def _main(args):
     """
 
     args = _parse_arguments(args[1:])
+    usb_inventory.INVENTORY.start()
     g_m = GatewayManager(args.log_folder, args.log_stdout)
     g_m.setup()
 
-    server = GatewayRest(g_m)
-    server.run(host=args.host, port=args.port, server='paste',
-               reloader=args.reloader)
+    server = GatewayRest(g_m, args.max_request_size)
+    options = server_options(args.server, args.threads, args.timeout,
+                             args.keep_alive)
+    server.run(host=args.host, port=args.port, server=args.server,
+               reloader=args.reloader, **options)
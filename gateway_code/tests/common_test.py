@@ -52,6 +52,28 @@ class TestLogger(unittest.TestCase):
         self.assertEqual(2, m_logger.info.call_count)
         self.assertEqual(1, m_logger.error.call_count)
 
+    @mock.patch('gateway_code.metrics.REGISTRY')
+    def test_logger_call_metrics(self, registry):
+
+        class Node:  # pylint: disable=too-few-public-methods
+            TYPE = 'm3'
+
+            @common.logger_call("test value")
+            def flash(self, value):
+                if value is None:
+                    raise ValueError()
+                return value
+
+        Node().flash(0)
+        Node().flash(2)
+        self.assertRaises(ValueError, Node().flash, None)
+
+        calls = registry.observe.call_args_list
+        self.assertEqual(3, len(calls))
+        self.assertTrue(calls[0][0][0].endswith('Node.flash'))
+        self.assertEqual('m3', calls[0][0][1])
+        self.assertEqual([0, 2, 1], [call[0][3] for call in calls])
+
 
 class TestWaitCond(unittest.TestCase):
 
@@ -94,6 +116,16 @@ class TestWaitTTY(unittest.TestCase):
         self.assertEqual(0, common.wait_no_tty('no_tty_file', 0))
         self.assertEqual(1, common.wait_no_tty('/dev/null', 0))
 
+    def test_wait_tty_stable(self):
+        """ Test running wait_tty_stable fct """
+        logger = mock.Mock()
+        t_ref = time.time()
+        self.assertEqual(0, common.wait_tty_stable('/dev/null', logger, 0.5))
+        self.assertLessEqual(0.5, time.time() - t_ref)
+        self.assertEqual(1, common.wait_tty_stable('no_tty_file', logger,
+                                                   timeout=0))
+        self.assertEqual(1, logger.error.call_count)
+
 
 class TestSynchronousDecorator(unittest.TestCase):
 
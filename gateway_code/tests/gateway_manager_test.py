@@ -26,12 +26,16 @@ Complement the 'integration' tests
 """
 
 import os
+import errno
+import threading
 
 import unittest
 import mock
 import pytest
 
-from gateway_code import gateway_manager
+from gateway_code import gateway_manager, metrics
+from gateway_code.utils import firmware_state, usb_inventory
+from gateway_code.utils.command_queue import CommandQueueError
 from . import utils
 
 # pylint: disable=missing-docstring
@@ -42,6 +46,23 @@ from . import utils
 # pylint: disable=no-member
 
 
+def _in_thread(func):
+    """ Return func() run in another thread, or raise its exception """
+    result = {}
+
+    def _run():
+        try:
+            result['ret'] = func()
+        except Exception as err:  # pylint:disable=broad-except
+            result['err'] = err
+    thread = threading.Thread(target=_run)
+    thread.start()
+    thread.join()
+    if 'err' in result:
+        raise result['err']
+    return result['ret']
+
+
 @mock.patch(utils.READ_CONFIG, utils.read_config_mock('m3'))
 class TestGatewayManager(unittest.TestCase):
 
@@ -49,7 +70,11 @@ class TestGatewayManager(unittest.TestCase):
         """ Test running gateway_manager with setup without error """
         g_m = gateway_manager.GatewayManager()
         g_m.node_flash = mock.Mock(return_value=0)
-        assert g_m.setup() == 0
+        with mock.patch.object(firmware_state.FIRMWARE_STATE,
+                               'clear') as clear:
+            assert g_m.setup() == 0
+        clear.assert_called_with()
+        g_m.node_flash.assert_called_with('control', None)
 
     def test_setup_fail_flash(self):
         """ Run setup with a flash fail error """
@@ -58,12 +83,207 @@ class TestGatewayManager(unittest.TestCase):
         with pytest.raises(RuntimeError):
             g_m.setup()
 
+    @mock.patch('gateway_code.config.EXP_FILES_DIR', './iotlab/')
+    def test_exp_start_steps(self):
+        """ Start experiment steps are run and recorded """
+        g_m = gateway_manager.GatewayManager()
+        g_m._create_user_exp_folders('user', 123)
+        calls = mock.Mock()
+        calls.cn_start.return_value = 0
+        calls.on_setup.return_value = 1
+        calls.cn_start_exp.return_value = 0
+        calls.on_teardown.return_value = 0
+        with mock.patch.multiple(g_m.control_node, start=calls.cn_start,
+                                 start_experiment=calls.cn_start_exp,
+                                 stop_experiment=mock.Mock(return_value=0),
+                                 stop=mock.Mock(return_value=0)), \
+                mock.patch.object(g_m.open_node, 'setup', calls.on_setup), \
+                mock.patch.object(g_m.open_node, 'teardown',
+                                  calls.on_teardown):
+            self.assertEqual(1, g_m.exp_start('user', 123,
+                                              serial_timestamps=True))
+            self.assertTrue(g_m.experiment_is_running)
+            self.assertTrue(g_m.open_node.serial_redirection.timestamps)
+            self.assertEqual(['cn_start', 'on_setup', 'cn_start_exp'],
+                             [name for name, _, _ in calls.mock_calls])
+            for step in ('profile', 'firmware', 'exp_files'):
+                self.assertIsNotNone(metrics.REGISTRY.mean(
+                    f'GatewayManager.exp_start_checks.{step}'))
+            self.assertEqual(0, g_m.exp_stop())
+            self.assertFalse(g_m.open_node.serial_redirection.timestamps)
+        g_m._destroy_user_exp_folders('user', 123)
+
+    @mock.patch('gateway_code.config.EXP_FILES_DIR', './iotlab/')
+    def test_exp_start_step_exception(self):
+        """ Steps after a failed one are not run """
+        g_m = gateway_manager.GatewayManager()
+        g_m._create_user_exp_folders('user', 123)
+        with mock.patch.object(g_m.control_node, 'start',
+                               side_effect=RuntimeError()), \
+                mock.patch.object(g_m.open_node, 'setup') as setup:
+            self.assertRaises(RuntimeError, g_m.exp_start, 'user', 123)
+            self.assertFalse(setup.called)
+        g_m.experiment_is_running = False
+        gateway_manager.LOGGER.removeHandler(g_m.user_log_handler)
+        g_m._destroy_user_exp_folders('user', 123)
+
+    @mock.patch('gateway_code.config.EXP_FILES_DIR', './iotlab/')
+    def test_exp_start_invalid_args(self):
+        """ Invalid profile or firmware do not touch user files """
+        g_m = gateway_manager.GatewayManager()
+        g_m._create_user_exp_folders('user', 123)
+        exp_files = g_m.create_user_exp_files('m3-00', 'user', 123)
+        with open(exp_files['log'], 'w') as log:
+            log.write('previous run')
+
+        with mock.patch.object(g_m.control_node, 'start') as cn_start:
+            self.assertEqual(1, g_m.exp_start('user', 123, profile_dict={}))
+            self.assertEqual(1, g_m.exp_start('user', 123, __file__))
+            self.assertFalse(cn_start.called)
+        self.assertFalse(g_m.experiment_is_running)
+        # not truncated
+        with open(exp_files['log']) as log:
+            self.assertEqual('previous run', log.read())
+        g_m.cleanup_user_exp_files(exp_files)
+        g_m._destroy_user_exp_folders('user', 123)
+
+    @mock.patch('gateway_code.gateway_manager.time.sleep')
+    def test_timeout_exp_stop(self, sleep):
+        """ Timeout stop is retried while it cannot be queued """
+        g_m = gateway_manager.GatewayManager()
+        g_m.exp_id, g_m.user = 123, 'user'
+        queue_run = g_m.queue.run
+        errors = [CommandQueueError(errno.EWOULDBLOCK, 'exp_stop', 8, 60.0)]
+
+        def _run(*args, **kwargs):
+            if errors:
+                raise errors.pop()
+            return queue_run(*args, **kwargs)
+
+        with mock.patch.object(g_m.queue, 'run', side_effect=_run) as run, \
+                mock.patch.object(g_m, 'exp_stop') as exp_stop:
+            g_m._timeout_exp_stop(123, 'user')
+        self.assertEqual(2, run.call_count)
+        sleep.assert_called_once_with(g_m.TIMEOUT_STOP_RETRY)
+        exp_stop.assert_called_once_with()
+
+        # Another experiment started, not stopped
+        with mock.patch.object(g_m, 'exp_stop') as exp_stop:
+            g_m._timeout_exp_stop(122, 'user')
+        self.assertFalse(exp_stop.called)
+
+    def test_exp_stop_background(self):
+        """ Nodes teardown in background, next commands wait for it """
+        g_m = gateway_manager.GatewayManager()
+        g_m.experiment_is_running = True
+        g_m.user_log_handler = mock.Mock()
+        teardown_started = threading.Event()
+        teardown_done = threading.Event()
+
+        def _teardown():
+            teardown_started.set()
+            teardown_done.wait(5)
+            return 0
+
+        with mock.patch.object(g_m.control_node, 'stop_experiment',
+                               return_value=0), \
+                mock.patch.object(g_m.control_node, 'stop', return_value=0), \
+                mock.patch.object(g_m.control_node, 'reset',
+                                  return_value=0), \
+                mock.patch.object(g_m.open_node, 'teardown', _teardown), \
+                mock.patch.object(g_m.open_node.serial_redirection,
+                                  'stop', return_value=0) as serial_stop:
+            self.assertEqual(0, g_m.exp_stop(background=True))
+            self.assertTrue(teardown_started.wait(5))
+            self.assertFalse(g_m.experiment_is_running)
+            self.assertTrue(g_m.is_cleaning)
+            self.assertTrue(serial_stop.called)
+
+            threading.Timer(0.2, teardown_done.set).start()
+            self.assertEqual(0, g_m.node_soft_reset('control'))
+            self.assertTrue(teardown_done.is_set())
+            self.assertFalse(g_m.is_cleaning)
+            self.assertTrue(g_m.control_node.stop.called)
+
+    @mock.patch('gateway_code.utils.oml_columnar.CONVERTER')
+    def test_exp_stop_oml_columnar(self, converter):
+        """ Measures files are converted once control node stopped """
+        g_m = gateway_manager.GatewayManager()
+        self.assertFalse(g_m.oml_columnar)
+        g_m.oml_columnar = True
+        g_m.experiment_is_running = True
+        g_m.user_log_handler = mock.Mock()
+        g_m.exp_files = {'consumption': 'c.oml', 'radio': 'r.oml',
+                         'sniffer': 's.oml', 'log': 'l.log'}
+        stopped = []
+
+        with mock.patch.object(g_m.control_node, 'stop_experiment',
+                               return_value=0), \
+                mock.patch.object(g_m.control_node, 'stop',
+                                  side_effect=lambda: stopped.append(1)), \
+                mock.patch.object(g_m.open_node, 'teardown', return_value=0):
+            converter.submit.side_effect = (
+                lambda paths: self.assertEqual([1], stopped))
+            self.assertEqual(0, g_m.exp_stop())
+            paths = converter.submit.call_args[0][0]
+            self.assertEqual(['c.oml', 'r.oml'], list(paths))
+
+    def test_serial_capture(self):
+        """ Serial capture path is set from experiment log file """
+        g_m = gateway_manager.GatewayManager()
+        self.assertFalse(g_m.serial_capture)
+        redirection = g_m.open_node.serial_redirection
+        g_m._set_serial_capture({'log': '/exp/log/m3-1.log'})
+        self.assertIsNone(redirection.capture_path)
+
+        g_m.serial_capture = True
+        g_m._set_serial_capture({'log': '/exp/log/m3-1.log'})
+        self.assertEqual('/exp/log/m3-1.serial.log',
+                         redirection.capture_path)
+        g_m._set_serial_capture({})
+        self.assertIsNone(redirection.capture_path)
+
     def test_exp_update_profile_error(self):
         """ Update profile with an invalid profile """
 
         g_m = gateway_manager.GatewayManager()
         self.assertEqual(1, g_m.exp_update_profile(profile_dict={}))
 
+    def test_batch(self):
+        """ Run batch steps, stop on error """
+        g_m = gateway_manager.GatewayManager()
+        ok_step = mock.Mock(return_value=0)
+        err_step = mock.Mock(return_value=1)
+        raise_step = mock.Mock(side_effect=ValueError('step error'))
+
+        steps = [('ok', ok_step, {'power': 'dc'}), ('err', err_step, {}),
+                 ('raise', raise_step, {}), ('ok', ok_step, {})]
+        ret, results = g_m.batch(steps)
+        self.assertEqual(1, ret)
+        self.assertEqual([0, 1], [res['ret'] for res in results[:2]])
+        self.assertEqual([True, True], [res['skipped'] for res in results[2:]])
+        ok_step.assert_called_once_with(power='dc')
+        self.assertFalse(raise_step.called)
+
+        ret, results = g_m.batch(steps, stop_on_error=False)
+        self.assertEqual(2, ret)
+        self.assertEqual('step error', results[2]['error'])
+        self.assertEqual(3, ok_step.call_count)
+        self.assertTrue(all(res['duration'] >= 0 for res in results))
+
+    def test_status_lock(self):
+        """ Status only takes lock without USB inventory """
+        g_m = gateway_manager.GatewayManager()
+        g_m.control_node.status = mock.Mock(return_value=0)
+        g_m.open_node.status = mock.Mock(return_value=0)
+
+        with g_m.rlock:
+            with mock.patch.object(usb_inventory.INVENTORY, '_thread',
+                                   mock.Mock()):
+                self.assertEqual(0, _in_thread(g_m.status))
+
+            self.assertRaises(EnvironmentError, _in_thread, g_m.status)
+
 # # # # # # # # # # # # # # # # # # # # #
 # Measures folder and files management  #
 # # # # # # # # # # # # # # # # # # # # #
@@ -0,0 +1,64 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+# pylint: disable=missing-docstring
+# pylint: disable=protected-access
+
+import unittest
+
+from gateway_code import metrics
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.reg = metrics.MetricsRegistry(buckets=(1, 10))
+
+    def test_observe(self):
+        self.reg.observe('op', 'm3', 0.5)
+        self.reg.observe('op', 'm3', 5, error=1)
+        self.reg.observe('op', 'm3', 50, error=0)
+        self.reg.observe('op', 'a8', 5)
+
+        hist = self.reg._durations[('op', 'm3')]
+        self.assertEqual([1, 1, 1], hist.counts)
+        self.assertEqual(3, hist.count)
+        self.assertEqual(55.5, hist.sum)
+        self.assertEqual([('1', 1), ('10', 2), ('+Inf', 3)],
+                         list(hist.cumulative()))
+        self.assertEqual(1, self.reg._errors[('op', 'm3')])
+        self.assertEqual(0, self.reg._errors[('op', 'a8')])
+
+        self.reg.reset()
+        self.assertEqual({}, self.reg._durations)
+
+    def test_prometheus(self):
+        self.assertNotIn('{', self.reg.prometheus())
+
+        self.reg.const_labels['board'] = 'm3'
+        self.reg.observe('Cls.op"', 'm3', 2)
+        output = self.reg.prometheus()
+        labels = '{board="m3",node_type="m3",operation="Cls.op\\""}'
+        self.assertIn(f'gateway_operation_duration_seconds_count{labels} 1\n',
+                      output)
+        self.assertIn(f'gateway_operation_errors_total{labels} 0\n', output)
+        self.assertTrue(output.endswith('\n'))
@@ -67,6 +67,29 @@ class TestsSimpleProfile(unittest.TestCase):
     def test_profile_from_dict_empty(self):
         self.assertIsNone(Profile.from_dict(NodeM3, None))
 
+    def test_profile_diff(self):
+        prof_d = {'profilename': 'prof', 'power': 'dc',
+                  'consumption': {'period': 140, 'average': 1,
+                                  'power': True},
+                  'radio': {'mode': 'rssi', 'channels': [11, 12],
+                            'period': 10, 'num_per_channel': 1}}
+        profile = Profile.from_dict(NodeM3, prof_d)
+        self.assertEqual({'power', 'consumption', 'radio', 'aggregate'},
+                         profile.diff(None))
+
+        other = Profile.from_dict(NodeM3, dict(prof_d, profilename='other'))
+        other.radio.channels = [12, 11, 12]
+        self.assertEqual(profile, other)
+        self.assertEqual(hash(profile), hash(other))
+        self.assertEqual(set(), profile.diff(other))
+
+        other.radio.period = 20
+        self.assertEqual({'radio'}, profile.diff(other))
+        other = Profile.from_dict(NodeM3, dict(prof_d, power='battery'))
+        self.assertEqual({'power', 'consumption'}, profile.diff(other))
+        self.assertNotEqual(profile, other)
+        self.assertNotEqual(profile.radio, None)
+
 
 class TestsConsumptionProfile(unittest.TestCase):
 
@@ -87,6 +110,29 @@ class TestsConsumptionProfile(unittest.TestCase):
             self.assertRaises(ValueError, Profile.from_dict,
                               NodeM3, profile_dict(profile_file))
 
+    def test_consumption_aggregate(self):
+        prof_d = profile_dict(PROFILES_DIR + 'consumption_aggregate_1.json')
+        profile = Profile.from_dict(NodeM3, prof_d)
+        self.assertEqual(100, profile.aggregate.window_ms)
+        self.assertEqual(('mean', 'max'), profile.aggregate.stats)
+        self.assertFalse(profile.aggregate.raw)
+        self.assertEqual(('power',), profile.consumption.fields)
+
+        # Only aggregation changed
+        prof_d['consumption']['aggregate'] = {
+            'window_ms': 100, 'stats': ['max', 'mean'], 'raw': True}
+        other = Profile.from_dict(NodeM3, prof_d)
+        self.assertEqual({'aggregate'}, profile.diff(other))
+        self.assertEqual(other.consumption, profile.consumption)
+
+        del prof_d['consumption']['aggregate']
+        other = Profile.from_dict(NodeM3, prof_d)
+        self.assertIsNone(other.aggregate)
+        self.assertEqual({'aggregate'}, profile.diff(other))
+
+        self.assertIsNone(Profile.from_dict(
+            NodeM3, {'profilename': 'p', 'power': 'dc'}).aggregate)
+
 
 class TestsRadioProfile(unittest.TestCase):
 
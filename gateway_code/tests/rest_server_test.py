@@ -30,9 +30,11 @@ Complement the 'integration' tests
 # pylint: disable=invalid-name
 # pylint: disable=protected-access
 # pylint: disable=too-few-public-methods
+# pylint: disable=too-many-public-methods
 # pylint: disable=no-member
 
 import os
+import json
 import errno
 import unittest
 
@@ -40,6 +42,9 @@ import webtest
 import mock
 
 from gateway_code import rest_server
+from gateway_code.utils.command_queue import CommandQueueError
+from gateway_code.utils import measures_hub
+from gateway_code.utils import usb_inventory
 from . import utils
 
 
@@ -117,6 +122,170 @@ class TestRestMethods(unittest.TestCase):
         self.assertIsNotNone(ret)
         assert "500 Internal Server Error" in self.server.post('/test')
 
+    def test_metrics(self):
+        with mock.patch('gateway_code.metrics.REGISTRY') as registry:
+            registry.prometheus.return_value = 'metrics\n'
+            ret = self.server.get('/metrics')
+        self.assertEqual('metrics\n', ret.text)
+        self.assertEqual('text/plain', ret.content_type)
+
+    def test_inventory(self):
+        ret = self.server.get('/status/inventory')
+        self.assertEqual(1, ret.json['ret'])
+
+        snapshot = usb_inventory.Snapshot([{'kind': 'jlink'}], 42.0)
+        with mock.patch.object(usb_inventory.INVENTORY, 'snapshot',
+                               return_value=snapshot):
+            ret = self.server.get('/status/inventory')
+        self.assertEqual({'ret': 0, 'timestamp': 42.0,
+                          'devices': [{'kind': 'jlink'}]}, ret.json)
+
+    def test_exp_measures(self):
+        hub = measures_hub.MeasuresHub()
+        subscription = hub.subscribe(maxsize=1)
+        subscription.dropped = True
+        with mock.patch.object(measures_hub, 'HUB') as m_hub:
+            m_hub.subscribe.return_value = subscription
+            ret = self.server.get('/exp/measures?streams=radio,consumption')
+        m_hub.subscribe.assert_called_with(['radio', 'consumption'],
+                                           measures_hub.QUEUE_SIZE)
+        self.assertEqual('text/event-stream', ret.content_type)
+        self.assertIn('event: dropped\n', ret.text)
+        self.assertEqual(0, hub.subscribers)
+
+        m_hub.reset_mock()
+        m_hub.check_available.side_effect = EnvironmentError(
+            errno.EWOULDBLOCK, '')
+        with mock.patch.object(measures_hub, 'HUB', m_hub):
+            self.server.get('/exp/measures', status=503)
+        self.assertFalse(m_hub.subscribe.called)
+
+        # Experiment measures not published
+        self.g_m.measures_published.return_value = False
+        ret = self.server.get('/exp/measures', status=409)
+        self.assertEqual(1, ret.json['ret'])
+
+        # Control node without live measures
+        board_cfg = mock.Mock(board_class=self.s_r.board_config.board_class,
+                              cn_class=object)
+        with mock.patch('gateway_code.board_config.BoardConfig',
+                        return_value=board_cfg):
+            server = webtest.TestApp(rest_server.GatewayRest(self.g_m))
+        server.get('/exp/measures', status=404)
+
+    def test_measures_window(self):
+        self.g_m.measures_window.return_value = {
+            'radio': {'timestamp': [1.0], 'channel': [11.0], 'rssi': [-91.0]}}
+        ret = self.server.get('/exp/measures/window')
+        self.assertEqual(0, ret.json['ret'])
+        self.assertEqual([-91.0], ret.json['radio']['rssi'])
+        self.g_m.measures_window.assert_called_with(None)
+
+        self.server.get('/exp/measures/window?seconds=2.5')
+        self.g_m.measures_window.assert_called_with(2.5)
+
+        for seconds in ('-1', 'nan', 'abc'):
+            ret = self.server.get(f'/exp/measures/window?seconds={seconds}')
+            self.assertEqual(1, ret.json['ret'])
+
+    def test_sse_stream(self):
+        hub = measures_hub.MeasuresHub()
+        stream = rest_server._sse_stream(hub, ['radio'], maxsize=2)
+        # Not subscribed before the stream is sent
+        self.assertEqual(0, hub.subscribers)
+        self.assertEqual(': measures\n\n', next(stream))
+        self.assertEqual(1, hub.subscribers)
+
+        hub.publish('measures_debug: radio_measure 12.5 11 -91')
+        hub.publish('measures_debug: consumption_measure 12.6 0.1 3.2 0.08')
+        self.assertEqual('event: radio\ndata: 12.5 11 -91\n\n', next(stream))
+
+        for _ in range(3):
+            hub.publish('measures_debug: radio_measure 12.5 11 -91')
+        self.assertEqual('event: dropped\ndata: client too slow\n\n',
+                         next(stream))
+        self.assertEqual(0, hub.subscribers)
+
+    def test_batch(self):
+        self.g_m.batch.return_value = (0, [{'op': 'open_stop', 'ret': 0}])
+        batch = {'steps': [{'op': 'open_stop'},
+                           {'op': 'open_start', 'args': {'power': 'dc'}},
+                           {'op': 'exp_update',
+                            'args': {'profile': self.PROFILE_DICT}}],
+                 'stop_on_error': False}
+        ret = self.server.post_json('/batch', batch)
+        self.assertEqual(0, ret.json['ret'])
+        self.assertEqual('open_stop', ret.json['steps'][0]['op'])
+
+        steps, stop_on_error = self.g_m.batch.call_args[0]
+        self.assertFalse(stop_on_error)
+        self.assertEqual(['open_stop', 'open_start', 'exp_update'],
+                         [name for name, _, _ in steps])
+        for _, func, kwargs in steps:
+            func(**kwargs)
+        self.g_m.open_power_start.assert_called_with(power='dc')
+        self.g_m.exp_update_profile.assert_called_with(self.PROFILE_DICT)
+
+    def test_batch_flash(self):
+        self.g_m.batch.return_value = (0, [])
+        batch = {'steps': [{'op': 'open_flash', 'args': {'offset': 4}},
+                           {'op': 'open_reset'}, {'op': 'open_flash_idle'}]}
+        files = [('firmware', 'idle.elf', b'elf32arm0X1234'),
+                 ('batch', 'batch.json', json.dumps(batch).encode())]
+        ret = self.server.post('/batch', upload_files=files)
+        self.assertEqual(0, ret.json['ret'])
+
+        steps, stop_on_error = self.g_m.batch.call_args[0]
+        self.assertTrue(stop_on_error)
+        steps[0][1](**steps[0][2])
+        args = self.g_m.node_flash.call_args[0]
+        self.assertTrue(args[1].endswith('idle.elf'))
+        self.assertEqual((False, 4), args[2:])
+        steps[1][1]()
+        self.g_m.node_soft_reset.assert_called_with('open')
+        steps[2][1]()
+        self.g_m.node_flash.assert_called_with('open', None)
+
+    def test_batch_invalid(self):
+        g_m = mock.create_autospec(rest_server.GatewayManager, instance=True)
+        server = webtest.TestApp(rest_server.GatewayRest(g_m))
+        for batch in ({}, {'steps': 'open_stop'},
+                      {'steps': [{'op': 'unknown'}]},
+                      {'steps': [{'op': 'open_stop', 'args': {'a': 1}}]},
+                      {'steps': [{'op': 'open_flash'}]},
+                      {'steps': [{'op': 'open_stop'}],
+                       'stop_on_error': 'maybe'}):
+            ret = server.post_json('/batch', batch)
+            self.assertEqual(1, ret.json['ret'])
+        self.assertFalse(g_m.batch.called)
+
+    def test_queue(self):
+        self.g_m.queue.status.return_value = [
+            {'command': 'exp_start', 'position': 0, 'running': True,
+             'eta': 0.0}]
+        ret = self.server.get('/queue')
+        self.assertEqual('exp_start', ret.json['queue'][0]['command'])
+
+    def test_queue_error(self):
+        self.g_m.exp_stop.side_effect = CommandQueueError(
+            errno.ETIMEDOUT, 'exp_stop', 2, 12.3)
+        ret = self.server.delete('/exp/stop', status=503,
+                                 extra_environ=query_string('queue_timeout=1'))
+        self.g_m.exp_stop.assert_called_with(background=False,
+                                             queue_timeout=1.0)
+        self.assertEqual('13', ret.headers['Retry-After'])
+        self.assertEqual(1, ret.json['ret'])
+        self.assertEqual(2, ret.json['position'])
+        self.assertEqual(12.3, ret.json['eta'])
+
+        for value in ('-1', 'nan', 'soon'):
+            ret = self.server.delete('/exp/stop', extra_environ=query_string(
+                'queue_timeout=' + value))
+            self.assertEqual(1, ret.json['ret'])
+            ret = self.server.post(self.EXP_START, extra_environ=query_string(
+                'queue_timeout=' + value))
+            self.assertEqual(1, ret.json['ret'])
+
     def test_exp_start_file_and_profile(self):
         self.g_m.exp_start.return_value = 0
 
@@ -139,6 +308,26 @@ class TestRestMethods(unittest.TestCase):
         ret = self.server.post(self.EXP_START, upload_files=files)
         self.assertEqual(1, ret.json['ret'])
 
+        # No firmware temporary file left
+        files += [('firmware', 'idle.elf', b'elf32arm0X1234')]
+        with mock.patch('gateway_code.rest_server.FirmwareUpload') as upload:
+            ret = self.server.post(self.EXP_START, upload_files=files)
+        self.assertEqual(1, ret.json['ret'])
+        self.assertFalse(upload.called)
+        self.assertFalse(self.g_m.exp_start.called)
+
+    def test_exp_start_job_error(self):
+        """ Firmware file is closed when its job cannot start """
+        files = [('firmware', 'idle.elf', b'elf32arm0X1234')]
+        with mock.patch('gateway_code.rest_server.FirmwareUpload') as upload:
+            with mock.patch.object(self.s_r.jobs, 'submit',
+                                   side_effect=RuntimeError('full')):
+                self.server.post(self.EXP_START, upload_files=files,
+                                 extra_environ=query_string('async=1'),
+                                 expect_errors=True)
+        upload.return_value.close.assert_called_with()
+        self.assertFalse(self.g_m.exp_start.called)
+
     def test_exp_start_no_files(self):
         self.g_m.exp_start.return_value = 0
 
@@ -147,7 +336,9 @@ class TestRestMethods(unittest.TestCase):
         self.assertEqual(0, ret.json['ret'])
 
         # validate
-        self.g_m.exp_start.assert_called_with('user', 123, None, None, 0)
+        self.g_m.exp_start.assert_called_with('user', 123, None, None, 0,
+                                              serial_timestamps=False,
+                                              queue_timeout=None)
         self.assertEqual(0, ret.json['ret'])
 
     def test_exp_start_valid_duration(self):
@@ -155,16 +346,35 @@ class TestRestMethods(unittest.TestCase):
 
         extra = query_string('timeout=12')
         self.server.post(self.EXP_START, extra_environ=extra)
-        self.g_m.exp_start.assert_called_with('user', 123, None, None, 12)
+        self.g_m.exp_start.assert_called_with('user', 123, None, None, 12,
+                                              serial_timestamps=False,
+                                              queue_timeout=None)
 
         # invalid data
         extra = query_string('timeout=ten_minutes')
         self.server.post(self.EXP_START, extra_environ=extra)
-        self.g_m.exp_start.assert_called_with('user', 123, None, None, 0)
+        self.g_m.exp_start.assert_called_with('user', 123, None, None, 0,
+                                              serial_timestamps=False,
+                                              queue_timeout=None)
 
         extra = query_string('timeout=-1')
         self.server.post(self.EXP_START, extra_environ=extra)
-        self.g_m.exp_start.assert_called_with('user', 123, None, None, 0)
+        self.g_m.exp_start.assert_called_with('user', 123, None, None, 0,
+                                              serial_timestamps=False,
+                                              queue_timeout=None)
+
+    def test_exp_start_serial_timestamps(self):
+        self.g_m.exp_start.return_value = 0
+
+        extra = query_string('serial_timestamps=1')
+        self.server.post(self.EXP_START, extra_environ=extra)
+        self.g_m.exp_start.assert_called_with('user', 123, None, None, 0,
+                                              serial_timestamps=True,
+                                              queue_timeout=None)
+
+        extra = query_string('serial_timestamps=maybe')
+        ret = self.server.post(self.EXP_START, extra_environ=extra)
+        self.assertEqual(1, ret.json['ret'])
 
     def test_exp_start_multipart_without_files(self):
         self.g_m.exp_start.return_value = 0
@@ -173,7 +383,9 @@ class TestRestMethods(unittest.TestCase):
                                content_type='multipart/form-data')
 
         self.assertEqual(0, ret.json['ret'])
-        self.g_m.exp_start.assert_called_with('user', 123, None, None, 0)
+        self.g_m.exp_start.assert_called_with('user', 123, None, None, 0,
+                                              serial_timestamps=False,
+                                              queue_timeout=None)
 
     def test_exp_stop(self):
         self.g_m.exp_stop.return_value = 0
@@ -184,6 +396,21 @@ class TestRestMethods(unittest.TestCase):
         ret = self.server.delete('/exp/stop')
         self.assertEqual(1, ret.json['ret'])
 
+    def test_exp_stop_background(self):
+        self.g_m.exp_stop.return_value = 0
+        self.server.delete('/exp/stop', extra_environ=query_string(
+            'background=1'))
+        self.g_m.exp_stop.assert_called_with(background=True,
+                                             queue_timeout=None)
+
+        self.server.delete('/exp/stop')
+        self.g_m.exp_stop.assert_called_with(background=False,
+                                             queue_timeout=None)
+
+        ret = self.server.delete('/exp/stop', extra_environ=query_string(
+            'background=maybe'))
+        self.assertEqual(1, ret.json['ret'])
+
     def test_exp_stop_wrong_request_type(self):
         ret = self.server.post('/exp/stop', status='*')
         self.assertEqual(405, ret.status_int)
@@ -248,6 +475,71 @@ class TestRestMethods(unittest.TestCase):
         ret = self.server.post('/open/flash', upload_files=[])
         self.assertEqual(1, ret.json['ret'])
 
+    def test_flash_async(self):
+        flashed = []
+
+        def _node_flash(node, firmware, *_):
+            with open(firmware, 'rb') as _file:
+                flashed.append((node, _file.read()))
+            return 0
+
+        self.g_m.node_flash.side_effect = _node_flash
+        files = [('firmware', 'idle.elf', b'elf32arm0X1234')]
+        ret = self.server.post('/open/flash', upload_files=files, status=202,
+                               extra_environ=query_string('async=1'))
+        self.assertEqual(0, ret.json['ret'])
+        job = self.s_r.jobs.get(ret.json['job'])
+        self.assertTrue(job.wait(5))
+
+        ret = self.server.get('/jobs/' + job.id)
+        self.assertEqual('done', ret.json['status'])
+        self.assertEqual('open_flash', ret.json['operation'])
+        self.assertEqual({'ret': 0}, ret.json['result'])
+        # firmware file still available during job
+        self.assertEqual([('open', b'elf32arm0X1234')], flashed)
+
+        ret = self.server.post('/open/flash', upload_files=files,
+                               extra_environ=query_string('async=maybe'))
+        self.assertEqual(1, ret.json['ret'])
+
+    def test_jobs(self):
+        self.g_m.exp_start.side_effect = ValueError('exp_start error')
+        ret = self.server.post(self.EXP_START, status=202,
+                               extra_environ=query_string('async=true'))
+        job = self.s_r.jobs.get(ret.json['job'])
+        self.assertTrue(job.wait(5))
+        ret = self.server.get('/jobs/' + job.id)
+        self.assertEqual('error', ret.json['status'])
+        self.assertEqual('exp_start error', ret.json['error'])
+
+        self.g_m.auto_tests.return_value = {'ret': 0, 'success': ['test'],
+                                            'errors': []}
+        ret = self.server.put('/autotest', status=202,
+                              extra_environ=query_string('async=1'))
+        job = self.s_r.jobs.get(ret.json['job'])
+        self.assertTrue(job.wait(5))
+        self.assertEqual(['test'], job.result['success'])
+
+        ret = self.server.get('/jobs/unknown', status=404)
+        self.assertEqual(1, ret.json['ret'])
+
+    def test_max_request_size(self):
+        self.g_m.node_flash.return_value = 0
+        files = [('firmware', 'idle.elf', b'elf32arm0X1234')]
+
+        server = webtest.TestApp(rest_server.GatewayRest(self.g_m, 10))
+        server.post('/open/flash', upload_files=files, status=413)
+        self.assertFalse(self.g_m.node_flash.called)
+
+        server = webtest.TestApp(rest_server.GatewayRest(self.g_m, 1000))
+        ret = server.post('/open/flash', upload_files=files)
+        self.assertEqual(0, ret.json['ret'])
+
+        # Chunked body size is unknown
+        server.post('/open/flash', upload_files=files, status=411,
+                    headers={'Transfer-Encoding': 'chunked'})
+        self.assertEqual(1, self.g_m.node_flash.call_count)
+
     def test_flash_idle(self):
         self.g_m.node_flash.return_value = 0
 
@@ -320,9 +612,20 @@ class TestServerRestMain(unittest.TestCase):
 
     @mock.patch(utils.READ_CONFIG, utils.read_config_mock('m3'))
     @mock.patch('gateway_code.utils.subprocess_timeout.call')  # CN flash
+    @mock.patch('gateway_code.utils.usb_inventory.INVENTORY')
     @mock.patch('bottle.run')
-    def test_main_function(self, run_mock, call_mock):
+    def test_main_function(self, run_mock, inventory, call_mock):
         call_mock.return_value = 0
         args = ['rest_server.py', 'localhost', '8080']
         rest_server._main(args)
         self.assertTrue(run_mock.called)
+        self.assertTrue(inventory.start.called)
+        self.assertEqual('paste', run_mock.call_args[1]['server'])
+        self.assertEqual(10, run_mock.call_args[1]['threadpool_workers'])
+
+        args += ['--server', 'waitress', '--threads', '2',
+                 '--max-request-size', '1000']
+        rest_server._main(args)
+        self.assertEqual('waitress', run_mock.call_args[1]['server'])
+        self.assertEqual(2, run_mock.call_args[1]['threads'])
+        self.assertEqual(1000, run_mock.call_args[0][0].max_request_size)
@@ -0,0 +1,181 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" FIFO queue of commands waiting for an instance lock
+
+Long commands (experiment start/stop) are queued in arrival order instead of
+failing when the lock is busy. A command waits until it is the queue head
+and the lock is free, or until its deadline. When the queue is full or the
+deadline expires, `CommandQueueError` gives its position and an estimated
+time before it could run, computed from the commands historical durations.
+"""
+
+import os
+import time
+import errno
+import functools
+import threading
+import collections
+
+# Max queued commands, including the running one
+QUEUE_SIZE = 8
+# Default time a command waits in queue
+DEFAULT_TIMEOUT = 60.0
+# Estimated duration for commands never run before
+DEFAULT_DURATION = 30.0
+# Lock is also taken by non queued commands which do not notify the queue
+POLL_INTERVAL = 0.1
+
+
+class CommandQueueError(EnvironmentError):
+    """ Command not run, queue full (EWOULDBLOCK) or deadline (ETIMEDOUT) """
+
+    def __init__(self, err, name, position, eta):
+        super().__init__(err, os.strerror(err), name)
+        self.position = position
+        self.eta = eta
+
+    def as_dict(self):
+        """ Return error infos as a json serializable dict """
+        return {'error': self.strerror, 'command': self.filename,
+                'position': self.position, 'eta': round(self.eta, 1)}
+
+
+class _Ticket:  # pylint:disable=too-few-public-methods
+    """ Queued command """
+
+    def __init__(self, name):
+        self.name = name
+        self.thread = threading.get_ident()
+        self.started = None
+
+
+class CommandQueue:
+    """ Bounded FIFO of commands run with `lock` held
+
+    :param lock: RLock protecting the commands
+    :param maxsize: maximum number of queued commands
+    :param estimate: function returning the expected duration of a command
+        from its name or None if unknown
+    """
+
+    def __init__(self, lock, maxsize=QUEUE_SIZE, estimate=None):
+        self.lock = lock
+        self.maxsize = maxsize
+        self.estimate = estimate or (lambda name: None)
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+
+    def _duration(self, ticket):
+        """ Expected remaining duration of `ticket` command """
+        duration = self.estimate(ticket.name)
+        duration = DEFAULT_DURATION if duration is None else duration
+        if ticket.started is not None:
+            duration -= time.monotonic() - ticket.started
+        return max(0.0, duration)
+
+    def _eta(self, position):
+        """ Estimated time before command at `position` starts """
+        return sum(self._duration(ticket)
+                   for ticket in list(self._queue)[:position])
+
+    def status(self):
+        """ Return the queued commands with their position and ETA """
+        with self._cond:
+            return [{'command': ticket.name, 'position': pos,
+                     'running': ticket.started is not None,
+                     'eta': round(self._eta(pos), 1)}
+                    for pos, ticket in enumerate(self._queue)]
+
+    def _is_running_thread(self):
+        """ Current thread is running the head command (nested call) """
+        return bool(self._queue) and self._queue[0].started is not None and \
+            self._queue[0].thread == threading.get_ident()
+
+    def run(self, name, timeout, func, *args, **kwargs):
+        """ Run `func(*args, **kwargs)` when all previous commands are done
+
+        :param name: command name, used for duration estimation
+        :param timeout: maximum time waiting in queue, None for default
+        :raises CommandQueueError: queue is full or `timeout` expired
+        """
+        timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+        with self._cond:
+            if self._is_running_thread():
+                return func(*args, **kwargs)
+            ticket = self._enqueue(name, timeout)
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.lock.release()
+            with self._cond:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def _enqueue(self, name, timeout):
+        """ Wait in queue until `name` can be run with lock held.
+
+        Must be called with `_cond` held """
+        position = len(self._queue)
+        if position >= self.maxsize:
+            raise CommandQueueError(errno.EWOULDBLOCK, name, position,
+                                    self._eta(position))
+
+        ticket = _Ticket(name)
+        self._queue.append(ticket)
+        deadline = time.monotonic() + timeout
+        while not (self._queue[0] is ticket and
+                   self.lock.acquire(blocking=False)):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                position = self._queue.index(ticket)
+                err = CommandQueueError(errno.ETIMEDOUT, name, position,
+                                        self._eta(position))
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+                raise err
+            self._cond.wait(min(remaining, POLL_INTERVAL))
+        ticket.started = time.monotonic()
+        return ticket
+
+
+def queued(queuename, name=None):
+    """ Decorator running the method through the instance `queuename` queue
+
+    The decorated method accepts a 'queue_timeout' keyword argument, the max
+    time waiting in queue.
+
+    :param name: command name, defaults to the method name
+    """
+    def _wrap(func):
+        """ Decorator implementation """
+        cmd_name = name or func.__name__
+
+        @functools.wraps(func)
+        def _wrapped_f(self, *args, queue_timeout=None, **kwargs):
+            """ Function run through command queue """
+            queue = getattr(self, queuename)
+            return queue.run(cmd_name, queue_timeout,
+                             func, self, *args, **kwargs)
+        return _wrapped_f
+    return _wrap
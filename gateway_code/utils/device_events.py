@@ -0,0 +1,195 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Device files appearance/disappearance events
+
+Waiters are woken up by inotify events on the device files directories
+instead of polling them. One shared reader thread handles all the watches.
+
+When inotify is not available, it falls back to polling.
+"""
+
+import os
+import time
+import errno
+import select
+import logging
+import threading
+import ctypes
+import ctypes.util
+
+LOGGER = logging.getLogger('gateway_code')
+
+# sys/inotify.h
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_CLOEXEC = 0o2000000
+IN_MASK = (IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+           IN_DELETE_SELF)
+
+
+def _inotify_libc():
+    """ Return libc if it implements inotify, None otherwise """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+    except (OSError, AttributeError, TypeError):  # pragma: no cover
+        return None
+    return libc
+
+
+class DeviceEvents:
+    """ Wait for device files to appear, disappear or be stable.
+
+    Wake-up happens on any event in the watched directories. Conditions are
+    still checked every `POLL_INTERVAL` in case an event is missed, or every
+    `FALLBACK_INTERVAL` when inotify is not available.
+    """
+    POLL_INTERVAL = 0.5
+    FALLBACK_INTERVAL = 0.1
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._libc = _inotify_libc()
+        self._fd = None
+        self._watched = set()
+        self._thread = None
+        self._last_event = None  # monotonic time of the last inotify event
+
+    @property
+    def interval(self):
+        """ Maximum time between two conditions checks """
+        return self.POLL_INTERVAL if self._fd else self.FALLBACK_INTERVAL
+
+    def wait(self, path, present=True, timeout=0):
+        """ Wait at max `timeout` for `path` to be `present` or not
+
+        :return: True if `path` presence is `present` before timeout """
+        return self.wait_stable(path, present, 0, timeout)
+
+    def wait_stable(self, path, present=True,
+                    stable_time=0, timeout=0, quiet=False):
+        """ Wait at max `timeout` for `path` presence to stay equal to
+        `present` during `stable_time` seconds.
+
+        :param quiet: also wait `stable_time` after the last event in the
+            watched directories, so a quick disappear/reappear between two
+            checks is not missed
+        :return: True if condition is met before timeout """
+        time_ref = time.monotonic()
+        deadline = time_ref + timeout
+        since = None
+
+        with self._cond:
+            while True:
+                self._watch(path)
+                now = time.monotonic()
+                if os.path.exists(path) == present:
+                    since = now if since is None else since
+                    if quiet and self._last_event is not None:
+                        since = max(since, self._last_event)
+                    if now - since >= stable_time:
+                        return True
+                    wait_time = since + stable_time - now
+                else:
+                    since = None
+                    wait_time = self.interval
+                if now >= deadline:
+                    return False
+                self._cond.wait(min(wait_time, self.interval, deadline - now))
+
+    def _watch(self, path):
+        """ Watch `path` directory, and its symlink target directory """
+        dirs = {os.path.dirname(os.path.abspath(path))}
+        if os.path.islink(path):
+            dirs.add(os.path.dirname(os.path.realpath(path)))
+        with self._lock:
+            if not self._start():
+                return
+            for directory in dirs - self._watched:
+                self._add_watch(directory)
+
+    def _add_watch(self, directory):
+        """ Add an inotify watch on `directory` or its first existing parent
+
+        Missing directory is not registered, to be watched once it exists. """
+        watched = directory
+        while not os.path.isdir(watched):
+            watched = os.path.dirname(watched)
+        wd_ = self._libc.inotify_add_watch(self._fd, watched.encode(),
+                                           IN_MASK)
+        if wd_ < 0:  # pragma: no cover
+            err = ctypes.get_errno()
+            LOGGER.debug('inotify watch %s: %s', watched, os.strerror(err))
+            return
+        if watched == directory:
+            self._watched.add(directory)
+
+    def _start(self):
+        """ Start inotify reader thread if not already started
+
+        :return: True if inotify is running """
+        if self._fd is not None:
+            return True
+        if self._libc is None:  # pragma: no cover
+            return False
+        fd_ = self._libc.inotify_init1(IN_CLOEXEC)
+        if fd_ < 0:  # pragma: no cover
+            err = ctypes.get_errno()
+            LOGGER.warning('inotify not available: %s', os.strerror(err))
+            self._libc = None
+            return False
+
+        self._fd = fd_
+        self._thread = threading.Thread(target=self._reader,
+                                        name='device_events', daemon=True)
+        self._thread.start()
+        return True
+
+    def _reader(self):
+        """ Notify waiters on each inotify events """
+        while True:
+            try:
+                select.select([self._fd], [], [])
+                os.read(self._fd, 4096)
+            except OSError as err:  # pragma: no cover
+                if err.errno == errno.EINTR:
+                    continue
+                LOGGER.error('Device events reader stopped: %r', err)
+                with self._lock:
+                    os.close(self._fd)
+                    self._fd = None
+                    self._watched.clear()
+                break
+            with self._cond:
+                self._last_event = time.monotonic()
+                self._cond.notify_all()
+
+
+DEVICE_EVENTS = DeviceEvents()
@@ -23,23 +23,97 @@
 
 from __future__ import print_function
 
+import os
 import sys
+import struct
 import logging
 
 from elftools.elf.constants import SH_FLAGS
 from elftools.elf.elffile import ELFFile
+from elftools.elf.enums import ENUM_EI_CLASS, ENUM_E_MACHINE, ENUM_E_TYPE
 import elftools.common.exceptions
 
 LOGGER = logging.getLogger('gateway_code')
 
 TYPE_EXECUTABLE = 'ET_EXEC'
 
+# e_ident[16], e_type, e_machine
+HEADER_SIZE = 20
+_ELF_MAGIC = b'\x7fELF'
+_ENDIANNESS = {1: '<', 2: '>'}  # EI_DATA: ELFDATA2LSB, ELFDATA2MSB
+
+# Targets already read from the headers of files being written
+_KNOWN_TARGETS = {}
+
+
+def _enum_name(enum, value):
+    """Return `enum` name for `value`, or the value if unknown."""
+    for name, val in enum.items():
+        if val == value:
+            return name
+    return value
+
+
+def header_target(header):
+    """Returns elf (class, machine) tuple from the elf file first bytes.
+
+    Same as `elf_target` when file is being received.
+
+    :param header: at least the first `HEADER_SIZE` bytes of the file
+    :raises: ValueError if header is not an executable elf file header.
+    """
+    header = bytes(header[:HEADER_SIZE])
+    if len(header) < HEADER_SIZE or header[:4] != _ELF_MAGIC:
+        raise ValueError('Not a valid elf file')
+    endian = _ENDIANNESS.get(header[5])
+    if endian is None:
+        raise ValueError('Not a valid elf file')
+
+    e_type, e_machine = struct.unpack(endian + 'HH', header[16:20])
+    e_type = _enum_name(ENUM_E_TYPE, e_type)
+    if e_type != TYPE_EXECUTABLE:
+        raise ValueError(f'Not an executable elf file: {e_type}')
+
+    return (_enum_name(ENUM_EI_CLASS, header[4]),
+            _enum_name(ENUM_E_MACHINE, e_machine))
+
+
+def _file_id(filepath):
+    """Identify file content version by path, inode, size and mtime."""
+    stat = os.stat(filepath)
+    return (os.path.abspath(filepath), stat.st_ino, stat.st_size,
+            stat.st_mtime_ns)
+
+
+def register_target(filepath, target):
+    """Save `target` read from `filepath` header, valid until it changes."""
+    _KNOWN_TARGETS[os.path.abspath(filepath)] = (_file_id(filepath), target)
+
+
+def forget_target(filepath):
+    """Remove `filepath` target saved with `register_target`."""
+    _KNOWN_TARGETS.pop(os.path.abspath(filepath), None)
+
+
+def _known_target(filepath):
+    """Return target saved for `filepath` if file did not change."""
+    file_id, target = _KNOWN_TARGETS.get(os.path.abspath(filepath),
+                                         (None, None))
+    try:
+        return target if file_id == _file_id(filepath) else None
+    except OSError:
+        return None
+
 
 def elf_target(filepath):
     """Returns elf (class, machine) tuple.
 
     :raises: ValueError if file is not an executable elf file.
     """
+    target = _known_target(filepath)
+    if target is not None:
+        return target
+
     try:
         with open(filepath, 'rb') as _file:
             elffile = ELFFile(_file)
@@ -0,0 +1,161 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Track the default firmware flashed on nodes to skip redundant flashes
+
+The sha256 of the default firmware (idle, control node) flashed on a node
+is stored in `config.RUN_DIR`. Flashing the same default firmware again is
+skipped. The record is removed before any other flash, or on debug session
+start, as the node flash content is not known anymore then.
+All records are cleared on gateway daemon start, so its setup really flashes
+and resets the nodes.
+
+User firmwares are never skipped: they run and may rewrite their flash,
+and users expect a flash to restart their firmware.
+
+`config.RUN_DIR` should be on a volatile filesystem (/var/run), so records
+are lost on gateway power loss. Tracking is disabled when it is not set.
+"""
+
+import os
+import hashlib
+import logging
+import functools
+
+from gateway_code import config
+
+LOGGER = logging.getLogger('gateway_code')
+
+
+def node_key(node):
+    """ Node identifier, supports multiple nodes on the same gateway
+
+    >>> class Node:  # pylint:disable=too-few-public-methods
+    ...     TYPE = 'm3'
+    >>> node_key(Node())
+    'm3'
+    >>> Node.OPENOCD_SERIAL_NUMBER = '42'
+    >>> node_key(Node())
+    'm3_42'
+    """
+    serial = getattr(node, 'OPENOCD_SERIAL_NUMBER', None)
+    return node.TYPE if serial is None else f'{node.TYPE}_{serial}'
+
+
+def file_digest(path):
+    """ Return sha256 hexdigest of file at `path` """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as _file:
+        for chunk in iter(functools.partial(_file.read, 65536), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class FirmwareState:
+    """ Flashed firmware records, one file per node in `config.RUN_DIR` """
+    SUFFIX = '.firmware'
+
+    @staticmethod
+    def enabled():
+        """ Tracking enabled if RUN_DIR is configured and exists """
+        return config.RUN_DIR is not None and os.path.isdir(config.RUN_DIR)
+
+    def _path(self, node):
+        """ Record file path for `node` """
+        return os.path.join(config.RUN_DIR, node_key(node) + self.SUFFIX)
+
+    def get(self, node):
+        """ Return the recorded firmware digest for `node` or None """
+        if not self.enabled():
+            return None
+        try:
+            with open(self._path(node)) as record:
+                return record.read().strip() or None
+        except IOError:
+            return None
+
+    def set(self, node, digest):
+        """ Record `digest` as the firmware flashed on `node` """
+        if not self.enabled():
+            return
+        path = self._path(node)
+        try:
+            with open(path + '.tmp', 'w') as record:
+                record.write(digest + '\n')
+            os.replace(path + '.tmp', path)
+        except OSError as err:
+            LOGGER.warning('Could not record flashed firmware: %r', err)
+
+    def invalidate(self, node):
+        """ Forget the firmware flashed on `node` """
+        if not self.enabled():
+            return
+        try:
+            os.remove(self._path(node))
+        except OSError:
+            pass
+
+    def clear(self):
+        """ Forget the firmwares flashed on all nodes """
+        if not self.enabled():
+            return
+        for name in os.listdir(config.RUN_DIR):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                os.remove(os.path.join(config.RUN_DIR, name))
+            except OSError:
+                pass
+
+
+FIRMWARE_STATE = FirmwareState()
+
+
+def tracked(default_fw_attr):
+    """ Decorator skipping a flash of the default firmware when already there
+
+    Decorated method is called as `flash(self, firmware_path=None, ...)`,
+    `firmware_path` None meaning the firmware at `self.default_fw_attr`.
+    """
+    def _wrap(func):
+        """ Decorator implementation """
+        @functools.wraps(func)
+        def _wrapped_f(self, *args, **kwargs):
+            """ Flash function with flashed firmware tracking """
+            firmware_path = args[0] if args else kwargs.get('firmware_path')
+            digest = None
+            debugging = getattr(self, '_in_debug', False)
+            if (firmware_path is None and not debugging and
+                    FIRMWARE_STATE.enabled()):
+                digest = file_digest(getattr(self, default_fw_attr))
+                if FIRMWARE_STATE.get(self) == digest:
+                    LOGGER.info('Firmware %s already flashed on %s, skip',
+                                default_fw_attr, node_key(self))
+                    return 0
+            FIRMWARE_STATE.invalidate(self)
+
+            ret = func(self, *args, **kwargs)
+            if ret == 0 and digest is not None:
+                FIRMWARE_STATE.set(self, digest)
+            return ret
+        return _wrapped_f
+    return _wrap
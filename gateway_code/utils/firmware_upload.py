@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Save an uploaded firmware to disk in a single streaming pass
+
+The upload is copied by chunks, so memory usage does not depend on the
+firmware size. Its sha256 and elf target are computed during the copy, the
+elf target is registered to `elftarget` so it is not read again.
+"""
+
+import hashlib
+import logging
+from tempfile import NamedTemporaryFile
+
+from gateway_code.utils import elftarget
+
+LOGGER = logging.getLogger('gateway_code')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FirmwareUpload:
+    """ Uploaded firmware temporary file
+
+    :param fileobj: file like object with the firmware content
+    :param filename: uploaded file name, used as temporary file suffix
+    """
+
+    def __init__(self, fileobj, filename):
+        self.file = NamedTemporaryFile(suffix='--' + filename)
+        self.size = 0
+        self.elf_target = None
+        sha256 = hashlib.sha256()
+        header = b''
+
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.file.write(chunk)
+            sha256.update(chunk)
+            self.size += len(chunk)
+            if len(header) < elftarget.HEADER_SIZE:
+                header += chunk[:elftarget.HEADER_SIZE - len(header)]
+        self.file.flush()
+        self.sha256 = sha256.hexdigest()
+
+        try:
+            self.elf_target = elftarget.header_target(header)
+            elftarget.register_target(self.name, self.elf_target)
+        except ValueError:
+            pass  # binary firmware or invalid, checked by users
+
+    @property
+    def name(self):
+        """ Temporary file path """
+        return self.file.name
+
+    def close(self):
+        """ Remove the temporary file """
+        elftarget.forget_target(self.name)
+        self.file.close()
@@ -24,6 +24,8 @@
 import re
 import subprocess
 import logging
+
+from gateway_code.utils import usb_inventory
 LOGGER = logging.getLogger('gateway_code')
 
 DEV_LIST = {
@@ -36,7 +38,13 @@ DEV_LIST = {
 
 
 def ftdi_check(node, ftdi_type, description=None):
-    """ Detect if a node ftdi is present 0 on success """
+    """ Detect if a node ftdi is present 0 on success
+
+    Read from the USB inventory snapshot when it is running """
+    snapshot = usb_inventory.INVENTORY.snapshot()
+    if snapshot is not None:
+        return snapshot.ftdi_check(node, ftdi_type, description)
+
     LOGGER.info("Check %r node ftdi", node)
 
     output = subprocess.check_output(['ftdi-devices-list', '-t', ftdi_type])
@@ -0,0 +1,152 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Long running operations run in background as jobs
+
+A job runs a function in its own thread and keeps its status, timings and
+result. The current operation stage is updated with `set_stage`, called by
+`common.logger_call`, from the job thread or threads it started with the
+job context.
+
+Finished jobs are kept in a bounded table, oldest are evicted first.
+"""
+
+import os
+import time
+import uuid
+import errno
+import logging
+import threading
+import contextvars
+import collections
+
+LOGGER = logging.getLogger('gateway_code')
+
+MAX_JOBS = 64
+
+CURRENT_JOB = contextvars.ContextVar('current_job', default=None)
+
+
+def set_stage(stage):
+    """ Set the current job progress stage, if running in a job """
+    job = CURRENT_JOB.get()
+    if job is not None:
+        job.stage = stage
+
+
+class Job:  # pylint:disable=too-many-instance-attributes
+    """ Function run in background """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    ERROR = 'error'
+
+    def __init__(self, operation, func, *args, **kwargs):
+        self.id = uuid.uuid4().hex  # pylint:disable=invalid-name
+        self.operation = operation
+        self.status = self.QUEUED
+        self.stage = None
+        self.created = time.time()
+        self.started = None
+        self.ended = None
+        self.result = None
+        self.error = None
+        self._call = (func, args, kwargs)
+        self._done = threading.Event()
+
+    @property
+    def finished(self):
+        """ Job is done or failed """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """ Wait until job is finished, return `finished` """
+        return self._done.wait(timeout)
+
+    def run(self):
+        """ Run job function, save result or error """
+        CURRENT_JOB.set(self)
+        func, args, kwargs = self._call
+        self.started = time.time()
+        self.status = self.RUNNING
+        try:
+            self.result = func(*args, **kwargs)
+            self.status = self.DONE
+        except Exception as err:  # pylint:disable=broad-except
+            LOGGER.error('Job %s %s failed: %r', self.operation, self.id, err)
+            self.error = err.as_dict() if hasattr(err, 'as_dict') else str(err)
+            self.status = self.ERROR
+        finally:
+            self.ended = time.time()
+            self._call = None
+            self._done.set()
+
+    def as_dict(self):
+        """ Return the job state as a json serializable dict """
+        end = self.ended or time.time()
+        return {'id': self.id, 'operation': self.operation,
+                'status': self.status, 'stage': self.stage,
+                'created': self.created, 'started': self.started,
+                'ended': self.ended,
+                'duration': end - self.started if self.started else None,
+                'result': self.result, 'error': self.error}
+
+
+class JobTable:
+    """ Start jobs and keep at most `maxsize` of them """
+
+    def __init__(self, maxsize=MAX_JOBS):
+        self.maxsize = maxsize
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, operation, func, *args, **kwargs):
+        """ Start `func(*args, **kwargs)` in a new job and return it
+
+        :raises EnvironmentError: EWOULDBLOCK if table is full of
+            running jobs
+        """
+        job = Job(operation, func, *args, **kwargs)
+        with self._lock:
+            self._evict(self.maxsize - 1)
+            if len(self._jobs) >= self.maxsize:
+                err = errno.EWOULDBLOCK
+                raise EnvironmentError(err, os.strerror(err), 'JobTable')
+            self._jobs[job.id] = job
+
+        # Run in a fresh context, not the one of the request thread
+        thread = threading.Thread(target=contextvars.Context().run,
+                                  args=(job.run,), daemon=True,
+                                  name=f'job-{operation}')
+        thread.start()
+        return job
+
+    def _evict(self, size):
+        """ Remove oldest finished jobs until there are at most `size` """
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished][:max(0, len(self._jobs) - size)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """ Return job `job_id` or None """
+        with self._lock:
+            return self._jobs.get(job_id)
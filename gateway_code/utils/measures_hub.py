@@ -0,0 +1,238 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" In-process publish/subscribe hub of the control node measures
+
+The control node serial interface measures lines are published to the hub
+while an experiment runs. Subscribers get them through a bounded queue,
+filtered by stream type ('consumption', 'radio', ...).
+A subscriber not reading fast enough to keep up is dropped, the publisher
+never waits.
+"""
+
+import os
+import errno
+import queue
+import logging
+import threading
+
+LOGGER = logging.getLogger('gateway_code')
+
+QUEUE_SIZE = 1024
+MAX_SUBSCRIBERS = 4
+KEEPALIVE = 15.0
+# Consumption measures, in the control node lines order
+CONSUMPTION = ('power', 'voltage', 'current')
+
+
+def parse_measure(line):
+    """ Return (stream, data) of a measures debug line, None if invalid
+
+    `line` may be bytes, so sinks do not decode it, the result is then bytes
+
+    >>> parse_measure('measures_debug: radio_measure 1378466517.186216 11 -91')
+    ('radio', '1378466517.186216 11 -91')
+    >>> parse_measure(b'measures_debug: consumption_measure')
+    (b'consumption', b'')
+    >>> parse_measure('measures_debug:') is None
+    True
+    """
+    space, suffix = ((b' ', b'_measure') if isinstance(line, bytes) else
+                     (' ', '_measure'))
+    fields = line.split(space, 2)
+    if len(fields) < 2:
+        return None
+    stream = fields[1]
+    if stream.endswith(suffix):
+        stream = stream[:-len(suffix)]
+    return stream, (fields[2] if len(fields) > 2 else line[:0])
+
+
+def measure_fields(data):
+    """ Return measure `data` timestamp and values fields
+
+    The control node relative time joined to the timestamp by ':' is removed
+
+    >>> measure_fields('1377268768.841070:1.78250 0.000000 3.230000 0.080003')
+    ['1377268768.841070', '0.000000', '3.230000', '0.080003']
+    >>> measure_fields(b'1378466517.186216 11 -91')
+    [b'1378466517.186216', b'11', b'-91']
+    """
+    fields = data.split()
+    if fields:
+        colon = b':' if isinstance(data, bytes) else ':'
+        fields[0] = fields[0].split(colon, 1)[0]
+    return fields
+
+
+def parse_values(data):
+    """ Return measure `data` [timestamp, values...] as floats, None if invalid
+
+    >>> parse_values(b'1377268768.841070:1.78250 0.000000 3.230000 0.080003')
+    [1377268768.84107, 0.0, 3.23, 0.080003]
+    >>> parse_values('1378466517.186216 11 -91')
+    [1378466517.186216, 11.0, -91.0]
+    >>> parse_values(b'9.9 a b c') is None, parse_values(b'') is None
+    (True, True)
+    """
+    try:
+        return [float(field) for field in measure_fields(data)] or None
+    except ValueError:
+        return None
+
+
+def consumption_values(values, fields):
+    """ Return consumption measure `values` of enabled `fields`, None if
+    invalid
+
+    Lines have all the `CONSUMPTION` values, 'nan' when disabled, or only the
+    enabled ones
+
+    >>> consumption_values([float('nan'), 3.23, 0.08], ('voltage', 'current'))
+    [3.23, 0.08]
+    >>> consumption_values([3.23], ('voltage',))
+    [3.23]
+    >>> consumption_values([0.2, 3.23], ('power',)) is None
+    True
+    """
+    if len(values) == len(fields):
+        return values
+    if len(values) == len(CONSUMPTION):
+        return [value for field, value in zip(CONSUMPTION, values)
+                if field in fields]
+    return None
+
+
+def parse_line(line):
+    """ Return (stream, [timestamp, values...]) of a measures debug line,
+    None if invalid
+
+    >>> parse_line(b'measures_debug: consumption_measure '
+    ...            b'1377268768.841070:1.78250 0.000000 3.230000 0.080003')
+    (b'consumption', [1377268768.84107, 0.0, 3.23, 0.080003])
+    >>> parse_line(b'measures_debug: radio_measure 4.0 a') is None
+    True
+    """
+    measure = parse_measure(line)
+    if measure is None:
+        return None
+    values = parse_values(measure[1])
+    if values is None:
+        return None
+    return measure[0], values
+
+
+class Subscription:
+    """ Measures of `streams` (all if None) received from `hub` """
+
+    def __init__(self, hub, streams=None, maxsize=QUEUE_SIZE):
+        self.hub = hub
+        self.streams = frozenset(streams) if streams else None
+        self.dropped = False
+        self._queue = queue.Queue(maxsize)
+
+    def wants(self, stream):
+        """ Subscription receives `stream` measures """
+        return self.streams is None or stream in self.streams
+
+    def put(self, measure):
+        """ Queue `measure` without waiting, return False if queue is full """
+        try:
+            self._queue.put_nowait(measure)
+            return True
+        except queue.Full:
+            return False
+
+    def events(self, keepalive=KEEPALIVE):
+        """ Yield (stream, data) measures until dropped
+
+        Yield (None, None) when no measure was received in `keepalive`
+        seconds. """
+        while not self.dropped:
+            try:
+                yield self._queue.get(timeout=keepalive)
+            except queue.Empty:
+                yield None, None
+
+    def close(self):
+        """ Stop receiving measures """
+        self.hub.unsubscribe(self)
+
+
+class MeasuresHub:
+    """ Dispatch measures to subscribers """
+
+    def __init__(self, max_subscribers=MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        # Replaced, not modified, so publish does not need the lock
+        self._subscribers = ()
+
+    @property
+    def subscribers(self):
+        """ Number of subscribers """
+        return len(self._subscribers)
+
+    def subscribe(self, streams=None, maxsize=QUEUE_SIZE):
+        """ Return a new Subscription to `streams` measures
+
+        :raises EnvironmentError(EWOULDBLOCK): too many subscribers """
+        subscription = Subscription(self, streams, maxsize)
+        with self._lock:
+            self.check_available()
+            self._subscribers += (subscription,)
+        return subscription
+
+    def check_available(self):
+        """ Check a new subscriber is accepted
+
+        :raises EnvironmentError(EWOULDBLOCK): too many subscribers """
+        if len(self._subscribers) >= self.max_subscribers:
+            err = errno.EWOULDBLOCK
+            raise EnvironmentError(err, os.strerror(err), 'measures')
+
+    def unsubscribe(self, subscription):
+        """ Remove `subscription`, if still subscribed """
+        with self._lock:
+            self._subscribers = tuple(sub for sub in self._subscribers
+                                      if sub is not subscription)
+
+    def publish(self, line):
+        """ Send measures debug `line` to the interested subscribers """
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        measure = parse_measure(line)
+        if measure is None or parse_values(measure[1]) is None:
+            return
+        # same timestamp format for every measure
+        measure = measure[0], ' '.join(measure_fields(measure[1]))
+        for subscription in subscribers:
+            if not subscription.wants(measure[0]):
+                continue
+            if not subscription.put(measure):
+                LOGGER.warning('Measures subscriber too slow, dropped')
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+
+
+HUB = MeasuresHub()
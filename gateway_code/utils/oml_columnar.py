@@ -0,0 +1,298 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Convert OML text measures files to columnar '.npz' files
+
+OML text files are parsed in one streaming pass, each schema column being
+appended to a local temporary file. Columns are then copied as '.npy'
+arrays, named '<schema>/<column>', to a '.npz' archive next to the OML file.
+Memory use does not depend on the file size, and numpy is not required.
+
+A '<schema>/index_time' array has the time of every `INDEX_STEP` rows, to
+find a time range without reading the whole columns.
+
+Conversion is run in background by `CONVERTER` after experiments stop.
+"""
+
+import os
+import sys
+import queue
+import array
+import struct
+import logging
+import zipfile
+import tempfile
+import threading
+
+from gateway_code import config
+
+LOGGER = logging.getLogger('gateway_code')
+
+# Experiment files converted
+STREAMS = ('consumption', 'radio', 'event')
+INDEX_STEP = 1024
+# Values kept in memory per column before writing them
+CHUNK = 4096
+
+_ORDER = '<' if sys.byteorder == 'little' else '>'
+# OML types: array typecode and numpy type. Others are stored as strings
+TYPES = {
+    'int32': ('i', _ORDER + 'i4'),
+    'uint32': ('I', _ORDER + 'u4'),
+    'int64': ('q', _ORDER + 'i8'),
+    'uint64': ('Q', _ORDER + 'u8'),
+    'double': ('d', _ORDER + 'f8'),
+}
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+def npy_header(descr, length):
+    """ Return '.npy' format header for `length` values of `descr` type
+
+    >>> header = npy_header('<f8', 3)
+    >>> len(header) % 64, header[10:].decode().strip()
+    (0, "{'descr': '<f8', 'fortran_order': False, 'shape': (3,), }")
+    """
+    header = (f"{{'descr': '{descr}', 'fortran_order': False, "
+              f"'shape': ({length},), }}")
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + ' ' * padding + '\n').encode('latin-1')
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header
+
+
+def npz_path(path):
+    """ Columnar file path for OML file `path`
+
+    >>> npz_path('/iotlab/users/user/.iot-lab/1/consumption/m3-1.oml')
+    '/iotlab/users/user/.iot-lab/1/consumption/m3-1.npz'
+    """
+    return os.path.splitext(path)[0] + '.npz'
+
+
+class _Column:
+    """ Values of one column, stored in a temporary file """
+
+    def __init__(self, name, oml_type):
+        self.name = name
+        self.typecode, self.descr = TYPES.get(oml_type, (None, None))
+        self.count = 0
+        self.width = 1  # strings max length
+        self._file = tempfile.TemporaryFile()
+        self._values = [] if self.typecode is None else array.array(
+            self.typecode)
+
+    def parse(self, value):
+        """ Return `value` text converted to the column type
+        :raises ValueError: invalid value """
+        if self.typecode is None:
+            return value
+        if self.typecode == 'd':
+            return float(value)
+        return int(value)
+
+    def append(self, value):
+        """ Add parsed `value` """
+        self._values.append(value)
+        self.count += 1
+        if len(self._values) >= CHUNK:
+            self._flush()
+
+    def _flush(self):
+        if self.typecode is not None:
+            self._values.tofile(self._file)
+            del self._values[:]
+            return
+        for value in self._values:
+            self.width = max(self.width, len(value))
+            self._file.write(value.encode('utf-8') + b'\n')
+        del self._values[:]
+
+    def write_npy(self, output):
+        """ Write column as a '.npy' array to `output` file object """
+        self._flush()
+        self._file.seek(0)
+        if self.typecode is not None:
+            output.write(npy_header(self.descr, self.count))
+            while True:
+                data = self._file.read(CHUNK * 8)
+                if not data:
+                    break
+                output.write(data)
+            return
+        # fixed width utf-32 strings
+        output.write(npy_header(f'{_ORDER}U{self.width}', self.count))
+        encoding = 'utf-32-le' if _ORDER == '<' else 'utf-32-be'
+        size = 4 * self.width
+        for line in self._file:
+            output.write(line[:-1].decode('utf-8').encode(encoding).ljust(
+                size, b'\0'))
+
+    def close(self):
+        """ Remove temporary file """
+        self._file.close()
+
+
+class _Schema:
+    """ OML schema columns and time index """
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = [_Column('oml_ts', 'double'),
+                        _Column('oml_seqno', 'uint32')]
+        self.columns += [_Column(*column.split(':', 1)) for column in columns]
+        self.index = _Column('index_time', 'double')
+        names = [column.name for column in self.columns]
+        if 'timestamp_s' in names and 'timestamp_us' in names:
+            self._time = (names.index('timestamp_s'),
+                          names.index('timestamp_us'))
+        else:
+            self._time = None
+
+    @property
+    def rows(self):
+        """ Number of rows """
+        return self.columns[0].count
+
+    def add_row(self, fields):
+        """ Add row `fields` text values, without the schema number
+        :raises ValueError: invalid row """
+        if len(fields) != len(self.columns):
+            raise ValueError('Invalid fields number')
+        values = [column.parse(field)
+                  for column, field in zip(self.columns, fields)]
+        if not self.rows % INDEX_STEP:
+            self.index.append(self._row_time(values))
+        for column, value in zip(self.columns, values):
+            column.append(value)
+
+    def _row_time(self, values):
+        if self._time is None:
+            return values[0]
+        seconds, micro = self._time
+        return values[seconds] + values[micro] * 1e-6
+
+    def write(self, archive):
+        """ Write columns and index to `archive` zip file """
+        for column in self.columns + [self.index]:
+            name = f'{self.name}/{column.name}.npy'
+            with archive.open(name, 'w', force_zip64=True) as output:
+                column.write_npy(output)
+
+    def close(self):
+        """ Remove temporary files """
+        for column in self.columns + [self.index]:
+            column.close()
+
+
+def _read_header(oml_file):
+    """ Read OML text header, return schemas by number """
+    schemas = {}
+    for line in oml_file:
+        line = line.strip()
+        if not line:
+            break
+        key, _, value = line.partition(': ')
+        if key == 'schema':
+            number, name, *columns = value.split()
+            schemas[number] = _Schema(name, columns)
+    return schemas
+
+
+def convert(path, output=None):
+    """ Convert OML text file `path` to columnar `output`
+
+    :param output: '.npz' file path, `npz_path(path)` if None
+    :return: number of invalid rows skipped """
+    output = output or npz_path(path)
+    invalid = 0
+    with open(path, encoding='utf-8', errors='replace') as oml_file:
+        schemas = _read_header(oml_file)
+        try:
+            for line in oml_file:
+                fields = line.rstrip('\n').split('\t')
+                schema = schemas.get(fields[1]) if len(fields) > 1 else None
+                try:
+                    if schema is None:
+                        raise ValueError('Unknown schema')
+                    schema.add_row(fields[:1] + fields[2:])
+                except ValueError:
+                    invalid += 1
+
+            # user file permissions, as the OML files
+            tmp_output = config.create_user_file(output + '.tmp', 'wb')
+            with zipfile.ZipFile(tmp_output, 'w') as archive:
+                for schema in schemas.values():
+                    if schema.rows:
+                        schema.write(archive)
+            os.rename(tmp_output, output)
+        finally:
+            for schema in schemas.values():
+                schema.close()
+    return invalid
+
+
+class Converter:
+    """ Convert OML files in a background thread """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, paths):
+        """ Convert OML files `paths` in background
+
+        Missing and empty files are ignored """
+        paths = list(paths)
+        if not paths:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='oml_columnar')
+                self._thread.start()
+        for path in paths:
+            self._queue.put(path)
+
+    def wait(self):
+        """ Wait until submitted files are converted """
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                if not os.path.isfile(path) or not os.path.getsize(path):
+                    continue
+                invalid = convert(path)
+                LOGGER.info('Converted %s to columnar file', path)
+                if invalid:
+                    LOGGER.warning('%s: %d invalid OML rows skipped', path,
+                                   invalid)
+            except (OSError, ValueError, zipfile.BadZipFile) as err:
+                LOGGER.error('Columnar conversion of %s failed: %r', path,
+                             err)
+            finally:
+                self._queue.task_done()
+
+
+CONVERTER = Converter()
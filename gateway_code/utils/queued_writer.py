@@ -0,0 +1,98 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Write to a file object from a thread
+
+Measures and frames are read from the control node serial interface, which
+must not wait for slow files on NFS. `QueuedWriter` queues the writes in a
+bounded queue and a thread does them. When the queue is full, data is
+dropped and counted.
+"""
+
+import queue
+import logging
+import threading
+
+LOGGER = logging.getLogger('gateway_code')
+
+# Writes queued before data is dropped
+QUEUE_SIZE = 4096
+
+
+class QueuedWriter:
+    """ Do `output` file object writes in a thread
+
+    :param output: object with `write`, `flush` and `close` methods
+    :param name: writer name, for thread and logs
+
+    >>> import io
+    >>> output = io.StringIO()
+    >>> writer = QueuedWriter(output)
+    >>> writer.write('hello ')
+    >>> writer.write('world')
+    >>> writer.flush()
+    >>> output.getvalue()
+    'hello world'
+    >>> writer.close()
+    """
+
+    def __init__(self, output, maxsize=QUEUE_SIZE, name='queued_writer'):
+        self.output = output
+        self.name = name
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._target, daemon=True,
+                                        name=name)
+        self._thread.start()
+
+    def write(self, data):
+        """ Queue `data` write, drop it if the queue is full """
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """ Wait queued writes and flush output """
+        self._queue.join()
+        self.output.flush()
+
+    def close(self):
+        """ Write queued data and close output """
+        self._queue.put(None)
+        self._thread.join()
+        self.output.close()
+        if self.dropped:
+            LOGGER.warning('%s: %d writes dropped', self.name, self.dropped)
+
+    def _target(self):
+        """ Write queued data until closed """
+        while True:
+            data = self._queue.get()
+            try:
+                if data is None:
+                    return
+                self.output.write(data)
+            except (OSError, ValueError) as err:
+                LOGGER.error('%s: %s', self.name, err)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,539 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" In process serial redirection of the open node serial port to TCP
+
+The serial port is kept open for the whole experiment, and clients can
+connect and reconnect at any time. The first connected client is the writer,
+the next ones are read only mirrors and take its place when it leaves.
+
+A single thread multiplexes the serial port and clients sockets with a
+selector. Each client output is bounded, a client that does not read it
+fast enough is disconnected, so it never slows down the serial port reading.
+
+WebSocket clients can also connect on `ws_port`, serial port data is sent
+in binary frames. They are handled like TCP clients, with the same serial
+port reader.
+"""
+
+import os
+import time
+import errno
+import socket
+import logging
+import functools
+import selectors
+import threading
+
+import serial
+
+from gateway_code.utils import websocket
+
+LOGGER = logging.getLogger('gateway_code')
+
+PORT = 20000
+WS_PORT = 20001
+MAX_CLIENTS = 8
+# Bytes queued per client before it is disconnected
+CLIENT_BUFFER = 2 ** 20
+# Bytes queued to the serial port before the writer is not read anymore
+TTY_BUFFER = 2 ** 16
+READ_SIZE = 2 ** 14
+# Delay before opening serial port again after an error
+TTY_RETRY = 0.5
+# WebSocket handshake request max size
+WS_REQUEST_SIZE = 2 ** 13
+
+
+class Client:
+    """ Connected client socket and its output buffer """
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.out = bytearray()
+        self.writer = False
+        self.events = 0  # registered selector events
+
+    def fileno(self):
+        """ Socket file descriptor """
+        return self.sock.fileno()
+
+    def queue(self, data):
+        """ Queue `data` to send, return False if buffer is full """
+        if self.out and len(self.out) + len(data) > CLIENT_BUFFER:
+            return False
+        self.out += data
+        return True
+
+    def send(self):
+        """ Send queued data, return False if connection is broken """
+        try:
+            sent = self.sock.send(self.out)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        del self.out[:sent]
+        return True
+
+    def recv(self):
+        """ Return received data, b'' when closed """
+        try:
+            return self.sock.recv(READ_SIZE)
+        except BlockingIOError:
+            return None
+        except OSError:
+            return b''
+
+    def close(self):
+        """ Close socket """
+        self.sock.close()
+
+
+class WebSocketClient(Client):
+    """ Connected WebSocket client, data is sent in binary frames
+
+    Data published before the opening handshake is not sent """
+
+    def __init__(self, sock, address):
+        super().__init__(sock, address)
+        self.handshaken = False
+        self._request = b''
+        self._parser = websocket.FrameParser(CLIENT_BUFFER)
+
+    def queue(self, data):
+        """ Queue `data` frame to send, return False if buffer is full """
+        if not self.handshaken:
+            return True
+        header = websocket.frame_header(len(data))
+        if self.out and len(self.out) + len(header) + len(data) > \
+                CLIENT_BUFFER:
+            return False
+        self.out += header
+        self.out += data
+        return True
+
+    def recv(self):
+        """ Return received messages data, b'' when closed """
+        data = super().recv()
+        if not data:
+            return data
+        if not self.handshaken:
+            data = self._handshake(data)
+            if not data:
+                return data
+        try:
+            frames = self._parser.feed(data)
+        except ValueError as err:
+            LOGGER.warning('websocket client %s: %s', self.address, err)
+            return b''
+
+        messages = []
+        for opcode, payload in frames:
+            if opcode == websocket.CLOSE:
+                self._send_now(websocket.frame_header(len(payload[:2]),
+                                                      websocket.CLOSE) +
+                               payload[:2])
+                return b''
+            if opcode == websocket.PING:
+                self.out += websocket.frame_header(len(payload),
+                                                   websocket.PONG)
+                self.out += payload
+            elif opcode != websocket.PONG:
+                messages.append(payload)
+        return b''.join(messages) or None
+
+    def _handshake(self, data):
+        """ Answer opening handshake, return data received after it """
+        self._request += data
+        request, end, data = self._request.partition(b'\r\n\r\n')
+        if not end:
+            return b'' if len(self._request) > WS_REQUEST_SIZE else None
+        try:
+            self.out += websocket.handshake_response(request)
+        except ValueError as err:
+            LOGGER.warning('websocket client %s: %s', self.address, err)
+            self._send_now(websocket.BAD_REQUEST)
+            return b''
+        self.handshaken = True
+        self._request = b''
+        return data or None
+
+    def _send_now(self, data):
+        """ Try sending `data` before closing the connection """
+        try:
+            self.sock.send(data)
+        except OSError:
+            pass
+
+
+class CrnlTranslation:
+    """ socat 'crnl' option: '\\n' is written as '\\r\\n' to the serial port,
+    and '\\r\\n' is read as '\\n'
+
+    >>> crnl = CrnlTranslation()
+    >>> crnl.to_tty(b'a\\nb\\n')
+    b'a\\r\\nb\\r\\n'
+    >>> crnl.from_tty(b'a\\r\\nb\\r'), crnl.from_tty(b'\\nc')
+    (b'a\\nb', b'\\nc')
+    """
+
+    def __init__(self):
+        self._cr = False  # last read chunk ended with '\r'
+
+    @staticmethod
+    def to_tty(data):
+        """ Translate data written to the serial port """
+        return data.replace(b'\n', b'\r\n')
+
+    def from_tty(self, data):
+        """ Translate data read from the serial port """
+        if self._cr:
+            data = b'\r' + data
+        self._cr = data.endswith(b'\r')
+        if self._cr:
+            data = data[:-1]
+        return data.replace(b'\r\n', b'\n')
+
+
+class NoTranslation:
+    """ Data is written and read unchanged """
+
+    @staticmethod
+    def to_tty(data):
+        """ Data written to the serial port """
+        return data
+
+    @staticmethod
+    def from_tty(data):
+        """ Data read from the serial port """
+        return data
+
+
+class LineTimestamps:  # pylint:disable=too-few-public-methods
+    """ Prefix each line with the gateway unix time it started arriving
+
+    Time is the control node 'set_time' one, in seconds with microseconds.
+    Lines read together get the same timestamp, so a chunk is handled
+    with one `bytes.replace`.
+
+    >>> stamps = LineTimestamps()
+    >>> stamps.add(b'a\\nb', 1500000000.25)
+    b'1500000000.250000;a\\n1500000000.250000;b'
+    >>> stamps.add(b'c\\n', 1500000001.5), stamps.add(b'd', 1500000002)
+    (b'c\\n', b'1500000002.000000;d')
+    """
+
+    def __init__(self):
+        self._line_start = True
+
+    def add(self, data, timestamp=None):
+        """ Return `data` with a timestamp at each line start """
+        timestamp = time.time() if timestamp is None else timestamp
+        prefix = b'%.6f;' % timestamp
+        # A trailing newline starts a line not received yet
+        end = b'\n' if data.endswith(b'\n') else b''
+        if end:
+            data = data[:-1]
+        data = data.replace(b'\n', b'\n' + prefix) + end
+        if self._line_start:
+            data = prefix + data
+        self._line_start = bool(end)
+        return data
+
+
+class SerialBridge:  # pylint:disable=too-many-instance-attributes
+    """ Serial port `tty` redirection to TCP `port` clients """
+    NAME = 'serial bridge'
+
+    def __init__(self, tty, baudrate,  # pylint:disable=too-many-arguments
+                 bind_ip='0.0.0.0', port=PORT, serial_opts=(), *,
+                 ws_port=None):
+        self.tty = tty
+        self.baudrate = baudrate
+        self.address = (bind_ip, port)
+        # No WebSocket clients when None
+        self.ws_address = None if ws_port is None else (bind_ip, ws_port)
+        self.translation = (CrnlTranslation() if 'crnl' in serial_opts
+                            else NoTranslation())
+        self.clients = []
+        self.dropped = 0
+        # Object with an `add(data)` method also given serial port data
+        self.capture = None
+        # LineTimestamps prefixing lines sent to clients, None for raw data
+        self.timestamps = None
+        self._serial = None
+        self._tty_out = bytearray()
+        self._listener = None
+        self._ws_listener = None
+        self._selector = None
+        self._wakeup = None
+        self._thread = None
+        self._run = False
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        """ Listening port """
+        return self._listener.getsockname()[1]
+
+    @property
+    def ws_port(self):
+        """ WebSocket listening port """
+        return self._ws_listener.getsockname()[1]
+
+    def start(self):
+        """ Listen for clients and start redirection thread """
+        if self._thread is not None:
+            return 0
+        LOGGER.debug('%s start', self.NAME)
+        self._listener = self._listen(self.address)
+        if self.ws_address is not None and self._listener is not None:
+            self._ws_listener = self._listen(self.ws_address)
+            if self._ws_listener is None:
+                self._listener.close()
+                self._listener = None
+        if self._listener is None:
+            return 1
+        self._wakeup = socket.socketpair()
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ,
+                                functools.partial(self._accept, Client))
+        if self._ws_listener is not None:
+            self._selector.register(
+                self._ws_listener, selectors.EVENT_READ,
+                functools.partial(self._accept, WebSocketClient))
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ, None)
+        self._open_tty()
+
+        self._run = True
+        self._thread = threading.Thread(target=self._target, daemon=True,
+                                        name='serial_bridge')
+        self._thread.start()
+        return 0
+
+    def stop(self):
+        """ Stop redirection, close serial port and clients """
+        if self._thread is None:
+            return 0
+        LOGGER.debug('%s stop', self.NAME)
+        self._run = False
+        self._wakeup[1].send(b'\0')
+        self._thread.join()
+        self._thread = None
+
+        for client in list(self.clients):
+            self._remove(client)
+        self._close_tty()
+        self._selector.close()
+        self._listener.close()
+        if self._ws_listener is not None:
+            self._ws_listener.close()
+            self._ws_listener = None
+        for sock in self._wakeup:
+            sock.close()
+        LOGGER.debug('%s stopped', self.NAME)
+        return 0
+
+    def _listen(self, address):
+        """ Return a socket listening on `address`, None on error """
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind(address)
+        except OSError as err:
+            LOGGER.error('%s: %s', self.NAME, err)
+            listener.close()
+            return None
+        listener.listen(MAX_CLIENTS)
+        listener.setblocking(False)
+        return listener
+
+    def _target(self):
+        """ Redirection loop """
+        while self._run:
+            timeout = TTY_RETRY if self._serial is None else None
+            for key, events in self._selector.select(timeout):
+                if key.data is not None:
+                    key.data(key.fileobj, events)
+            if self._serial is None and self._run:
+                self._open_tty()
+
+    # Serial port
+
+    def _open_tty(self):
+        """ Open serial port, return True on success """
+        try:
+            self._serial = serial.Serial(self.tty, self.baudrate, timeout=0)
+        except (serial.SerialException, OSError) as err:
+            if os.path.exists(self.tty):
+                LOGGER.warning('%s: %s', self.NAME, err)
+            return False
+        self._tty_out.clear()
+        self._selector.register(self._serial.fileno(), selectors.EVENT_READ,
+                                self._tty_event)
+        return True
+
+    def _close_tty(self):
+        if self._serial is None:
+            return
+        self._selector.unregister(self._serial.fileno())
+        self._serial.close()
+        self._serial = None
+
+    def _tty_event(self, fd, events):
+        if self._serial is None or self._serial.fileno() != fd:
+            return None  # closed during this selector loop
+        if events & selectors.EVENT_WRITE:
+            try:
+                written = os.write(fd, self._tty_out)
+                del self._tty_out[:written]
+            except BlockingIOError:
+                pass
+            except OSError as err:
+                return self._tty_error(err)
+            if not self._tty_out:
+                self._selector.modify(fd, selectors.EVENT_READ,
+                                      self._tty_event)
+                self._update_writer()
+        if events & selectors.EVENT_READ:
+            try:
+                data = os.read(fd, READ_SIZE)
+            except BlockingIOError:
+                return None
+            except OSError as err:
+                return self._tty_error(err)
+            if not data:
+                return self._tty_error(OSError(errno.EIO, 'End of file'))
+            data = self.translation.from_tty(data)
+            if self.capture is not None:
+                self.capture.add(data)
+            if self.timestamps is not None:
+                data = self.timestamps.add(data)
+            self.publish(data)
+        return None
+
+    def _tty_error(self, err):
+        """ Serial port failed, it will be opened again """
+        LOGGER.warning('%s: %s: %s', self.NAME, self.tty, err)
+        self._close_tty()
+
+    def _write_tty(self, data):
+        """ Queue `data` to the serial port """
+        if self._serial is None:
+            return
+        if not self._tty_out:
+            self._selector.modify(self._serial.fileno(),
+                                  selectors.EVENT_READ | selectors.EVENT_WRITE,
+                                  self._tty_event)
+        self._tty_out += self.translation.to_tty(data)
+        self._update_writer()
+
+    # Clients
+
+    def publish(self, data):
+        """ Send serial port `data` to all clients """
+        for client in list(self.clients):
+            if not client.queue(data):
+                LOGGER.warning('%s: client %s too slow, disconnected',
+                               self.NAME, client.address)
+                self.dropped += 1
+                self._remove(client)
+            else:
+                self._update(client)
+
+    def _accept(self, client_class, listener, _events):
+        try:
+            sock, address = listener.accept()
+        except BlockingIOError:
+            return
+        if len(self.clients) >= MAX_CLIENTS:
+            LOGGER.warning('%s: too many clients, %s refused', self.NAME,
+                           address)
+            sock.close()
+            return
+        sock.setblocking(False)
+        client = client_class(sock, address)
+        client.writer = not any(cli.writer for cli in self.clients)
+        self.clients.append(client)
+        self._update(client)
+        LOGGER.debug('%s: %s %s client %s connected', self.NAME,
+                     'writer' if client.writer else 'mirror',
+                     client_class.__name__, address)
+
+    def _update(self, client):
+        """ Register `client` socket for the events it waits
+
+        The writer is not read while serial port output is full """
+        events = 0
+        if not client.writer or len(self._tty_out) < TTY_BUFFER:
+            events |= selectors.EVENT_READ
+        if client.out:
+            events |= selectors.EVENT_WRITE
+        if events == client.events:
+            return
+        callback = functools.partial(self._client_event, client)
+        if not client.events:
+            self._selector.register(client.sock, events, callback)
+        elif not events:
+            self._selector.unregister(client.sock)
+        else:
+            self._selector.modify(client.sock, events, callback)
+        client.events = events
+
+    def _update_writer(self):
+        """ Stop or restart reading writer when serial port output is full """
+        for client in self.clients:
+            if client.writer:
+                self._update(client)
+
+    def _client_event(self, client, _sock, events):
+        if client not in self.clients:
+            return None  # removed during this selector loop
+        if events & selectors.EVENT_WRITE:
+            if not client.send():
+                return self._remove(client)
+            if not client.out:
+                self._update(client)
+        if events & selectors.EVENT_READ:
+            data = client.recv()
+            if data == b'':
+                return self._remove(client)
+            # mirrors input is ignored
+            if data and client.writer:
+                self._write_tty(data)
+            # WebSocket clients may have answers to send
+            self._update(client)
+        return None
+
+    def _remove(self, client):
+        """ Disconnect `client`, the oldest mirror becomes the writer """
+        if client.events:
+            self._selector.unregister(client.sock)
+        client.close()
+        self.clients.remove(client)
+        LOGGER.debug('%s: client %s disconnected', self.NAME, client.address)
+        if client.writer and self.clients:
+            self.clients[0].writer = True
+            self._update(self.clients[0])
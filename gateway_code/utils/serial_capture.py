@@ -0,0 +1,179 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Timestamped capture of the open node serial port output
+
+Data read from the serial port is written to a capture file in the
+experiment 'log' folder, each read chunk as a record:
+
+    <gateway monotonic time> <UTC unix time> <length>\\n<data>\\n
+
+Records are queued in a bounded buffer and written by a thread, flushed at
+least every `FLUSH_PERIOD`. When the file system does not keep up, records
+are dropped and counted, so the capture never slows down the serial port
+redirection.
+
+Files are rotated every `ROTATE_SIZE` bytes, next files are named
+'<name>.1.log', '<name>.2.log'...
+"""
+
+import os
+import time
+import logging
+import threading
+
+from gateway_code import config
+
+LOGGER = logging.getLogger('gateway_code')
+
+# Capture file size before rotation
+ROTATE_SIZE = 64 * 2 ** 20
+# Queued bytes before records are dropped
+BUFFER_SIZE = 4 * 2 ** 20
+# Queued bytes waking up the writer before the flush period
+FLUSH_SIZE = 2 ** 16
+FLUSH_PERIOD = 1.0
+
+
+def capture_path(log_path):
+    """ Return capture file path for experiment `log_path`
+
+    >>> capture_path('/exp/log/m3-1.log')
+    '/exp/log/m3-1.serial.log'
+    """
+    base, ext = os.path.splitext(log_path)
+    return f'{base}.serial{ext}'
+
+
+def record(data, monotonic, utc):
+    """ Return `data` capture record
+
+    >>> record(b'hello\\n', 12.5, 1500000000.25)
+    b'12.500000 1500000000.250000 6\\nhello\\n\\n'
+    """
+    return b'%.6f %.6f %d\n%b\n' % (monotonic, utc, len(data), data)
+
+
+class SerialCapture:  # pylint:disable=too-many-instance-attributes
+    """ Write serial port data records to `path` from a thread """
+
+    def __init__(self, path, rotate_size=ROTATE_SIZE):
+        self.path = path
+        self.rotate_size = rotate_size
+        self.dropped = 0  # bytes
+        self.files = 0
+        self.size = 0
+        self._file = None
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._run = False
+
+    def start(self):
+        """ Open capture file and start writer thread """
+        if self._thread is not None:
+            return 0
+        try:
+            self._open()
+        except OSError as err:
+            LOGGER.error('serial capture: %s', err)
+            return 1
+        self._run = True
+        self._thread = threading.Thread(target=self._target, daemon=True,
+                                        name='serial_capture')
+        self._thread.start()
+        return 0
+
+    def stop(self):
+        """ Write queued records and close capture file """
+        if self._thread is None:
+            return 0
+        with self._cond:
+            self._run = False
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+        self._close()
+        if self.dropped:
+            LOGGER.warning('serial capture: %d bytes dropped', self.dropped)
+        return 0
+
+    def add(self, data):
+        """ Queue `data` record, timestamped now """
+        rec = record(data, time.monotonic(), time.time())
+        with self._cond:
+            if len(self._buffer) + len(rec) > BUFFER_SIZE:
+                self.dropped += len(data)
+                return
+            self._buffer += rec
+            if len(self._buffer) >= FLUSH_SIZE:
+                self._cond.notify()
+
+    def _target(self):
+        """ Write queued records until stopped """
+        run = True
+        while run:
+            with self._cond:
+                if self._run and len(self._buffer) < FLUSH_SIZE:
+                    self._cond.wait(FLUSH_PERIOD)
+                data, self._buffer = self._buffer, bytearray()
+                run = self._run
+            if data:
+                self._write(data)
+
+    def _write(self, data):
+        try:
+            if self.size and self.size + len(data) > self.rotate_size:
+                self._close()
+                self._open()
+            self._file.write(data)
+            self._file.flush()
+            self.size += len(data)
+        except (OSError, ValueError) as err:
+            # ValueError: file closed after a failed rotation
+            LOGGER.error('serial capture: %s', err)
+            self.dropped += len(data)
+
+    def _open(self):
+        """ Open next capture file, or the last one when restarted
+        Files are appended so a restarted capture does not overwrite them """
+        path = self._path(self.files)
+        self.files += 1
+        while os.path.exists(self._path(self.files)):
+            path = self._path(self.files)
+            self.files += 1
+        try:
+            self.size = os.path.getsize(path)
+        except OSError:
+            self.size = 0
+        self._file = open(config.create_user_file(path, 'ab'), 'ab')
+
+    def _path(self, index):
+        """ Capture file `index` path """
+        if not index:
+            return self.path
+        base, ext = os.path.splitext(self.path)
+        return f'{base}.{index}{ext}'
+
+    def _close(self):
+        self._file.close()
+        config.clean_user_file(self._file.name)
@@ -27,7 +27,11 @@ import shlex
 
 import logging
 
+from gateway_code import common
+from gateway_code import config
 from .external_process import ExternalProcess
+from .serial_bridge import SerialBridge, LineTimestamps, WS_PORT
+from .serial_capture import SerialCapture
 
 LOGGER = logging.getLogger('gateway_code')
 
@@ -39,6 +43,16 @@ class SerialRedirection(ExternalProcess):
 
     Socat is run in a loop instead of using 'tcp-listen,..,fork' because we
     want
+
+    With 'serial_redirection' config set to 'bridge', the in process
+    `SerialBridge` is used instead of socat. It accepts reconnections
+    immediately and read only mirror clients. With 'serial_websocket'
+    config set, it also accepts WebSocket clients on `WS_PORT`.
+
+    When `capture_path` is set, the bridge also writes timestamped serial
+    port output to it, see `SerialCapture`. When `timestamps` is set, each
+    line sent to clients is prefixed with the gateway time, see
+    `LineTimestamps`. socat does not support them.
     """
     SOCAT = (
         'socat -d'
@@ -57,8 +71,50 @@ class SerialRedirection(ExternalProcess):
                 serial_opts=','.join(serial_opts)
             )
         )
+        self.bridge = None
+        websocket = common.booleanize(
+            config.read_config('serial_websocket', False))
+        if config.read_config('serial_redirection', 'socat') == 'bridge':
+            ws_port = WS_PORT if websocket else None
+            self.bridge = SerialBridge(tty, baudrate, bind_ip,
+                                       serial_opts=serial_opts,
+                                       ws_port=ws_port)
+        elif websocket:
+            LOGGER.warning('%s: WebSocket requires the bridge', self.NAME)
+        self.capture_path = None
+        self.timestamps = False
         super().__init__()
 
+    def start(self):
+        """ Start redirection """
+        if self.bridge is None:
+            if self.capture_path is not None:
+                LOGGER.warning('%s: serial capture requires the bridge',
+                               self.NAME)
+            if self.timestamps:
+                LOGGER.warning('%s: lines timestamps require the bridge',
+                               self.NAME)
+            return super().start()
+        ret_val = 0
+        self.bridge.timestamps = LineTimestamps() if self.timestamps else None
+        if self.capture_path is not None and self.bridge.capture is None:
+            capture = SerialCapture(self.capture_path)
+            ret_val += capture.start()
+            if not ret_val:
+                self.bridge.capture = capture
+        ret_val += self.bridge.start()
+        return ret_val
+
+    def stop(self):
+        """ Stop redirection """
+        if self.bridge is None:
+            return super().stop()
+        ret_val = self.bridge.stop()
+        if self.bridge.capture is not None:
+            ret_val += self.bridge.capture.stop()
+            self.bridge.capture = None
+        return ret_val
+
     def check_error(self, retcode):
         """Check the return code on exit and print a warning on error."""
         if retcode and self._run:
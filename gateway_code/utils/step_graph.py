@@ -0,0 +1,180 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Run a graph of dependent steps, concurrently when they are independent
+
+Each step declares the steps it requires, they must have been added before.
+Steps whose requirements are all done are run on a thread pool.
+A step is 'failed' if it raised an exception, then the steps requiring it
+are skipped. A non-zero return value is only recorded, as the caller
+usually accumulates return codes.
+"""
+
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+LOGGER = logging.getLogger('gateway_code')
+
+
+def _is_ret(value):
+    """ Value is an integer return code """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class StepResult:  # pylint:disable=too-few-public-methods
+    """ Outcome of a step execution """
+
+    def __init__(self, name):
+        self.name = name
+        self.value = None
+        self.error = None
+        self.skipped = False
+        self.duration = 0.0
+
+    @property
+    def failed(self):
+        """ Step raised an exception or was not run """
+        return self.skipped or self.error is not None
+
+    def as_dict(self):
+        """ Return the outcome as a json serializable dict """
+        ret = self.value if _is_ret(self.value) else None
+        return {'ret': ret, 'duration': round(self.duration, 6),
+                'skipped': self.skipped,
+                'error': None if self.error is None else repr(self.error)}
+
+    def __repr__(self):
+        return f'StepResult({self.name!r}, {self.as_dict()!r})'
+
+
+class _Step:  # pylint:disable=too-few-public-methods
+    """ Step declaration """
+
+    def __init__(self, func, args, kwargs, requires):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.requires = tuple(requires)
+
+
+class StepGraph:
+    """ Graph of steps executed concurrently following their requirements
+
+    >>> graph = StepGraph('doctest')
+    >>> graph.add('a', lambda: 1)
+    >>> graph.add('b', lambda x: x + 1, 2)
+    >>> graph.add('c', lambda: 0, requires=('a', 'b'))
+    >>> graph.run()
+    0
+    >>> [graph.results[name].value for name in ('a', 'b', 'c')]
+    [1, 3, 0]
+    """
+
+    def __init__(self, name, max_workers=4):
+        self.name = name
+        self.max_workers = max_workers
+        self.results = {}
+        self._steps = {}
+
+    def add(self, name, func, *args, requires=(), **kwargs):
+        """ Add step `name` running `func(*args, **kwargs)`
+
+        :param requires: names of the steps that must be done before """
+        assert name not in self._steps, f'Step {name} already declared'
+        for req in requires:
+            assert req in self._steps, f'Step {name}: unknown {req} step'
+        self._steps[name] = _Step(func, args, kwargs, requires)
+
+    def run(self):
+        """ Run all the steps, wait until they are all done
+
+        :returns: number of failed steps """
+        self.results = {name: StepResult(name) for name in self._steps}
+        pending = list(self._steps)
+        running = {}
+
+        with ThreadPoolExecutor(self.max_workers,
+                                thread_name_prefix=self.name) as pool:
+            while pending or running:
+                for name in list(pending):
+                    state = self._requirements_state(name, running, pending)
+                    if state is None:
+                        continue
+                    pending.remove(name)
+                    if state:
+                        # keep caller context, like the current job
+                        future = pool.submit(contextvars.copy_context().run,
+                                             self._run_step, name)
+                        running[future] = name
+                    else:
+                        LOGGER.debug('%s: skip step %s', self.name, name)
+                        self.results[name].skipped = True
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+
+        return sum(1 for res in self.results.values() if res.failed)
+
+    def _requirements_state(self, name, running, pending):
+        """ Return True if `name` can run, False if it should be skipped,
+        None if it should wait. """
+        requires = self._steps[name].requires
+        if any(self.results[req].failed for req in requires
+               if req not in pending and req not in running.values()):
+            return False
+        if any(req in pending or req in running.values() for req in requires):
+            return None
+        return True
+
+    def _run_step(self, name):
+        """ Run step `name` and record its outcome """
+        step = self._steps[name]
+        result = self.results[name]
+        t_start = time.monotonic()
+        try:
+            result.value = step.func(*step.args, **step.kwargs)
+        except Exception as err:  # pylint:disable=broad-except
+            result.error = err
+        result.duration = time.monotonic() - t_start
+        LOGGER.debug('%s: step %s done in %.3f s: %r', self.name, name,
+                     result.duration, result.value
+                     if result.error is None else result.error)
+
+    def raise_error(self):
+        """ Raise the first step error, in declaration order """
+        for result in self.results.values():
+            if result.error is not None:
+                raise result.error
+
+    def ret_value(self):
+        """ Sum of the integer values returned by the steps """
+        return sum(res.value for res in self.results.values()
+                   if _is_ret(res.value))
+
+    def summary(self):
+        """ Steps outcomes as a dict of json serializable dicts """
+        return {name: res.as_dict() for name, res in self.results.items()}
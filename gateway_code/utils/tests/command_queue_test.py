@@ -0,0 +1,160 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test command_queue module """
+
+import time
+import errno
+import threading
+import unittest
+
+import mock
+
+from gateway_code.utils import command_queue
+
+
+class _Manager:
+    """ Manager with queued commands """
+
+    def __init__(self, maxsize=4, estimate=None):
+        self.rlock = threading.RLock()
+        self.queue = command_queue.CommandQueue(self.rlock, maxsize, estimate)
+        self.calls = []
+        self.release = threading.Event()
+
+    @command_queue.queued('queue')
+    def blocking(self, name):
+        """ Wait for release event """
+        self.calls.append(name)
+        self.release.wait(5)
+        return 0
+
+    @command_queue.queued('queue')
+    def command(self, name):
+        """ Record call """
+        self.calls.append(name)
+        return 0
+
+    @command_queue.queued('queue')
+    def nested(self):
+        """ Queued command calling a queued command """
+        return self.command('nested')
+
+
+class TestCommandQueue(unittest.TestCase):
+    """ Test CommandQueue """
+    # pylint:disable=unexpected-keyword-arg
+
+    def setUp(self):
+        patcher = mock.patch.object(command_queue, 'POLL_INTERVAL', 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = _Manager(estimate={'blocking': 10.0}.get)
+        self.threads = []
+
+    def tearDown(self):
+        self.manager.release.set()
+        for thr in self.threads:
+            thr.join()
+
+    def _start(self, func, *args, **kwargs):
+        """ Run func in a thread and wait it is queued """
+        queued = len(self.manager.queue.status())
+        thr = threading.Thread(target=func, args=args, kwargs=kwargs)
+        thr.start()
+        self.threads.append(thr)
+        for _ in range(500):
+            if len(self.manager.queue.status()) > queued:
+                break
+            time.sleep(0.01)
+        return thr
+
+    def test_fifo_order(self):
+        """ Commands are run in arrival order after the running one """
+        self._start(self.manager.blocking, 'first')
+        for name in ('a', 'b', 'c'):
+            self._start(self.manager.command, name)
+
+        status = self.manager.queue.status()
+        self.assertEqual(['blocking', 'command', 'command', 'command'],
+                         [cmd['command'] for cmd in status])
+        self.assertTrue(status[0]['running'])
+        self.assertFalse(status[1]['running'])
+        # 'command' duration unknown, uses default
+        self.assertAlmostEqual(10.0 + command_queue.DEFAULT_DURATION,
+                               status[2]['eta'], delta=0.5)
+
+        self.manager.release.set()
+        for thr in self.threads:
+            thr.join()
+        self.assertEqual(['first', 'a', 'b', 'c'], self.manager.calls)
+        self.assertEqual([], self.manager.queue.status())
+
+    def test_queue_full(self):
+        """ Queue full raises EWOULDBLOCK with position and ETA """
+        self._start(self.manager.blocking, 'first')
+        for name in ('a', 'b', 'c'):
+            self._start(self.manager.command, name)
+
+        with self.assertRaises(command_queue.CommandQueueError) as err:
+            self.manager.command('d', queue_timeout=0)
+        self.assertEqual(errno.EWOULDBLOCK, err.exception.errno)
+        self.assertEqual(4, err.exception.position)
+        self.assertEqual('command', err.exception.as_dict()['command'])
+
+    def test_deadline(self):
+        """ Command waiting too long raises ETIMEDOUT and leaves queue """
+        self._start(self.manager.blocking, 'first')
+
+        with self.assertRaises(command_queue.CommandQueueError) as err:
+            self.manager.command('late', queue_timeout=0.1)
+        self.assertEqual(errno.ETIMEDOUT, err.exception.errno)
+        self.assertEqual(1, err.exception.position)
+        self.assertAlmostEqual(10.0, err.exception.eta, delta=0.5)
+        self.assertEqual(1, len(self.manager.queue.status()))
+
+        self.manager.release.set()
+        self.assertEqual(0, self.manager.command('now'))
+        self.assertEqual(['first', 'now'], self.manager.calls)
+
+    def test_lock_held_outside_queue(self):
+        """ Head command waits for lock taken by a non queued command """
+        with self.manager.rlock:
+            thr = self._start(self.manager.command, 'a')
+            time.sleep(0.05)
+            self.assertEqual([], self.manager.calls)
+        thr.join()
+        self.assertEqual(['a'], self.manager.calls)
+
+    def test_nested(self):
+        """ Queued command called by the running one is run directly """
+        self.assertEqual(0, self.manager.nested())
+        self.assertEqual(['nested'], self.manager.calls)
+
+    def test_exception(self):
+        """ Command raising frees the queue and lock """
+        with mock.patch.object(self.manager, 'calls') as calls:
+            calls.append.side_effect = ValueError()
+            self.assertRaises(ValueError, self.manager.command, 'a')
+        self.assertEqual([], self.manager.queue.status())
+        self.assertTrue(self.manager.rlock.acquire(blocking=False))
+        self.manager.rlock.release()
@@ -0,0 +1,121 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" test device_events module """
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ..device_events import DeviceEvents
+
+# pylint: disable=missing-docstring
+# pylint: disable=protected-access
+
+
+class TestDeviceEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'ttyTEST')
+        self.events = DeviceEvents()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _later(self, delay, func, *args):
+        thr = threading.Timer(delay, func, args)
+        thr.start()
+        self.addCleanup(thr.join)
+
+    def _create(self):
+        open(self.path, 'w').close()
+
+    def test_wait_no_timeout(self):
+        self.assertTrue(self.events.wait(self.path, False, 0))
+        self.assertFalse(self.events.wait(self.path, True, 0))
+        self._create()
+        self.assertTrue(self.events.wait(self.path, True, 0))
+        self.assertFalse(self.events.wait(self.path, False, 0))
+
+    def test_wait_appear_disappear(self):
+        """ Waiters are woken up by events, not by polling """
+        self.events.POLL_INTERVAL = 5
+        self._later(0.2, self._create)
+        t_ref = time.monotonic()
+        self.assertTrue(self.events.wait(self.path, True, 10))
+        self.assertGreater(1, time.monotonic() - t_ref)
+        self.assertIsNotNone(self.events._fd)
+
+        self._later(0.2, os.remove, self.path)
+        t_ref = time.monotonic()
+        self.assertTrue(self.events.wait(self.path, False, 10))
+        self.assertGreater(1, time.monotonic() - t_ref)
+
+    def test_wait_timeout(self):
+        t_ref = time.monotonic()
+        self.assertFalse(self.events.wait(self.path, True, 0.3))
+        self.assertLessEqual(0.3, time.monotonic() - t_ref)
+
+    def test_wait_missing_directory(self):
+        """ Path in a directory created later """
+        self.events.POLL_INTERVAL = 5
+        sub_dir = os.path.join(self.tmp_dir, 'iotlab')
+        self.path = os.path.join(sub_dir, 'ttyTEST')
+        self._later(0.1, os.mkdir, sub_dir)
+        self._later(0.3, self._create)
+        t_ref = time.monotonic()
+        self.assertTrue(self.events.wait(self.path, True, 10))
+        self.assertGreater(1, time.monotonic() - t_ref)
+
+    def test_wait_stable(self):
+        """ Presence should stay the same during 'stable_time' """
+        self._create()
+        self._later(0.2, os.remove, self.path)
+        self._later(0.4, self._create)
+
+        t_ref = time.monotonic()
+        self.assertTrue(self.events.wait_stable(self.path, True, 0.5, 10))
+        self.assertLessEqual(0.9, time.monotonic() - t_ref)
+
+        self.assertFalse(self.events.wait_stable(self.path, False, 0.1, 0.3))
+
+    def test_wait_stable_quiet(self):
+        """ Events in the directory restart the stable time """
+        self._create()
+        other = os.path.join(self.tmp_dir, 'ttyOTHER')
+        self._later(0.2, os.mkdir, other)
+
+        t_ref = time.monotonic()
+        self.assertTrue(self.events.wait_stable(self.path, True, 0.3, 10,
+                                                quiet=True))
+        self.assertLessEqual(0.5, time.monotonic() - t_ref)
+
+    def test_fallback_polling(self):
+        self.events._libc = None
+        self._later(0.2, self._create)
+        self.assertTrue(self.events.wait(self.path, True, 10))
+        self.assertIsNone(self.events._fd)
+        self.assertEqual(self.events.FALLBACK_INTERVAL, self.events.interval)
@@ -23,6 +23,7 @@
 
 import os
 import logging
+import tempfile
 import unittest
 import runpy
 
@@ -67,6 +68,46 @@ class TestElfTarget(unittest.TestCase):
             elftarget.elf_target(firmware('wsn430_print_uids.hex'))
         assert 'Not a valid elf file' in str(exc_info.value)
 
+    def test_header_target(self):
+        """Test header_target gives the same result as elf_target."""
+        for name in ('m3_idle.elf', 'leonardo_idle.elf', 'node.z1'):
+            with open(firmware(name), 'rb') as _file:
+                header = _file.read(elftarget.HEADER_SIZE)
+            self.assertEqual(elftarget.elf_target(firmware(name)),
+                             elftarget.header_target(header))
+
+        with open(firmware('idle.c.o'), 'rb') as _file:
+            header = _file.read()
+        with pytest.raises(ValueError) as exc_info:
+            elftarget.header_target(header)
+        assert 'Not an executable elf file: ET_REL' in str(exc_info.value)
+
+        with open(firmware('wsn430_print_uids.hex'), 'rb') as _file:
+            hex_header = _file.read(elftarget.HEADER_SIZE)
+        for header in (b'', b'\x7fELF', b'\x7fELF\x01\x03' + bytes(14),
+                       hex_header):
+            with pytest.raises(ValueError) as exc_info:
+                elftarget.header_target(header)
+            assert 'Not a valid elf file' in str(exc_info.value)
+
+    def test_register_target(self):
+        """Test registered target is used until file changes."""
+        with tempfile.NamedTemporaryFile() as elf:
+            elf.write(b'not an elf')
+            elf.flush()
+            elftarget.register_target(elf.name, ('ELFCLASS32', 'EM_ARM'))
+            self.assertEqual(('ELFCLASS32', 'EM_ARM'),
+                             elftarget.elf_target(elf.name))
+
+            elf.write(b' anymore')
+            elf.flush()
+            self.assertRaises(ValueError, elftarget.elf_target, elf.name)
+
+            elftarget.register_target(elf.name, ('ELFCLASS32', 'EM_AVR'))
+            elftarget.forget_target(elf.name)
+            self.assertRaises(ValueError, elftarget.elf_target, elf.name)
+        elftarget.forget_target(elf.name)
+
 
 class TestElfTargetIsCompatibleWithNode(unittest.TestCase):
     """Test elftarget.is_compatible_with_node."""
@@ -0,0 +1,143 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test firmware_state module """
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from gateway_code.utils import firmware_state
+
+
+class _Node:  # pylint:disable=too-few-public-methods
+    """ Node with a tracked flash """
+    TYPE = 'node'
+
+    def __init__(self, fw_idle):
+        self.FW_IDLE = fw_idle  # pylint:disable=invalid-name
+        self.flashed = []
+        self.ret = 0
+
+    @firmware_state.tracked('FW_IDLE')
+    def flash(self, firmware_path=None, binary=False, offset=0):
+        """ Record flashed firmwares """
+        self.flashed.append((firmware_path or self.FW_IDLE, binary, offset))
+        return self.ret
+
+
+class TestFirmwareState(unittest.TestCase):
+    """ Test flashed firmware tracking """
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.run_dir)
+        patcher = mock.patch('gateway_code.config.RUN_DIR', self.run_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.idle = os.path.join(self.run_dir, 'idle.elf')
+        with open(self.idle, 'wb') as _file:
+            _file.write(b'idle firmware')
+        self.node = _Node(self.idle)
+
+    def test_skip_same_idle(self):
+        """ Flashing idle firmware twice only flashes once """
+        self.assertEqual(0, self.node.flash())
+        self.assertEqual(0, self.node.flash(None))
+        self.assertEqual([(self.idle, False, 0)], self.node.flashed)
+        self.assertEqual(firmware_state.file_digest(self.idle),
+                         firmware_state.FIRMWARE_STATE.get(self.node))
+
+        # idle firmware changed on disk
+        with open(self.idle, 'wb') as _file:
+            _file.write(b'new idle firmware')
+        self.node.flash()
+        self.assertEqual(2, len(self.node.flashed))
+
+    def test_user_firmware_invalidates(self):
+        """ Other firmwares are always flashed and invalidate record """
+        self.node.flash()
+        self.node.flash('user.elf')
+        self.node.flash('user.elf')
+        self.assertIsNone(firmware_state.FIRMWARE_STATE.get(self.node))
+        self.node.flash()
+        self.assertEqual(['user.elf', 'user.elf', self.idle],
+                         [fw for fw, _, _ in self.node.flashed[1:]])
+
+    def test_flash_error(self):
+        """ Failed flash is not recorded """
+        self.node.ret = 1
+        self.assertEqual(1, self.node.flash())
+        self.assertIsNone(firmware_state.FIRMWARE_STATE.get(self.node))
+        self.assertEqual(1, self.node.flash())
+        self.assertEqual(2, len(self.node.flashed))
+
+    def test_in_debug(self):
+        """ Flash during debug is never skipped nor recorded """
+        self.node.flash()
+        # pylint:disable=protected-access,attribute-defined-outside-init
+        self.node._in_debug = True
+        self.node.flash()
+        self.assertIsNone(firmware_state.FIRMWARE_STATE.get(self.node))
+        self.assertEqual(2, len(self.node.flashed))
+
+    def test_node_key(self):
+        """ Record is per node serial number """
+        other = _Node(self.idle)
+        # pylint:disable=invalid-name,attribute-defined-outside-init
+        other.OPENOCD_SERIAL_NUMBER = '1234'
+        self.node.flash()
+        other.flash()
+        self.assertEqual(1, len(other.flashed))
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.run_dir, 'node_1234.firmware')))
+
+    def test_clear(self):
+        """ Clear removes all records, on daemon start """
+        other = _Node(self.idle)
+        # pylint:disable=invalid-name,attribute-defined-outside-init
+        other.OPENOCD_SERIAL_NUMBER = '1234'
+        self.node.flash()
+        other.flash()
+        firmware_state.FIRMWARE_STATE.clear()
+        self.assertIsNone(firmware_state.FIRMWARE_STATE.get(self.node))
+        self.assertIsNone(firmware_state.FIRMWARE_STATE.get(other))
+        self.assertTrue(os.path.isfile(self.idle))
+        self.node.flash()
+        self.assertEqual(2, len(self.node.flashed))
+
+    def test_disabled(self):
+        """ No tracking without RUN_DIR """
+        with mock.patch('gateway_code.config.RUN_DIR', None):
+            self.node.flash()
+            self.node.flash()
+            firmware_state.FIRMWARE_STATE.set(self.node, 'digest')
+            firmware_state.FIRMWARE_STATE.invalidate(self.node)
+            firmware_state.FIRMWARE_STATE.clear()
+            self.assertIsNone(firmware_state.FIRMWARE_STATE.get(self.node))
+        self.assertEqual(2, len(self.node.flashed))
+        self.assertEqual([], [f for f in os.listdir(self.run_dir)
+                              if f.endswith('.firmware')])
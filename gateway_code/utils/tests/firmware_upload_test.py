@@ -0,0 +1,73 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test firmware_upload module """
+
+import io
+import os
+import hashlib
+import unittest
+
+import mock
+
+from gateway_code.utils import elftarget
+from gateway_code.utils import firmware_upload
+
+M3_IDLE = os.path.join(os.path.dirname(__file__), 'elftarget_firmwares',
+                       'm3_idle.elf')
+
+
+class TestFirmwareUpload(unittest.TestCase):
+    """ Test FirmwareUpload """
+
+    @mock.patch('gateway_code.utils.firmware_upload.CHUNK_SIZE', 7)
+    def test_elf_upload(self):
+        """ Upload elf file by small chunks """
+        with open(M3_IDLE, 'rb') as _file:
+            content = _file.read()
+        upload = firmware_upload.FirmwareUpload(io.BytesIO(content),
+                                                'idle.elf')
+        self.assertTrue(upload.name.endswith('--idle.elf'))
+        self.assertEqual(len(content), upload.size)
+        self.assertEqual(hashlib.sha256(content).hexdigest(), upload.sha256)
+        self.assertEqual(('ELFCLASS32', 'EM_ARM'), upload.elf_target)
+        with open(upload.name, 'rb') as _file:
+            self.assertEqual(content, _file.read())
+
+        # Target is not read again from file
+        with mock.patch('gateway_code.utils.elftarget.ELFFile') as elffile:
+            self.assertEqual(upload.elf_target,
+                             elftarget.elf_target(upload.name))
+            self.assertFalse(elffile.called)
+
+        upload.close()
+        self.assertFalse(os.path.exists(upload.name))
+        self.assertNotIn(os.path.abspath(upload.name),
+                         elftarget._KNOWN_TARGETS)  # pylint:disable=W0212
+
+    def test_binary_upload(self):
+        """ Upload a non elf file """
+        upload = firmware_upload.FirmwareUpload(io.BytesIO(b'\x00' * 100),
+                                                'fw.bin')
+        self.assertIsNone(upload.elf_target)
+        self.assertEqual(100, upload.size)
+        upload.close()
@@ -27,6 +27,7 @@ import unittest
 import mock
 
 from ..ftdi_check import ftdi_check
+from .. import usb_inventory
 
 
 @mock.patch('subprocess.check_output')
@@ -80,3 +81,16 @@ class TestFtdiCheck(unittest.TestCase):
         self.assertEqual(0, ftdi_check('control', '4232'))
         self.assertEqual(0, ftdi_check('control', '4232', description='M3'))
         m_check_output.assert_called_with(['ftdi-devices-list', '-t', '4232'])
+
+    def test_ftdi_inventory(self, m_check_output):
+        """ Test the 'ftdi_check' method uses the inventory snapshot """
+        snapshot = usb_inventory.Snapshot([{
+            'kind': 'ftdi', 'vendor': '0403', 'product': '6011',
+            'description': 'ControlNode'}])
+        with mock.patch.object(usb_inventory.INVENTORY, 'snapshot',
+                               return_value=snapshot):
+            self.assertEqual(0, ftdi_check('control', '4232'))
+            self.assertEqual(0, ftdi_check('control', '4232', 'ControlNode'))
+            self.assertEqual(1, ftdi_check('control', '4232', 'M3'))
+            self.assertEqual(1, ftdi_check('open', '2232'))
+        self.assertFalse(m_check_output.called)
@@ -0,0 +1,107 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test jobs module """
+
+import errno
+import threading
+import unittest
+
+from gateway_code.utils import jobs
+from gateway_code.utils.step_graph import StepGraph
+
+
+class TestJobs(unittest.TestCase):
+    """ Test Job and JobTable """
+
+    def test_job_result(self):
+        """ Job runs in background and keeps result and stages """
+        release = threading.Event()
+
+        def _func(value):
+            jobs.set_stage('first')
+            release.wait(5)
+            graph = StepGraph('graph')
+            graph.add('step', jobs.set_stage, 'second')
+            graph.run()
+            return {'ret': value}
+
+        table = jobs.JobTable()
+        job = table.submit('operation', _func, 42)
+        self.assertIs(job, table.get(job.id))
+        self.assertFalse(job.wait(0.1))
+        self.assertEqual('running', job.as_dict()['status'])
+        self.assertEqual('first', job.stage)
+
+        release.set()
+        self.assertTrue(job.wait(5))
+        state = job.as_dict()
+        self.assertEqual('done', state['status'])
+        self.assertEqual('second', state['stage'])
+        self.assertEqual({'ret': 42}, state['result'])
+        self.assertIsNone(state['error'])
+        self.assertGreaterEqual(state['ended'], state['started'])
+        self.assertIsNone(jobs.CURRENT_JOB.get())
+
+    def test_job_error(self):
+        """ Job exception is saved as error """
+        class _Error(Exception):
+            def as_dict(self):
+                """ Error details """
+                return {'error': 'details'}
+
+        def _raise(err):
+            raise err
+
+        table = jobs.JobTable()
+        job = table.submit('op', _raise, ValueError('value'))
+        job.wait(5)
+        self.assertEqual('error', job.status)
+        self.assertEqual('value', job.error)
+
+        job = table.submit('op', _raise, _Error())
+        job.wait(5)
+        self.assertEqual({'error': 'details'}, job.error)
+
+    def test_eviction(self):
+        """ Oldest finished jobs are evicted, running ones are kept """
+        release = threading.Event()
+        table = jobs.JobTable(maxsize=3)
+
+        running = table.submit('op', release.wait, 5)
+        done = []
+        for i in range(4):
+            done.append(table.submit('op', int, i))
+            done[-1].wait(5)
+
+        self.assertIsNotNone(table.get(running.id))
+        self.assertEqual([None, None, done[2], done[3]],
+                         [table.get(job.id) for job in done])
+
+        more = [table.submit('op', release.wait, 5) for _ in range(2)]
+        with self.assertRaises(EnvironmentError) as err:
+            table.submit('op', release.wait, 5)
+        self.assertEqual(errno.EWOULDBLOCK, err.exception.errno)
+
+        release.set()
+        for job in [running] + more:
+            job.wait(5)
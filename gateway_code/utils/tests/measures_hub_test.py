@@ -0,0 +1,109 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test measures_hub module """
+
+import errno
+import unittest
+
+from gateway_code.utils import measures_hub
+
+RADIO = 'measures_debug: radio_measure 1378466517.186216 11 -91'
+CONSUMPTION = ('measures_debug: consumption_measure 1377268768.841070:'
+               '1.78250 0.000000 3.230000 0.080003')
+
+
+class TestMeasuresHub(unittest.TestCase):
+    """ Test MeasuresHub and Subscription """
+
+    def test_publish(self):
+        """ Measures are dispatched to subscribers of their stream """
+        hub = measures_hub.MeasuresHub()
+        hub.publish(RADIO)  # no subscribers
+
+        radio = hub.subscribe(['radio'])
+        every = hub.subscribe()
+        self.assertEqual(2, hub.subscribers)
+        hub.publish(RADIO)
+        hub.publish(CONSUMPTION)
+        hub.publish('measures_debug:')
+        hub.publish('measures_debug: radio_measure 1.0 a')
+
+        events = every.events(keepalive=0.01)
+        self.assertEqual('radio', next(events)[0])
+        self.assertEqual(('consumption',
+                          '1377268768.841070 0.000000 3.230000 0.080003'),
+                         next(events))
+        self.assertEqual((None, None), next(events))
+
+        events = radio.events(keepalive=0.01)
+        self.assertEqual(('radio', '1378466517.186216 11 -91'), next(events))
+        self.assertEqual((None, None), next(events))
+
+        radio.close()
+        every.close()
+        self.assertEqual(0, hub.subscribers)
+
+    def test_slow_subscriber(self):
+        """ Subscribers with a full queue are dropped """
+        hub = measures_hub.MeasuresHub()
+        slow = hub.subscribe(maxsize=2)
+        radio = hub.subscribe(['radio'], maxsize=2)
+        for _ in range(3):
+            hub.publish(CONSUMPTION)
+
+        self.assertTrue(slow.dropped)
+        self.assertFalse(radio.dropped)
+        self.assertEqual(1, hub.subscribers)
+        self.assertEqual([], list(slow.events(keepalive=0.01)))
+        slow.close()  # already removed
+
+    def test_max_subscribers(self):
+        """ Subscribers number is limited """
+        hub = measures_hub.MeasuresHub(max_subscribers=1)
+        subscription = hub.subscribe()
+        with self.assertRaises(EnvironmentError) as cm:
+            hub.subscribe()
+        self.assertEqual(errno.EWOULDBLOCK, cm.exception.errno)
+        self.assertRaises(EnvironmentError, hub.check_available)
+
+        subscription.close()
+        hub.check_available()
+        hub.subscribe().close()
+
+
+class TestParseLine(unittest.TestCase):
+    """ Test measures lines parsing """
+
+    def test_parse_line(self):
+        """ Control node measures debug lines """
+        self.assertEqual(
+            (b'consumption', [1377268768.84107, 0.0, 3.23, 0.080003]),
+            measures_hub.parse_line(CONSUMPTION.encode()))
+        self.assertEqual(
+            ('radio', [1378466517.186216, 11.0, -91.0]),
+            measures_hub.parse_line(RADIO))
+        self.assertIsNone(measures_hub.parse_line(b'measures_debug:'))
+        self.assertIsNone(measures_hub.parse_line(
+            b'measures_debug: consumption_measure'))
+        self.assertIsNone(measures_hub.parse_line(
+            b'measures_debug: consumption_measure 1.0:2.0 3,0'))
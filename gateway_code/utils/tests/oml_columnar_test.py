@@ -0,0 +1,144 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test oml_columnar module """
+
+import os
+import ast
+import stat
+import array
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+import mock
+
+from gateway_code.utils import oml_columnar
+
+OML = '''protocol: 5
+domain: 123
+start-time: 1378387028
+sender-id: m3-1
+app-name: control_node_measures
+schema: 0 _experiment_metadata subject:string key:string value:string
+schema: 1 consumption timestamp_s:uint32 timestamp_us:uint32 power:double
+schema: 2 event timestamp_s:uint32 timestamp_us:uint32 value:uint32 \
+name:string
+content: text
+
+1.5\t1\t1\t1378387029\t500000\t0.25
+1.6\t1\t2\t1378387029\t600000\t0.26
+1.7\t2\t1\t1378387029\t700000\t1\tpower_start
+invalid line
+1.8\t1\t3\t1378387029\t800000\tnan_value
+1.9\t2\t2\t1378387029\t900000\t0\tstop
+'''
+
+
+def read_npz(path):
+    """ Read '.npz' arrays as lists, without numpy """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            data = archive.read(name)
+            header_len = int.from_bytes(data[8:10], 'little')
+            header = ast.literal_eval(data[10:10 + header_len].decode())
+            values = data[10 + header_len:]
+            descr = header['descr']
+            if descr[1] == 'U':
+                size = 4 * int(descr[2:])
+                values = [values[i:i + size].decode('utf-32-le').rstrip('\0')
+                          for i in range(0, len(values), size)]
+            else:
+                values = array.array({'f8': 'd', 'u4': 'I'}[descr[1:]],
+                                     values).tolist()
+            assert len(values) == header['shape'][0]
+            arrays[name[:-len('.npy')]] = values
+    return arrays
+
+
+class TestOmlColumnar(unittest.TestCase):
+    """ Test OML files conversion """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'm3-1.oml')
+        with open(self.path, 'w') as oml_file:
+            oml_file.write(OML)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_convert(self):
+        """ OML file is converted, invalid rows skipped """
+        self.assertEqual(2, oml_columnar.convert(self.path))
+        npz = os.path.join(self.directory, 'm3-1.npz')
+        arrays = read_npz(npz)
+        # user file, as the OML files
+        self.assertEqual(0o666, stat.S_IMODE(os.stat(npz).st_mode))
+
+        # empty schemas are not written
+        self.assertEqual(
+            {'consumption/' + name for name in (
+                'oml_ts', 'oml_seqno', 'timestamp_s', 'timestamp_us',
+                'power', 'index_time')} |
+            {'event/' + name for name in (
+                'oml_ts', 'oml_seqno', 'timestamp_s', 'timestamp_us',
+                'value', 'name', 'index_time')},
+            set(arrays))
+        self.assertEqual([0.25, 0.26], arrays['consumption/power'])
+        self.assertEqual([1, 2], arrays['consumption/oml_seqno'])
+        self.assertEqual(['power_start', 'stop'], arrays['event/name'])
+        self.assertEqual([1378387029.5], arrays['consumption/index_time'])
+
+    @mock.patch('gateway_code.utils.oml_columnar.CHUNK', 2)
+    @mock.patch('gateway_code.utils.oml_columnar.INDEX_STEP', 2)
+    def test_convert_chunks(self):
+        """ Columns are written by chunks, index every INDEX_STEP rows """
+        with open(self.path, 'a') as oml_file:
+            for seqno in range(3, 8):
+                oml_file.write(f'2.{seqno}\t1\t{seqno}\t1378387030\t0\t0.1\n')
+        output = os.path.join(self.directory, 'columns.npz')
+        oml_columnar.convert(self.path, output)
+        arrays = read_npz(output)
+        self.assertEqual(list(range(1, 3)) + list(range(3, 8)),
+                         arrays['consumption/oml_seqno'])
+        self.assertEqual([1378387029.5, 1378387030.0, 1378387030.0,
+                          1378387030.0], arrays['consumption/index_time'])
+
+    def test_converter(self):
+        """ Files are converted in background, empty ones ignored """
+        empty = os.path.join(self.directory, 'empty.oml')
+        open(empty, 'w').close()
+        converter = oml_columnar.Converter()
+        converter.submit([])
+        with mock.patch('gateway_code.utils.oml_columnar.LOGGER') as logger:
+            converter.submit([self.path, empty, empty + '_missing',
+                              self.directory])
+            converter.wait()
+        self.assertTrue(os.path.exists(os.path.join(self.directory,
+                                                    'm3-1.npz')))
+        self.assertFalse(os.path.exists(os.path.join(self.directory,
+                                                     'empty.npz')))
+        self.assertEqual(1, logger.warning.call_count)
+        self.assertEqual(0, logger.error.call_count)
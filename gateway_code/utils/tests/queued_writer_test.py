@@ -0,0 +1,74 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test queued_writer module """
+
+import threading
+import unittest
+
+import mock
+
+from gateway_code.utils.queued_writer import QueuedWriter
+
+
+class TestQueuedWriter(unittest.TestCase):
+    """ Test QueuedWriter """
+
+    def test_write_close(self):
+        """ Queued data is written before closing output """
+        output = mock.Mock()
+        writer = QueuedWriter(output)
+        for num in range(100):
+            writer.write(num)
+        writer.close()
+        self.assertEqual([mock.call(num) for num in range(100)],
+                         output.write.call_args_list)
+        output.close.assert_called_with()
+        self.assertEqual(0, writer.dropped)
+
+    def test_full_queue(self):
+        """ Data is dropped when the output does not keep up """
+        blocked = threading.Event()
+        output = mock.Mock()
+        output.write.side_effect = lambda data: blocked.wait()
+        writer = QueuedWriter(output, maxsize=2)
+        for num in range(10):
+            writer.write(num)
+        # one being written, two queued
+        self.assertGreaterEqual(writer.dropped, 7)
+        blocked.set()
+        writer.close()
+        self.assertEqual(10 - writer.dropped, output.write.call_count)
+
+    def test_write_error(self):
+        """ Write errors are logged, next writes continue """
+        output = mock.Mock()
+        output.write.side_effect = [OSError('No space left'), None]
+        writer = QueuedWriter(output, name='test')
+        with mock.patch('gateway_code.utils.queued_writer.LOGGER') as logger:
+            writer.write('a')
+            writer.write('b')
+            writer.flush()
+        logger.error.assert_called_once()
+        self.assertEqual(2, output.write.call_count)
+        output.flush.assert_called_with()
+        writer.close()
@@ -0,0 +1,295 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test serial_bridge module """
+
+import os
+import tty
+import time
+import socket
+import unittest
+
+import mock
+
+from gateway_code.tests import utils
+from gateway_code.utils import serial_bridge
+from gateway_code.utils import websocket
+from gateway_code.utils.serial_redirection import SerialRedirection
+
+
+def _wait(condition, timeout=5.0):
+    """ Wait until `condition()` is True """
+    t_end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > t_end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestSerialBridge(unittest.TestCase):
+    """ Test SerialBridge with a pseudo terminal """
+
+    def setUp(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        self.tty = os.ttyname(self.slave)
+        self.bridge = serial_bridge.SerialBridge(self.tty, 500000,
+                                                 '127.0.0.1', port=0,
+                                                 ws_port=0)
+        self.assertEqual(0, self.bridge.start())
+        self.sockets = []
+
+    def tearDown(self):
+        self.bridge.stop()
+        for sock in self.sockets:
+            sock.close()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def _connect(self, clients):
+        sock = socket.create_connection(('127.0.0.1', self.bridge.port), 5)
+        self.sockets.append(sock)
+        self.assertTrue(_wait(lambda: len(self.bridge.clients) == clients))
+        return sock
+
+    def _read_tty(self, size):
+        data = b''
+        while len(data) < size:
+            data += os.read(self.master, size - len(data))
+        return data
+
+    @staticmethod
+    def _recv(sock, size):
+        data = b''
+        while len(data) < size:
+            data += sock.recv(size - len(data))
+        return data
+
+    def test_writer_and_mirrors(self):
+        """ First client writes, others only read """
+        writer = self._connect(1)
+        mirror = self._connect(2)
+        mirror.sendall(b'ignored\n')
+        writer.sendall(b'hello\n')
+        self.assertEqual(b'hello\n', self._read_tty(6))
+
+        os.write(self.master, b'node output\n')
+        self.assertEqual(b'node output\n', self._recv(writer, 12))
+        self.assertEqual(b'node output\n', self._recv(mirror, 12))
+
+        # Mirror becomes writer, new client can reconnect immediately
+        writer.close()
+        self.assertTrue(_wait(lambda: len(self.bridge.clients) == 1))
+        mirror.sendall(b'now writer\n')
+        self.assertEqual(b'now writer\n', self._read_tty(11))
+        self._connect(2)
+        self.assertEqual([True, False],
+                         [cli.writer for cli in self.bridge.clients])
+
+    def test_capture(self):
+        """ Serial port output is also given to capture """
+        self.bridge.capture = mock.Mock()
+        client = self._connect(1)
+        os.write(self.master, b'captured\n')
+        self.assertEqual(b'captured\n', self._recv(client, 9))
+        self.bridge.capture.add.assert_called_with(b'captured\n')
+
+    @mock.patch('time.time', return_value=1500000000.25)
+    def test_timestamps(self, _time):
+        """ Lines sent to clients are prefixed with gateway time """
+        self.bridge.timestamps = serial_bridge.LineTimestamps()
+        client = self._connect(1)
+        os.write(self.master, b'a\nb\n')
+        self.assertEqual(b'1500000000.250000;a\n1500000000.250000;b\n',
+                         self._recv(client, 40))
+
+    def _ws_connect(self, clients):
+        sock = socket.create_connection(('127.0.0.1', self.bridge.ws_port), 5)
+        self.sockets.append(sock)
+        sock.sendall(b'GET /serial HTTP/1.1\r\nHost: m3-1\r\n'
+                     b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+                     b'Sec-WebSocket-Version: 13\r\n\r\n')
+        response = b''
+        while not response.endswith(b'\r\n\r\n'):
+            response += sock.recv(1)
+        self.assertIn(b' 101 ', response)
+        self.assertIn(b's3pPLMBiTxaQ9kYGzzhZRbK+xOo=', response)
+        self.assertTrue(_wait(lambda: len(self.bridge.clients) == clients))
+        return sock
+
+    @staticmethod
+    def _ws_frame(payload, opcode=websocket.BINARY):
+        mask = b'\x01\x02\x03\x04'
+        return (bytes([0x80 | opcode, 0x80 | len(payload)]) + mask +
+                websocket.unmask(payload, mask))
+
+    def test_websocket(self):
+        """ WebSocket clients share the serial port with TCP clients """
+        writer = self._ws_connect(1)
+        mirror = self._connect(2)
+        writer.sendall(self._ws_frame(b'hel') + self._ws_frame(b'lo\n'))
+        self.assertEqual(b'hello\n', self._read_tty(6))
+
+        os.write(self.master, b'node output\n')
+        self.assertEqual(b'\x82\x0cnode output\n', self._recv(writer, 14))
+        self.assertEqual(b'node output\n', self._recv(mirror, 12))
+
+        writer.sendall(self._ws_frame(b'ping', websocket.PING))
+        self.assertEqual(b'\x8a\x04ping', self._recv(writer, 6))
+
+        # Closed with a close frame, TCP mirror becomes writer
+        writer.sendall(self._ws_frame(b'\x03\xe8', websocket.CLOSE))
+        self.assertEqual(b'\x88\x02\x03\xe8', self._recv(writer, 4))
+        self.assertTrue(_wait(lambda: len(self.bridge.clients) == 1))
+        self.assertTrue(self.bridge.clients[0].writer)
+
+    def test_websocket_invalid(self):
+        """ Invalid handshake or frame closes the connection """
+        sock = socket.create_connection(('127.0.0.1', self.bridge.ws_port))
+        self.sockets.append(sock)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: m3-1\r\n\r\n')
+        answer = self._recv(sock, len(websocket.BAD_REQUEST))
+        self.assertEqual(websocket.BAD_REQUEST, answer)
+        self.assertEqual(b'', sock.recv(1))
+
+        client = self._ws_connect(1)
+        client.sendall(b'\x82\x05hello')  # not masked
+        self.assertEqual(b'', client.recv(1))
+        self.assertTrue(_wait(lambda: not self.bridge.clients))
+
+    @mock.patch('gateway_code.utils.serial_bridge.MAX_CLIENTS', 1)
+    def test_max_clients(self):
+        """ Clients above MAX_CLIENTS are refused """
+        self._connect(1)
+        refused = socket.create_connection(('127.0.0.1', self.bridge.port))
+        self.sockets.append(refused)
+        self.assertEqual(b'', refused.recv(1))
+        self.assertEqual(1, len(self.bridge.clients))
+
+    @mock.patch('gateway_code.utils.serial_bridge.CLIENT_BUFFER', 2 ** 16)
+    def test_slow_client(self):
+        """ Client not reading is dropped, others still receive data """
+        slow = socket.socket()
+        self.sockets.append(slow)
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+        slow.connect(('127.0.0.1', self.bridge.port))
+        self.assertTrue(_wait(lambda: len(self.bridge.clients) == 1))
+        reader = self._connect(2)
+        reader.setblocking(False)
+
+        chunk = b'x' * 4096
+        t_end = time.monotonic() + 10
+        while not self.bridge.dropped and time.monotonic() < t_end:
+            os.write(self.master, chunk)
+            try:
+                while reader.recv(65536):
+                    pass
+            except BlockingIOError:
+                pass
+        self.assertEqual(1, self.bridge.dropped)
+        self.assertTrue(_wait(lambda: len(self.bridge.clients) == 1))
+        self.assertTrue(self.bridge.clients[0].writer)
+
+    @mock.patch('gateway_code.utils.serial_bridge.LOGGER')
+    def test_tty_reopened(self, logger):
+        """ Serial port is opened again after an error """
+        client = self._connect(1)
+        with mock.patch('os.read', side_effect=OSError(5, 'EIO')):
+            os.write(self.master, b'lost')
+            self.assertTrue(_wait(lambda: logger.warning.called))
+        client.sendall(b'again\n')
+        self.assertEqual(b'again\n', self._read_tty(6))
+
+    def test_start_error(self):
+        """ Listening port already used """
+        other = serial_bridge.SerialBridge(self.tty, 500000, '127.0.0.1',
+                                           port=self.bridge.port)
+        self.assertEqual(1, other.start())
+        self.assertEqual(0, other.stop())
+        other = serial_bridge.SerialBridge(self.tty, 500000, '127.0.0.1',
+                                           port=0,
+                                           ws_port=self.bridge.ws_port)
+        self.assertEqual(1, other.start())
+        self.assertEqual(0, other.stop())
+        self.assertEqual(0, self.bridge.start())
+
+
+class TestSerialRedirectionBridge(unittest.TestCase):
+    """ SerialRedirection uses SerialBridge from config """
+
+    def test_config(self):
+        """ Bridge is used only if configured """
+        with mock.patch(utils.READ_CONFIG, utils.read_config_mock(
+                'm3', serial_redirection='bridge')):
+            redirect = SerialRedirection('/dev/null', 500000,
+                                         serial_opts=('crnl',))
+        self.assertIsInstance(redirect.bridge.translation,
+                              serial_bridge.CrnlTranslation)
+        self.assertIsNone(redirect.bridge.ws_address)
+        with mock.patch(utils.READ_CONFIG, utils.read_config_mock(
+                'm3', serial_redirection='bridge', serial_websocket='1')):
+            websocket_redirect = SerialRedirection('/dev/null', 500000)
+        self.assertEqual(('0.0.0.0', serial_bridge.WS_PORT),
+                         websocket_redirect.bridge.ws_address)
+        redirect.bridge = mock.Mock(capture=None)
+        redirect.bridge.start.return_value = 0
+        redirect.bridge.stop.return_value = 0
+        self.assertEqual(0, redirect.start())
+        self.assertEqual(0, redirect.stop())
+        self.assertFalse(redirect.is_alive())
+
+        with mock.patch(utils.READ_CONFIG, utils.read_config_mock('m3')):
+            self.assertIsNone(SerialRedirection('/dev/null', 500000).bridge)
+
+    @mock.patch('gateway_code.utils.serial_redirection.SerialCapture')
+    def test_capture_and_timestamps(self, capture_class):
+        """ Capture and timestamps are used only if configured """
+        with mock.patch(utils.READ_CONFIG, utils.read_config_mock(
+                'm3', serial_redirection='bridge')):
+            redirect = SerialRedirection('/dev/null', 500000)
+        redirect.bridge = mock.Mock(capture=None)
+        redirect.bridge.start.return_value = 0
+        redirect.bridge.stop.return_value = 0
+        capture = capture_class.return_value
+        capture.start.return_value = 0
+        capture.stop.return_value = 0
+
+        self.assertEqual(0, redirect.start())
+        self.assertIsNone(redirect.bridge.capture)
+        self.assertIsNone(redirect.bridge.timestamps)
+        self.assertEqual(0, redirect.stop())
+
+        redirect.timestamps = True
+        self.assertEqual(0, redirect.start())
+        self.assertIsInstance(redirect.bridge.timestamps,
+                              serial_bridge.LineTimestamps)
+        self.assertEqual(0, redirect.stop())
+
+        redirect.capture_path = 'm3-1.serial.log'
+        self.assertEqual(0, redirect.start())
+        capture_class.assert_called_once_with('m3-1.serial.log')
+        self.assertIs(capture, redirect.bridge.capture)
+        self.assertEqual(0, redirect.stop())
+        self.assertTrue(capture.stop.called)
+        self.assertIsNone(redirect.bridge.capture)
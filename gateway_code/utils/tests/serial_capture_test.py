@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test serial_capture module """
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from gateway_code.utils import serial_capture
+
+# pylint: disable=missing-docstring
+# pylint: disable=protected-access
+
+
+def _records(path):
+    """ Return (monotonic, utc, data) records of capture file `path` """
+    records = []
+    with open(path, 'rb') as capture:
+        content = capture.read()
+    while content:
+        header, content = content.split(b'\n', 1)
+        monotonic, utc, length = header.split()
+        length = int(length)
+        records.append((float(monotonic), float(utc), content[:length]))
+        assert content[length:length + 1] == b'\n'
+        content = content[length + 1:]
+    return records
+
+
+class TestSerialCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'm3-1.serial.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_capture(self):
+        """ Data records are written with timestamps """
+        capture = serial_capture.SerialCapture(self.path)
+        self.assertEqual(0, capture.start())
+        capture.add(b'hello\n')
+        capture.add(b'\x00\nbinary')
+        self.assertEqual(0, capture.stop())
+        self.assertEqual(0, capture.stop())
+
+        records = _records(self.path)
+        self.assertEqual([b'hello\n', b'\x00\nbinary'],
+                         [data for _, _, data in records])
+        self.assertLessEqual(records[0][0], records[1][0])
+        self.assertLessEqual(records[0][1], records[1][1])
+        self.assertEqual(0o666, os.stat(self.path).st_mode & 0o777)
+
+    def test_rotate_and_append(self):
+        """ Files are rotated by size, a restarted capture appends """
+        capture = serial_capture.SerialCapture(self.path, rotate_size=180)
+        capture._open()
+        for _ in range(3):
+            capture._write(serial_capture.record(b'x' * 100, 1.0, 2.0))
+        capture._close()
+        self.assertEqual(['m3-1.serial.1.log', 'm3-1.serial.2.log',
+                          'm3-1.serial.log'],
+                         sorted(os.listdir(self.directory)))
+
+        # Restarted capture appends to the last file
+        capture = serial_capture.SerialCapture(self.path, rotate_size=180)
+        capture.start()
+        capture.add(b'y')
+        capture.stop()
+        last = os.path.join(self.directory, 'm3-1.serial.2.log')
+        self.assertEqual([b'x' * 100, b'y'],
+                         [data for _, _, data in _records(last)])
+
+    @mock.patch('gateway_code.utils.serial_capture.BUFFER_SIZE', 100)
+    def test_buffer_full(self):
+        """ Records are dropped when the buffer is full """
+        capture = serial_capture.SerialCapture(self.path)
+        # Writer thread not started, records stay queued
+        capture.add(b'a' * 50)
+        capture.add(b'b' * 50)
+        self.assertEqual(50, capture.dropped)
+
+    def test_empty_and_error(self):
+        """ Empty capture file is removed, open error is reported """
+        capture = serial_capture.SerialCapture(self.path)
+        self.assertEqual(0, capture.start())
+        self.assertEqual(0, capture.stop())
+        self.assertFalse(os.path.exists(self.path))
+
+        capture = serial_capture.SerialCapture('/invalid/dir/capture.log')
+        self.assertEqual(1, capture.start())
+        self.assertEqual(0, capture.stop())
@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" test step_graph module """
+
+import time
+import threading
+import unittest
+
+import mock
+
+from ..step_graph import StepGraph
+
+# pylint: disable=missing-docstring
+
+
+class TestStepGraph(unittest.TestCase):
+
+    def test_independent_steps_concurrent(self):
+        """ Independent steps run at the same time """
+        barrier = threading.Barrier(3, timeout=5)
+        graph = StepGraph('test')
+        for name in ('a', 'b', 'c'):
+            graph.add(name, barrier.wait)
+
+        t_ref = time.monotonic()
+        self.assertEqual(0, graph.run())
+        self.assertGreater(5, time.monotonic() - t_ref)
+        self.assertFalse(barrier.broken)
+
+    def test_requirements_order(self):
+        """ Steps run after their requirements """
+        order = []
+        graph = StepGraph('test')
+        graph.add('a', lambda: time.sleep(0.2) or order.append('a'))
+        graph.add('b', order.append, 'b', requires=('a',))
+        graph.add('c', order.append, 'c')
+        graph.add('d', order.append, 'd', requires=('b', 'c'))
+
+        self.assertEqual(0, graph.run())
+        self.assertLess(order.index('a'), order.index('b'))
+        self.assertLess(order.index('b'), order.index('d'))
+        self.assertLess(order.index('c'), order.index('d'))
+
+    def test_failed_step_skips_dependents(self):
+        """ Steps requiring a failed step are skipped """
+        func = mock.Mock(return_value=0)
+        graph = StepGraph('test')
+        graph.add('fail', lambda: 1 / 0)
+        graph.add('dep', func, requires=('fail',))
+        graph.add('dep_dep', func, requires=('dep',))
+        graph.add('other', lambda: 2)
+
+        self.assertEqual(3, graph.run())
+        self.assertFalse(func.called)
+        self.assertIsInstance(graph.results['fail'].error, ZeroDivisionError)
+        self.assertTrue(graph.results['dep'].skipped)
+        self.assertTrue(graph.results['dep_dep'].skipped)
+        self.assertEqual(2, graph.ret_value())
+        self.assertRaises(ZeroDivisionError, graph.raise_error)
+
+        summary = graph.summary()
+        self.assertEqual(2, summary['other']['ret'])
+        self.assertIsNone(summary['other']['error'])
+        self.assertIn('ZeroDivisionError', summary['fail']['error'])
+        self.assertTrue(summary['dep']['skipped'])
+
+    def test_non_ret_values(self):
+        """ Only integer values are summed as return codes """
+        graph = StepGraph('test')
+        graph.add('bool', lambda: True)
+        graph.add('dict', dict)
+        graph.add('int', lambda: 1)
+        graph.run()
+        graph.raise_error()
+        self.assertEqual(1, graph.ret_value())
+        self.assertIsNone(graph.summary()['bool']['ret'])
+
+    def test_invalid_declarations(self):
+        graph = StepGraph('test')
+        graph.add('a', int)
+        self.assertRaises(AssertionError, graph.add, 'a', int)
+        self.assertRaises(AssertionError, graph.add, 'b', int,
+                          requires=('unknown',))
@@ -0,0 +1,137 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Test usb_inventory module """
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import mock
+
+from gateway_code.utils import usb_inventory
+
+DEVICES = {
+    '1-1': {'idVendor': '0403', 'idProduct': '6011',
+            'manufacturer': 'IoT-LAB', 'product': 'ControlNode'},
+    '1-1:1.0': {},  # interface
+    '1-2': {'idVendor': '0403', 'idProduct': '6010',
+            'manufacturer': 'IoT-LAB', 'product': 'M3', 'serial': 'A1'},
+    '1-3': {'idVendor': '0d28', 'idProduct': '0204',
+            'product': 'DAPLink CMSIS-DAP'},
+    '1-4': {'idVendor': '1d6b', 'idProduct': '0002', 'product': 'Hub'},
+}
+
+
+class TestUsbInventory(unittest.TestCase):
+    """ Test scan and UsbInventory """
+
+    def setUp(self):
+        self.sysfs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sysfs)
+        for entry, attrs in DEVICES.items():
+            self._add(entry, attrs)
+
+    def _add(self, entry, attrs):
+        """ Add a device in fake sysfs """
+        os.mkdir(os.path.join(self.sysfs, entry))
+        for attr, value in attrs.items():
+            with open(os.path.join(self.sysfs, entry, attr), 'w') as _file:
+                _file.write(value + '\n')
+
+    def test_scan(self):
+        """ Debug probes are found with their attributes """
+        devices = usb_inventory.scan(self.sysfs)
+        self.assertEqual(['1-1', '1-2', '1-3'],
+                         [dev['bus_id'] for dev in devices])
+        self.assertEqual(['ftdi', 'ftdi', 'cmsis-dap'],
+                         [dev['kind'] for dev in devices])
+        self.assertEqual('ControlNode', devices[0]['description'])
+        self.assertIsNone(devices[0]['serial'])
+        self.assertEqual('A1', devices[1]['serial'])
+
+        self.assertEqual([], usb_inventory.scan('/invalid/sysfs/path'))
+
+    def test_snapshot_ftdi_check(self):
+        """ ftdi_check from snapshot """
+        snapshot = usb_inventory.Snapshot(usb_inventory.scan(self.sysfs))
+        self.assertEqual(0, snapshot.ftdi_check('control', '4232'))
+        self.assertEqual(0, snapshot.ftdi_check('m3', '2232', 'M3'))
+        self.assertEqual(1, snapshot.ftdi_check('m3', '2232', 'A8'))
+        self.assertEqual(1, snapshot.ftdi_check('node', '232H'))
+
+    def test_inventory_polling(self):
+        """ Inventory without uevents refreshes every interval """
+        inventory = usb_inventory.UsbInventory(self.sysfs, interval=0.05)
+        self.assertIsNone(inventory.snapshot())
+
+        with mock.patch.object(inventory, '_uevent_socket',
+                               return_value=None):
+            inventory.start()
+            inventory.start()  # no effect
+        self.addCleanup(inventory.stop)
+        first = inventory.snapshot()
+        self.assertEqual(3, len(first.devices))
+
+        self._add('1-5', {'idVendor': '1366', 'idProduct': '0105'})
+        for _ in range(100):
+            if len(inventory.snapshot().devices) == 4:
+                break
+            inventory._stop.wait(0.01)  # pylint:disable=protected-access
+        self.assertEqual('jlink', inventory.snapshot().devices[-1]['kind'])
+        self.assertGreater(inventory.snapshot().timestamp, first.timestamp)
+
+        inventory.stop()
+        inventory.stop()
+        self.assertFalse(inventory.running)
+        self.assertIsNone(inventory.snapshot())
+
+    @mock.patch('gateway_code.utils.usb_inventory.EVENT_DEBOUNCE', 0.01)
+    def test_inventory_uevents(self):
+        """ USB uevents trigger a refresh """
+        inventory = usb_inventory.UsbInventory(self.sysfs, interval=60)
+        events, kernel = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(kernel.close)
+        with mock.patch.object(inventory, '_uevent_socket',
+                               return_value=events):
+            inventory.start()
+        self.addCleanup(inventory.stop)
+
+        self._add('1-5', {'idVendor': '0483', 'idProduct': '374b'})
+        kernel.send(b'add@/devices/pci0000:00\x00SUBSYSTEM=input\x00')
+        inventory._stop.wait(0.1)  # pylint:disable=protected-access
+        self.assertEqual(3, len(inventory.snapshot().devices))
+
+        kernel.send(b'add@/devices/pci0000:00/usb1/1-5\x00SUBSYSTEM=usb\x00')
+        for _ in range(100):
+            if len(inventory.snapshot().devices) == 4:
+                break
+            inventory._stop.wait(0.01)  # pylint:disable=protected-access
+        self.assertEqual('stlink', inventory.snapshot().devices[-1]['kind'])
+
+    def test_uevent_socket(self):
+        """ Netlink socket unavailable """
+        with mock.patch('socket.socket', side_effect=OSError()):
+            # pylint:disable=protected-access
+            self.assertIsNone(usb_inventory.UsbInventory._uevent_socket())
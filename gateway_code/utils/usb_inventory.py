@@ -0,0 +1,219 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Background inventory of the USB debug probes, read from sysfs
+
+FTDI, CMSIS-DAP, J-Link and ST-Link devices are listed from
+'/sys/bus/usb/devices' without opening them. The snapshot is refreshed
+periodically and on kernel USB uevents, and read without waiting.
+"""
+
+import os
+import time
+import socket
+import select
+import logging
+import threading
+
+LOGGER = logging.getLogger('gateway_code')
+
+SYSFS_USB = '/sys/bus/usb/devices'
+REFRESH_INTERVAL = 30.0
+# Wait for uevents burst to end before rescanning
+EVENT_DEBOUNCE = 0.5
+NETLINK_KOBJECT_UEVENT = 15
+
+FTDI_VENDOR = '0403'
+# 'ftdi-devices-list -t' types product ids
+FTDI_TYPES = {'232': '6001', '2232': '6010', '4232': '6011',
+              '232H': '6014', '230X': '6015'}
+JLINK_VENDOR = '1366'
+STLINK_VENDOR = '0483'
+STLINK_PRODUCTS = ('3744', '3748', '374a', '374b', '374d', '374e', '374f',
+                   '3752', '3753', '3754')
+
+
+def probe_kind(vendor, product, product_name):
+    """ Return debug probe kind or None
+
+    >>> probe_kind('0403', '6011', 'ControlNode')
+    'ftdi'
+    >>> probe_kind('0d28', '0204', 'DAPLink CMSIS-DAP')
+    'cmsis-dap'
+    >>> probe_kind('1366', '0105', 'J-Link')
+    'jlink'
+    >>> probe_kind('0483', '374b', 'STM32 STLink')
+    'stlink'
+    >>> probe_kind('1d6b', '0002', 'EHCI Host Controller') is None
+    True
+    """
+    if vendor == FTDI_VENDOR and product in FTDI_TYPES.values():
+        return 'ftdi'
+    if 'CMSIS-DAP' in (product_name or ''):
+        return 'cmsis-dap'
+    if vendor == JLINK_VENDOR:
+        return 'jlink'
+    if vendor == STLINK_VENDOR and product in STLINK_PRODUCTS:
+        return 'stlink'
+    return None
+
+
+def _read_attr(path, attr):
+    """ Read sysfs device attribute, None if missing """
+    try:
+        with open(os.path.join(path, attr), encoding='latin-1') as _file:
+            return _file.read().strip()
+    except OSError:
+        return None
+
+
+def scan(sysfs_usb=SYSFS_USB):
+    """ Return the list of debug probes found in `sysfs_usb` """
+    try:
+        entries = sorted(os.listdir(sysfs_usb))
+    except OSError:
+        return []
+
+    devices = []
+    for entry in entries:
+        path = os.path.join(sysfs_usb, entry)
+        vendor = _read_attr(path, 'idVendor')
+        if vendor is None:  # interfaces
+            continue
+        product = _read_attr(path, 'idProduct')
+        product_name = _read_attr(path, 'product')
+        kind = probe_kind(vendor, product, product_name)
+        if kind is None:
+            continue
+        devices.append({'kind': kind, 'bus_id': entry,
+                        'vendor': vendor, 'product': product,
+                        'manufacturer': _read_attr(path, 'manufacturer'),
+                        'description': product_name,
+                        'serial': _read_attr(path, 'serial')})
+    return devices
+
+
+class Snapshot:  # pylint:disable=too-few-public-methods
+    """ Devices found at `timestamp` """
+
+    def __init__(self, devices, timestamp=None):
+        self.devices = tuple(devices)
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def ftdi_check(self, node, ftdi_type, description=None):
+        """ Same as `ftdi_check.ftdi_check` from the snapshot """
+        product = FTDI_TYPES[ftdi_type]
+        found = any(dev['kind'] == 'ftdi' and dev['product'] == product and
+                    description in (None, dev['description'])
+                    for dev in self.devices)
+        LOGGER.debug('%s%s node ftdi found', '' if found else 'No ', node)
+        return 0 if found else 1
+
+    def as_dict(self):
+        """ Return snapshot as a json serializable dict """
+        return {'timestamp': self.timestamp, 'devices': list(self.devices)}
+
+
+class UsbInventory:
+    """ Keep a snapshot of the USB debug probes up to date """
+
+    def __init__(self, sysfs_usb=SYSFS_USB, interval=REFRESH_INTERVAL):
+        self.sysfs_usb = sysfs_usb
+        self.interval = interval
+        self._snapshot = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        """ Background refresh is running """
+        return self._thread is not None
+
+    def snapshot(self):
+        """ Return the last snapshot, None if not running """
+        return self._snapshot if self.running else None
+
+    def refresh(self):
+        """ Scan devices now and return the new snapshot """
+        self._snapshot = Snapshot(scan(self.sysfs_usb))
+        return self._snapshot
+
+    def start(self):
+        """ Take a first snapshot and start the background refresh """
+        if self.running:
+            return
+        self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='usb_inventory')
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the background refresh """
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    @staticmethod
+    def _uevent_socket():
+        """ Return socket receiving kernel uevents or None """
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                 NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1))  # kernel events group
+            return sock
+        except (OSError, AttributeError) as err:
+            LOGGER.warning('USB inventory: no uevents, polling: %r', err)
+            return None
+
+    def _wait_events(self, sock):
+        """ Wait `interval`, or the end of a USB uevents burst """
+        deadline = time.monotonic() + self.interval
+        while not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            # wake up regularly to check 'stop'
+            if not select.select([sock], [], [], min(remaining, 1.0))[0]:
+                continue
+            if b'SUBSYSTEM=usb' in sock.recv(8192):
+                deadline = time.monotonic() + EVENT_DEBOUNCE
+
+    def _run(self):
+        """ Refresh snapshot on uevents or every `interval` """
+        sock = self._uevent_socket()
+        try:
+            while not self._stop.is_set():
+                if sock is None:
+                    self._stop.wait(self.interval)
+                else:
+                    self._wait_events(sock)
+                if not self._stop.is_set():
+                    self.refresh()
+        finally:
+            if sock is not None:
+                sock.close()
+
+
+INVENTORY = UsbInventory()
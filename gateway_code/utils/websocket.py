@@ -0,0 +1,172 @@
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB gateway_code
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+""" Minimal WebSocket server protocol, RFC 6455
+
+Only what is needed to stream bytes: opening handshake, frames headers and
+client frames parsing. Messages are not reassembled, fragments payloads are
+used as they come.
+"""
+
+import base64
+import struct
+import hashlib
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+CONTINUATION = 0x0
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+BAD_REQUEST = b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n'
+
+
+def accept_key(key):
+    """ Return 'Sec-WebSocket-Accept' value for client `key`
+
+    >>> accept_key(b'dGhlIHNhbXBsZSBub25jZQ==')
+    b's3pPLMBiTxaQ9kYGzzhZRbK+xOo='
+    """
+    return base64.b64encode(hashlib.sha1(key + GUID).digest())
+
+
+def handshake_response(request):
+    """ Return the response to the HTTP `request` headers, without the
+    final empty line
+
+    :raises ValueError: not a WebSocket opening handshake
+
+    >>> handshake_response(b'GET /serial HTTP/1.1\\r\\nHost: m3-1\\r\\n'
+    ...                    b'Upgrade: websocket\\r\\nConnection: Upgrade\\r\\n'
+    ...                    b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\\r\\n'
+    ...                    b'Sec-WebSocket-Version: 13')[:34]
+    b'HTTP/1.1 101 Switching Protocols\\r\\n'
+    >>> handshake_response(b'GET / HTTP/1.1\\r\\nHost: m3-1')
+    Traceback (most recent call last):
+    ...
+    ValueError: Not a WebSocket handshake
+    """
+    lines = request.split(b'\r\n')
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(b':')
+        headers[name.strip().lower()] = value.strip()
+    if (not lines[0].startswith(b'GET ') or
+            headers.get(b'upgrade', b'').lower() != b'websocket' or
+            b'sec-websocket-key' not in headers):
+        raise ValueError('Not a WebSocket handshake')
+    return (b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' +
+            accept_key(headers[b'sec-websocket-key']) + b'\r\n\r\n')
+
+
+def frame_header(length, opcode=BINARY):
+    """ Return unfragmented server frame header for a `length` bytes payload
+
+    >>> frame_header(5), frame_header(200)
+    (b'\\x82\\x05', b'\\x82~\\x00\\xc8')
+    >>> len(frame_header(2 ** 16, CLOSE))
+    10
+    """
+    if length < 126:
+        return struct.pack('!BB', 0x80 | opcode, length)
+    if length < 2 ** 16:
+        return struct.pack('!BBH', 0x80 | opcode, 126, length)
+    return struct.pack('!BBQ', 0x80 | opcode, 127, length)
+
+
+def unmask(data, mask):
+    """ Return `data` XORed with the 4 bytes `mask`
+
+    >>> unmask(b'\\x7f\\x9f\\x4d\\x51\\x58', b'\\x37\\xfa\\x21\\x3d')
+    b'Hello'
+    """
+    length = len(data)
+    key = (mask * (length // 4 + 1))[:length]
+    value = int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')
+    return value.to_bytes(length, 'big')
+
+
+class FrameParser:  # pylint:disable=too-few-public-methods
+    """ Parse frames received from a client
+
+    >>> parser = FrameParser(1024)
+    >>> hello = b'\\x82\\x85\\x37\\xfa\\x21\\x3d\\x7f\\x9f\\x4d\\x51\\x58'
+    >>> parser.feed(hello[:4]), parser.feed(hello[4:] + b'\\x89\\x80abcd')
+    ([], [(2, b'Hello'), (9, b'')])
+    >>> parser.feed(b'\\x82\\x05Hello')
+    Traceback (most recent call last):
+    ...
+    ValueError: Client frame not masked
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._buff = bytearray()
+
+    def feed(self, data):
+        """ Return the list of (opcode, payload) frames completed by `data`
+
+        :raises ValueError: invalid frame """
+        self._buff += data
+        frames = []
+        frame = self._parse()
+        while frame is not None:
+            frames.append(frame)
+            frame = self._parse()
+        return frames
+
+    def _parse(self):
+        """ Return first frame, None if it is not complete """
+        buff = self._buff
+        if len(buff) < 2:
+            return None
+        length = buff[1] & 0x7F
+        offset = 2
+        if length == 126:
+            offset = 4
+        elif length == 127:
+            offset = 10
+        if len(buff) < offset:
+            return None
+        if offset == 4:
+            length = struct.unpack_from('!H', buff, 2)[0]
+        elif offset == 10:
+            length = struct.unpack_from('!Q', buff, 2)[0]
+
+        if not buff[1] & 0x80:
+            raise ValueError('Client frame not masked')
+        if length > self.max_size:
+            raise ValueError(f'Frame too large: {length}')
+        end = offset + 4 + length
+        if len(buff) < end:
+            return None
+        payload = unmask(bytes(buff[offset + 4:end]),
+                         bytes(buff[offset:offset + 4]))
+        opcode = buff[0] & 0x0F
+        del buff[:end]
+        return opcode, payload
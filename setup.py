@@ -79,6 +79,8 @@ INSTALL_REQUIRES += ['pyelftools']
 if sys.version_info[0] < 3:
     # Python3 backports of subprocess, support 'timeout' option
     INSTALL_REQUIRES += ['subprocess32']
+# 'rest_server.py --server waitress' backend
+EXTRAS_REQUIRE = {'waitress': ['waitress']}
 
 UDEV_RULES = glob('bin/rules.d/*.rules')
 
@@ -190,4 +192,5 @@ setup(name=PACKAGE,
           'post_install': simple_command(post_install),
           'udev_rules_install': simple_command(udev_rules),
       },
-      install_requires=INSTALL_REQUIRES)
+      install_requires=INSTALL_REQUIRES,
+      extras_require=EXTRAS_REQUIRE)
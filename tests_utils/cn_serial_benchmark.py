@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+# -*- coding:utf-8 -*-
+
+""" Control node serial interface readers benchmark
+
+Replace `control_node_serial_interface` by a script printing `--lines`
+measures as fast as possible, and measure the time and CPU used by each
+reader implementation to handle them, then answer a command sent after.
+
+Consumers:
+  * debug: measures are given to `measures_debug`, as in autotests
+  * none: nobody reads measures
+
+Run from the repository root, gateway_code must be importable:
+
+    PYTHONPATH=. python tests_utils/cn_serial_benchmark.py \\
+        --lines 200000 [--readers thread asyncio] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import stat
+import logging
+import argparse
+import tempfile
+
+# Nodes modules must be imported through gateway_code.nodes first
+import gateway_code.nodes  # noqa: F401  pylint:disable=unused-import
+from gateway_code.control_nodes.cn_iotlab import cn_interface
+
+MEASURE = (b'measures_debug: consumption_measure '
+           b'1378387028.906210 0.257343 3.216250 0.080003\n')
+
+FAKE_INTERFACE = f'''#! {sys.executable}
+import os
+import sys
+out = sys.stderr.buffer
+out.write(b'cn_serial_ready\\n')
+out.flush()
+lines = int(os.environ['BENCH_LINES'])
+for _ in range(lines // 1000):
+    out.write({MEASURE!r} * 1000)
+out.write({MEASURE!r} * (lines % 1000))
+out.flush()
+for cmd in sys.stdin.buffer:
+    out.write(cmd.split()[0] + b' ACK\\n')
+    out.flush()
+'''
+
+
+def fake_interface(directory):
+    """ Write fake control node serial interface script in `directory` """
+    path = os.path.join(directory, 'fake_cn_serial_interface')
+    with open(path, 'w') as script:
+        script.write(FAKE_INTERFACE)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    return path
+
+
+def run(reader, consumer, lines):
+    """ Handle `lines` measures with `reader` implementation """
+    received = []
+    cn_serial = cn_interface.READERS[reader]('tty')
+    if consumer == 'debug':
+        cn_serial.measures_debug = received.append
+
+    os.environ['BENCH_LINES'] = str(lines)
+    t_start = time.monotonic()
+    cpu_start = time.process_time()
+    try:
+        assert cn_serial.start() == 0
+        answer = cn_serial.send_command(['ping'], timeout=600)
+        elapsed = time.monotonic() - t_start
+        cpu = time.process_time() - cpu_start
+    finally:
+        cn_serial.stop()
+
+    assert answer == ['ping', 'ACK'], answer
+    assert consumer == 'none' or len(received) == lines, len(received)
+    return {'reader': reader, 'consumer': consumer, 'lines': lines,
+            'seconds': elapsed, 'lines_per_s': lines / elapsed,
+            'cpu_seconds': cpu}
+
+
+def parse_arguments(args):
+    """ Parse command line arguments """
+    description = __doc__.split('\n', maxsplit=1)[0]
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--lines', type=int, default=200000,
+                        help="Measures lines printed")
+    parser.add_argument('--readers', nargs='+',
+                        choices=sorted(cn_interface.READERS),
+                        default=sorted(cn_interface.READERS, reverse=True))
+    parser.add_argument('--consumers', nargs='+', choices=('debug', 'none'),
+                        default=('debug', 'none'))
+    parser.add_argument('--json', action='store_true',
+                        help="Print results as json")
+    return parser.parse_args(args)
+
+
+def main(args):
+    """ Run benchmark and print results """
+    opts = parse_arguments(args)
+    # Threaded reader logs an error when process is stopped
+    logging.getLogger('gateway_code').addHandler(logging.NullHandler())
+    with tempfile.TemporaryDirectory() as directory:
+        cn_interface.CONTROL_NODE_SERIAL_INTERFACE = fake_interface(directory)
+        results = [run(reader, consumer, opts.lines)
+                   for consumer in opts.consumers
+                   for reader in opts.readers]
+
+    if opts.json:
+        print(json.dumps({'results': results}, indent=2))
+        return
+
+    print(f'{"reader":8} {"consumer":8} {"lines":>9} {"seconds":>8} '
+          f'{"lines/s":>10} {"cpu s":>7}')
+    for res in results:
+        print(f'{res["reader"]:8} {res["consumer"]:8} {res["lines"]:9d} '
+              f'{res["seconds"]:8.2f} {res["lines_per_s"]:10.0f} '
+              f'{res["cpu_seconds"]:7.2f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+# -*- coding:utf-8 -*-
+
+""" REST server throughput benchmark
+
+Run the REST server with a mocked GatewayManager on a local port, using the
+given server backend options, and send requests to '/status',
+'/exp/update' and '/sleep/0' from concurrent clients.
+Reports requests/s and latency percentiles per route.
+
+Run from the repository root, gateway_code must be importable:
+
+    PYTHONPATH=. python tests_utils/rest_benchmark.py --server paste \\
+        --threads 10 --clients 8 --duration 10 [--keep-alive] [--json]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import http.client
+
+# Board config read from the test config directory
+os.environ.setdefault('IOTLAB_GATEWAY_CFG_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cfg_dir'))
+
+import bottle  # noqa: E402  pylint:disable=wrong-import-position
+from gateway_code import rest_server  # noqa: E402  pylint:disable=C0413
+
+PROFILE = json.dumps({'profilename': '_default_profile', 'power': 'dc'})
+ROUTES = {
+    'status': ('GET', '/status', None),
+    'exp_update': ('POST', '/exp/update', PROFILE),
+    'sleep': ('GET', '/sleep/0', None),
+}
+
+
+class MockGatewayManager:
+    """ GatewayManager answering immediately """
+
+    @staticmethod
+    def status():
+        """ Nodes are ok """
+        return 0
+
+    @staticmethod
+    def exp_update_profile(profile):  # pylint:disable=unused-argument
+        """ Profile updated """
+        return 0
+
+    @staticmethod
+    def sleep(seconds):
+        """ Sleep `seconds` """
+        time.sleep(seconds)
+        return 0
+
+
+def free_port():
+    """ Return an unused local TCP port """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(opts, port):
+    """ Run REST server in a daemon thread and wait it accepts requests """
+    app = rest_server.GatewayRest(MockGatewayManager(), opts.max_request_size)
+    options = rest_server.server_options(opts.server, opts.threads,
+                                         opts.timeout, opts.keep_alive)
+    if opts.server == 'paste':
+        # Let the process exit at the end
+        options['daemon_threads'] = True
+    options.update(app=app, host='127.0.0.1', port=port, server=opts.server,
+                   quiet=True)
+    thread = threading.Thread(target=bottle.run, kwargs=options, daemon=True)
+    thread.start()
+
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Server did not start')
+
+
+def client(port, route, deadline, keep_alive, results):
+    """ Send requests to `route` until `deadline`
+
+    :param results: (latencies, errors) lists to append results to """
+    latencies, errors = results
+    method, path, body = ROUTES[route]
+    headers = {'Content-Type': 'application/json'} if body else {}
+    conn = None
+    while time.monotonic() < deadline:
+        t_start = time.monotonic()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, 10)
+            conn.request(method, path, body, headers)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+            if resp.will_close or not keep_alive:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException) as err:
+            errors.append(repr(err))
+            conn = None
+            continue
+        latencies.append(time.monotonic() - t_start)
+    if conn is not None:
+        conn.close()
+
+
+def percentile(values, pct):
+    """ Return the `pct` percentile of sorted `values`
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    """
+    if not values:
+        return float('nan')
+    index = max(0, int(round(pct / 100.0 * len(values))) - 1)
+    return values[index]
+
+
+def run_route(opts, port, route):
+    """ Benchmark `route` with `opts.clients` concurrent clients """
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + opts.duration
+    clients = [threading.Thread(target=client, args=(
+        port, route, deadline, opts.keep_alive, (latencies, errors)))
+        for _ in range(opts.clients)]
+    t_start = time.monotonic()
+    for thr in clients:
+        thr.start()
+    for thr in clients:
+        thr.join()
+    elapsed = time.monotonic() - t_start
+
+    latencies.sort()
+    return {'route': route, 'requests': len(latencies),
+            'errors': len(errors), 'rps': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000}
+
+
+def parse_arguments(args):
+    """ Parse command line arguments """
+    description = __doc__.split('\n', maxsplit=1)[0]
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--server', choices=rest_server.SERVERS,
+                        default='paste')
+    parser.add_argument('--threads', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=None)
+    parser.add_argument('--keep-alive', dest='keep_alive',
+                        action='store_true')
+    parser.add_argument('--max-request-size', dest='max_request_size',
+                        type=int, default=None)
+    parser.add_argument('--clients', type=int, default=8,
+                        help="Concurrent clients")
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help="Duration per route in seconds")
+    parser.add_argument('--routes', nargs='+', choices=sorted(ROUTES),
+                        default=sorted(ROUTES))
+    parser.add_argument('--json', action='store_true',
+                        help="Print results as json")
+    return parser.parse_args(args)
+
+
+def main(args):
+    """ Run benchmark and print results """
+    opts = parse_arguments(args)
+    port = free_port()
+    start_server(opts, port)
+
+    results = [run_route(opts, port, route) for route in opts.routes]
+    if opts.json:
+        settings = {key: getattr(opts, key) for key in (
+            'server', 'threads', 'timeout', 'keep_alive', 'clients',
+            'duration')}
+        print(json.dumps({'settings': settings, 'results': results},
+                         indent=2))
+        return
+
+    print(f'{"route":12} {"requests":>9} {"errors":>7} {"req/s":>9} '
+          f'{"p50 ms":>8} {"p99 ms":>8}')
+    for res in results:
+        print(f'{res["route"]:12} {res["requests"]:9d} {res["errors"]:7d} '
+              f'{res["rps"]:9.1f} {res["p50_ms"]:8.2f} {res["p99_ms"]:8.2f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
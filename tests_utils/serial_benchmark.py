@@ -0,0 +1,341 @@
+#! /usr/bin/env python
+# -*- coding:utf-8 -*-
+
+""" Open node serial link throughput and latency benchmark
+
+A pseudo terminal pair stands in for the open node TTY: a fake node writes
+to its master side at the UART speed of `--baudrates`, 8N1, and the serial
+redirection engines read its slave side.
+
+For each engine and baudrate, measure:
+  * stream: bytes/s received by a TCP client while the node sends
+    continuously for `--duration`, and the ratio of bytes lost
+  * echo: the node echoes lines, round trip time percentiles and the ratio
+    of lost answers for each client implementation
+
+Engines:
+  * direct: clients open the TTY themselves, the reference
+  * socat: `SerialRedirection` socat process, socat must be installed
+  * bridge: `SerialRedirection` with the in process `SerialBridge`
+
+Clients:
+  * raw: pyserial, on the TTY or a 'socket://' url
+  * connection: `OpenNodeConnection` commands
+  * expect: `SerialExpect` and `SerialExpectForSocket`
+
+Redirection listens on the usual port 20000, do not run it on a gateway
+running experiments. Baudrate 0 sends as fast as possible.
+Run from the repository root, gateway_code must be importable:
+
+    PYTHONPATH=. python tests_utils/serial_benchmark.py \\
+        --engines bridge socat --baudrates 115200 500000 [--json]
+"""
+
+import os
+import re
+import sys
+import tty
+import json
+import time
+import select
+import logging
+import argparse
+import threading
+
+# Board config read from the test config directory
+os.environ.setdefault('IOTLAB_GATEWAY_CFG_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'cfg_dir'))
+
+# pylint:disable=wrong-import-position
+import serial  # noqa: E402
+from gateway_code.utils.serial_bridge import SerialBridge  # noqa: E402
+from gateway_code.utils.serial_redirection import (  # noqa: E402
+    SerialRedirection)
+from gateway_code.utils.node_connection import (  # noqa: E402
+    OpenNodeConnection)
+from gateway_code.utils.serial_expect import (  # noqa: E402
+    SerialExpect, SerialExpectForSocket)
+
+HOST = '127.0.0.1'
+PORT = 20000
+ENGINES = ('direct', 'socat', 'bridge')
+CLIENTS = ('raw', 'connection', 'expect')
+# Stream line, sequence number and padding
+LINE_SIZE = 64
+# Answer not received after TIMEOUT is lost
+TIMEOUT = 2.0
+
+
+class FakeNode:  # pylint:disable=too-many-instance-attributes
+    """ Node side of a pseudo terminal pair, writing at `baudrate` speed """
+
+    def __init__(self, baudrate):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        self.tty = os.ttyname(self.slave)
+        self.rate = baudrate / 10.0  # bytes/s, 8N1
+        self.sent = 0
+        self._next = 0.0
+        self._thread = None
+        self._run = False
+
+    def write(self, data):
+        """ Write `data`, waiting the time the UART would take """
+        os.write(self.master, data)
+        self.sent += len(data)
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self._next = max(self._next, now) + len(data) / self.rate
+        if self._next > now:
+            time.sleep(self._next - now)
+
+    def stream(self, duration):
+        """ Send numbered lines during `duration` in a thread """
+        self._start(self._stream, duration)
+
+    def echo(self):
+        """ Echo received data in a thread """
+        self._start(self._echo)
+
+    def _start(self, target, *args):
+        self.sent = 0
+        self._run = True
+        self._thread = threading.Thread(target=target, args=args,
+                                        daemon=True)
+        self._thread.start()
+
+    def is_running(self):
+        """ Stream or echo thread is running """
+        return self._thread is not None and self._thread.is_alive()
+
+    def wait(self):
+        """ Wait stream or echo thread end """
+        self._run = False
+        self._thread.join()
+
+    def _stream(self, duration):
+        # 10ms of data per write, 4kB without speed limit
+        lines = max(1, int(self.rate / 100 / LINE_SIZE)) if self.rate else 64
+        padding = b'x' * (LINE_SIZE - 10)
+        t_end = time.monotonic() + duration
+        num = 0
+        while self._run and time.monotonic() < t_end:
+            chunk = b''.join(b'%08d %b\n' % (num + i, padding)
+                             for i in range(lines))
+            num += lines
+            self.write(chunk)
+        self._run = False
+
+    def _echo(self):
+        while self._run:
+            if not select.select([self.master], [], [], 0.1)[0]:
+                continue
+            self.write(os.read(self.master, 4096))
+
+    def close(self):
+        """ Close pseudo terminal """
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def start_engine(engine, node_tty, baudrate):
+    """ Return started `engine` redirection, None for 'direct' """
+    if engine == 'direct':
+        return None
+    redirection = SerialRedirection(node_tty, baudrate, HOST)
+    redirection.bridge = None
+    if engine == 'bridge':
+        redirection.bridge = SerialBridge(node_tty, baudrate, HOST, PORT)
+    # Clients retry connecting while socat starts
+    if redirection.start():
+        raise RuntimeError(f'{engine} start failed')
+    return redirection
+
+
+def raw_client(engine, node_tty, baudrate):
+    """ Return a pyserial client for `engine` """
+    url = node_tty if engine == 'direct' else f'socket://{HOST}:{PORT}'
+    return SerialExpectForSocket.try_connect(url, baudrate=baudrate,
+                                             timeout=0.1)
+
+
+def run_stream(engine, node, baudrate, duration):
+    """ Receive node stream with a raw client """
+    client = raw_client(engine, node.tty, baudrate)
+    received = 0
+    t_last = t_start = time.monotonic()
+    node.stream(duration)
+    try:
+        # Data may still arrive after the node stopped sending
+        while node.is_running() or time.monotonic() - t_last < TIMEOUT:
+            try:
+                data = client.read(2 ** 16)
+            except serial.SerialException:
+                break  # disconnected by the redirection
+            if data:
+                received += len(data)
+                t_last = time.monotonic()
+    finally:
+        node.wait()
+        client.close()
+    elapsed = t_last - t_start
+    return {'test': 'stream', 'client': 'raw', 'bytes': received,
+            'bytes_per_s': received / elapsed if elapsed else 0.0,
+            'drop_rate': 1.0 - received / node.sent if node.sent else 0.0}
+
+
+class EchoClient:
+    """ Send lines and wait their echo with a `client` implementation """
+
+    def __init__(self, client, engine, node_tty, baudrate):
+        self.client = client
+        self._buff = b''
+        if client == 'raw':
+            self.conn = raw_client(engine, node_tty, baudrate)
+        elif client == 'connection':
+            self.conn = OpenNodeConnection(HOST, PORT, timeout=TIMEOUT)
+            if self.conn.start():
+                raise RuntimeError('OpenNodeConnection start failed')
+        elif engine == 'direct':
+            self.conn = SerialExpect(node_tty, baudrate)
+        else:
+            self.conn = SerialExpectForSocket(HOST, PORT)
+
+    def echo(self, line):
+        """ Send `line`, return True if echoed before TIMEOUT """
+        if self.client == 'raw':
+            return self._raw_echo(line.encode() + b'\n')
+        if self.client == 'connection':
+            return self.conn.send_command(line.split()) == line.split()
+        self.conn.send(line)
+        return bool(self.conn.expect(re.escape(line), timeout=TIMEOUT))
+
+    def _raw_echo(self, line):
+        self.conn.write(line)
+        t_end = time.monotonic() + TIMEOUT
+        while time.monotonic() < t_end:
+            self._buff += self.conn.read(len(line))
+            index = self._buff.find(line)
+            if index != -1:
+                self._buff = self._buff[index + len(line):]
+                return True
+        return False
+
+    def close(self):
+        """ Close client """
+        if self.client == 'connection':
+            self.conn.fd.close()  # stop() waits a socat restart
+        else:
+            self.conn.close()
+
+
+def run_echo(client, engine, node, baudrate, count):
+    """ Measure `count` echo lines round trip time """
+    conn = EchoClient(client, engine, node.tty, baudrate)
+    node.echo()
+    rtts = []
+    try:
+        for num in range(count):
+            t_start = time.monotonic()
+            if conn.echo(f'ping {num:06d}'):
+                rtts.append(time.monotonic() - t_start)
+    finally:
+        node.wait()
+        conn.close()
+
+    rtts.sort()
+    return {'test': 'echo', 'client': client, 'lines': count,
+            'drop_rate': 1.0 - len(rtts) / count,
+            'p50_ms': percentile(rtts, 50) * 1000,
+            'p90_ms': percentile(rtts, 90) * 1000,
+            'p99_ms': percentile(rtts, 99) * 1000}
+
+
+def percentile(values, pct):
+    """ Return the `pct` percentile of sorted `values`
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    """
+    if not values:
+        return float('nan')
+    index = max(0, int(round(pct / 100.0 * len(values))) - 1)
+    return values[index]
+
+
+def run(engine, baudrate, opts):
+    """ Run stream and echo tests through `engine` at `baudrate` """
+    node = FakeNode(baudrate)
+    redirection = start_engine(engine, node.tty, baudrate)
+    results = []
+    try:
+        results.append(run_stream(engine, node, baudrate, opts.duration))
+        for client in opts.clients:
+            if client == 'connection' and engine == 'direct':
+                continue  # TCP only
+            results.append(run_echo(client, engine, node, baudrate,
+                                    opts.lines))
+    finally:
+        if redirection is not None:
+            redirection.stop()
+        node.close()
+    for res in results:
+        res.update(engine=engine, baudrate=baudrate)
+    return results
+
+
+def parse_arguments(args):
+    """ Parse command line arguments """
+    description = __doc__.split('\n', maxsplit=1)[0]
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--engines', nargs='+', choices=ENGINES,
+                        default=('direct', 'bridge'))
+    parser.add_argument('--baudrates', nargs='+', type=int,
+                        default=(115200, 500000))
+    parser.add_argument('--clients', nargs='+', choices=CLIENTS,
+                        default=CLIENTS)
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help="Stream duration in seconds")
+    parser.add_argument('--lines', type=int, default=200,
+                        help="Echo lines per client")
+    parser.add_argument('--json', action='store_true',
+                        help="Print results as json")
+    return parser.parse_args(args)
+
+
+def main(args):
+    """ Run benchmark and print results """
+    opts = parse_arguments(args)
+    # Redirection logs clients disconnections and socat restarts
+    logging.getLogger('gateway_code').addHandler(logging.NullHandler())
+    results = [res for engine in opts.engines
+               for baudrate in opts.baudrates
+               for res in run(engine, baudrate, opts)]
+
+    if opts.json:
+        settings = {key: getattr(opts, key) for key in (
+            'engines', 'baudrates', 'clients', 'duration', 'lines')}
+        print(json.dumps({'settings': settings, 'results': results},
+                         indent=2))
+        return
+
+    print(f'{"engine":7} {"baud":>7} {"test":7} {"client":10} '
+          f'{"bytes/s":>9} {"drop %":>7} {"p50 ms":>8} {"p90 ms":>8} '
+          f'{"p99 ms":>8}')
+    for res in results:
+        line = (f'{res["engine"]:7} {res["baudrate"]:7d} {res["test"]:7} '
+                f'{res["client"]:10} ')
+        if res['test'] == 'stream':
+            line += f'{res["bytes_per_s"]:9.0f} {res["drop_rate"] * 100:7.2f}'
+        else:
+            line += (f'{"":9} {res["drop_rate"] * 100:7.2f} '
+                     f'{res["p50_ms"]:8.2f} {res["p90_ms"]:8.2f} '
+                     f'{res["p99_ms"]:8.2f}')
+        print(line)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])